@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+import kpi_calculation as kpi  # package
+import parallel  # package
+import tuning  # package
+from baseline import BaselineModel
+from serving import FEATURE_COLUMNS, PriceModel
+
+PRED_NAMES = ["ML FORECAST", "BASELINE"]
+LAST_YEAR_COL = "median_PRICE_CATEGORY_SPACE_binned_last_YEAR"
+
+
+def rolling_origins(dates, first_origin, last_origin=None, step="7D", horizon="7D", window=None):
+    """
+    Folds of a rolling-origin back-test
+
+    Fold i is trained on the dates up to its origin (all history for an expanding window, the
+    last window before the origin for a sliding one) and tested on the dates in (origin, origin + horizon].
+
+    Args:
+        dates (array): dates of the data
+        first_origin (str): last training date of the first fold, format 'YYYY-MM-DD'
+        last_origin (str): last origin, the last one with a full horizon if None
+        step (str): time between origins, e.g. "7D"
+        horizon (str): test period after the origin
+        window (str): length of a sliding training window, expanding window if None
+
+    Returns:
+        DataFrame with fold, train_from, train_upto, test_from, test_upto
+    """
+    dates = pd.to_datetime(pd.Series(dates))
+    horizon = pd.Timedelta(horizon)
+    last_origin = dates.max() - horizon if last_origin is None else pd.Timestamp(last_origin)
+    origins = pd.date_range(first_origin, last_origin, freq=step)
+    if window is None:
+        train_from = pd.DatetimeIndex([dates.min()] * len(origins))
+    else:
+        train_from = origins - pd.Timedelta(window) + pd.Timedelta("1D")
+    return pd.DataFrame(
+        {
+            "fold": np.arange(len(origins)),
+            "train_from": train_from,
+            "train_upto": origins,
+            "test_from": origins + pd.Timedelta("1D"),
+            "test_upto": origins + horizon,
+        }
+    )
+
+
+def backtest(
+    df,
+    folds,
+    target_col="PRICE",
+    date_col="DATE",
+    median_col="median_PRICE_CATEGORY_SPACE_binned_DATE",
+    params=None,
+    n_jobs=1,
+):
+    """
+    Train and evaluate the price model and the baseline on every fold of rolling_origins
+
+    The features (enrich_day calendar and last year medians, see serving.PriceModel) are computed
+    once for the full timeline and every fold gets its rows by position. Only the baseline table
+    and the regressor depend on the training period and are fitted per fold, folds run on a
+    process pool. The last year median of a test row is only used if that (ISO) year was complete
+    at the origin, so test periods after a year end do not see data after the origin (origins on
+    the last day of a year, e.g. Sundays for weekly folds, keep it).
+
+    Args:
+        df (DataFrame): cleaned data (forecasting_cleaned.csv)
+        folds (DataFrame): folds of rolling_origins
+        target_col (str): column to forecast
+        date_col (str): column with dates
+        median_col (str): column with median prices per category, space bin and date
+        params (dict): XGBRegressor parameters (e.g. tuning.best_params)
+        n_jobs (int): number of processes, -1 for all cores
+
+    Returns:
+        DataFrame with the test rows of all folds: fold, origin, date_col, CATEGORIES, SPACE,
+        target_col, FEATURE_COLUMNS and the PRED_NAMES columns
+    """
+    X = PriceModel.from_data(df, date_col=date_col, median_col=median_col).features_frame(df, date_col)
+    df_features = pd.DataFrame(X, columns=FEATURE_COLUMNS)
+    for col in [date_col, "CATEGORIES", median_col, target_col]:
+        df_features[col] = df[col].to_numpy()
+
+    order = np.argsort(df_features[date_col].to_numpy(), kind="stable")
+    dates = df_features[date_col].to_numpy()[order]
+    starts = np.searchsorted(dates, folds["train_from"].to_numpy(), "left")
+    ends = np.searchsorted(dates, folds["test_upto"].to_numpy(), "right")
+    slice_rows = [order[start:end] for start, end in zip(starts, ends)]
+    results = parallel.map_slices(
+        _run_fold,
+        df_features,
+        slice_rows,
+        n_jobs=n_jobs,
+        slice_kwargs=[{"fold": fold.fold, "origin": fold.train_upto} for fold in folds.itertuples()],
+        target_col=target_col,
+        date_col=date_col,
+        median_col=median_col,
+        params=params or {},
+    )
+    return pd.concat(results, ignore_index=True)
+
+
+def _run_fold(df_fold, fold, origin, target_col, date_col, median_col, params):
+    """
+    Fit the regressor and the baseline on the rows up to origin and predict the rows after it
+    """
+    train = (df_fold[date_col] <= origin).to_numpy()
+    regressor = xgb.XGBRegressor(**tuning.BASE_PARAMS, **params)
+    regressor.fit(df_fold.loc[train, FEATURE_COLUMNS].to_numpy(), df_fold.loc[train, target_col].to_numpy())
+    baseline = BaselineModel().fit(df_fold[train], target_col=median_col, date_col=date_col)
+
+    df_test = df_fold[~train].copy()
+    X_test = df_test[FEATURE_COLUMNS].to_numpy()
+    origin_year = origin.isocalendar()[0]
+    # the year of the origin is complete if the origin is its last day
+    last_complete_year = origin_year - int((origin + pd.Timedelta("1D")).isocalendar()[0] == origin_year)
+    X_test[(df_test["YEAR"] - 1 > last_complete_year).to_numpy(), FEATURE_COLUMNS.index(LAST_YEAR_COL)] = np.nan
+    df_test["ML FORECAST"] = regressor.predict(X_test)
+    df_test["BASELINE"] = baseline.predict_frame(df_test)
+    df_test.insert(0, "origin", origin)
+    df_test.insert(0, "fold", fold)
+    return df_test
+
+
+def backtest_report(df_pred, granularity_list=["WEEK", "CATEGORIES"], target_col="PRICE", pred_names=PRED_NAMES):
+    """
+    KPIs per fold and over all folds with the metric definitions of kpi_calculation
+
+    Actuals and predictions are summed to granularity_list per fold first, as in KPI_per_agg_var_df.
+
+    Returns:
+        DataFrame with the KPI_COLUMNS, fc_name and fold ("Total" for all folds)
+    """
+    groupvars = list(dict.fromkeys(["fold"] + list(granularity_list)))
+    df_agg = df_pred.groupby(groupvars, observed=True)[[target_col] + pred_names].sum().reset_index()
+    n_products = df_pred.groupby("fold")["CATEGORIES"].nunique()
+    df_folds = kpi.get_metrics_grouped(
+        df_agg, group_col="fold", pred_name=pred_names, target_name=target_col, n_products=n_products
+    )
+    df_total = kpi.get_metrics_grouped(
+        df_agg.assign(fold="Total"),
+        group_col="fold",
+        pred_name=pred_names,
+        target_name=target_col,
+        n_products=pd.Series({"Total": df_pred["CATEGORIES"].nunique()}),
+    )
+    return pd.concat([df_folds, df_total], ignore_index=True)
@@ -0,0 +1,183 @@
+import bisect
+
+import numpy as np
+import pandas as pd
+
+from cleaning import SPACE_BINS
+from quantile_sketch import DEFAULT_ALPHA, GroupedQuantileSketch
+
+# batches with less rows are looked up with python dicts, pandas' overhead is higher for them
+SMALL_BATCH = 1000
+
+
+class BaselineModel:
+    """
+    Baseline price forecast: median of median_PRICE_CATEGORY_SPACE_binned_DATE per category and space bin
+
+    The medians are stored in a dense table (category code x space bin), so predictions are a
+    hash lookup of the category plus a binary search of SPACE in the bin edges, without merges.
+
+    Example:
+        baseline = BaselineModel().fit(df, date_upto="2020-12-31")
+        df["BASELINE"] = baseline.predict_frame(df)
+        baseline.predict_one("APARTMENT, FLAT", 72.0)
+
+        # approximate medians from chunks, see quantile_sketch.GroupedQuantileSketch
+        sketch = baseline.sketch(chunk_1).merge(baseline.sketch(chunk_2))
+        baseline.fit_sketch(sketch)
+    """
+
+    def __init__(self, bins=SPACE_BINS):
+        """
+        Args:
+            bins (list): edges of the space bins, bins are closed on the right like pd.cut
+        """
+        self.bins = np.asarray(bins, dtype=np.float64)
+        self.categories = pd.Index([], dtype=object)
+        self.table = np.zeros((0, len(self.bins) - 1))
+        self._init_lookup()
+
+    def _init_lookup(self):
+        # plain python containers for predict_one, numpy scalars are slower for single values
+        self._category_codes = {cat: code for code, cat in enumerate(self.categories)}
+        self._bins_list = self.bins.tolist()
+        self._table_list = self.table.tolist()
+
+    def space_bin(self, space):
+        """
+        Index of the space bin for every value of space, -1 outside of the bins
+        """
+        idx = np.searchsorted(self.bins, np.asarray(space, dtype=np.float64), side="left") - 1
+        return np.where((idx >= 0) & (idx < len(self.bins) - 1), idx, -1)
+
+    def fit(
+        self,
+        df,
+        date_upto=None,
+        target_col="median_PRICE_CATEGORY_SPACE_binned_DATE",
+        category_col="CATEGORIES",
+        space_col="SPACE",
+        date_col="DATE",
+        alpha=None,
+    ):
+        """
+        Compute the median table
+
+        Args:
+            df (DataFrame): training data
+            date_upto (str): last date used for training, format 'YYYY-MM-DD', all data if None
+            target_col (str): column to take the median of
+            category_col (str): column with categories
+            space_col (str): column with space
+            date_col (str): column with dates
+            alpha (float): relative accuracy of approximate medians from a quantile sketch, exact medians if None
+        """
+        if alpha is not None:
+            return self.fit_sketch(
+                self.sketch(df, date_upto, target_col, category_col, space_col, date_col, alpha=alpha)
+            )
+        if date_upto is not None:
+            df = df[df[date_col] <= date_upto]
+        codes, categories = pd.factorize(df[category_col], sort=True)
+        bin_idx = self.space_bin(df[space_col].to_numpy())
+        target = df[target_col].to_numpy(dtype=np.float64)
+        valid = (codes >= 0) & (bin_idx >= 0)
+
+        medians = pd.Series(target[valid]).groupby([codes[valid], bin_idx[valid]]).median()
+        self._set_table(categories, medians.index.get_level_values(0), medians.index.get_level_values(1), medians)
+        return self
+
+    def sketch(
+        self,
+        df,
+        date_upto=None,
+        target_col="median_PRICE_CATEGORY_SPACE_binned_DATE",
+        category_col="CATEGORIES",
+        space_col="SPACE",
+        date_col="DATE",
+        alpha=DEFAULT_ALPHA,
+    ):
+        """
+        Quantile sketch of target_col per category and space bin index, mergeable across chunks
+
+        Args as in fit
+        """
+        if date_upto is not None:
+            df = df[df[date_col] <= date_upto]
+        df_keys = pd.DataFrame(
+            {
+                "CATEGORIES": df[category_col].to_numpy(),
+                "SPACE_BIN": self.space_bin(df[space_col].to_numpy()),
+                "target": df[target_col].to_numpy(dtype=np.float64),
+            }
+        )
+        df_keys = df_keys[df_keys["CATEGORIES"].notna() & (df_keys["SPACE_BIN"] >= 0)]
+        return GroupedQuantileSketch(["CATEGORIES", "SPACE_BIN"], alpha=alpha).update(df_keys, "target")
+
+    def fit_sketch(self, sketch):
+        """
+        Compute the median table from a sketch made by the sketch method
+        """
+        medians = sketch.median()
+        codes, categories = pd.factorize(medians.index.get_level_values(0), sort=True)
+        self._set_table(categories, codes, medians.index.get_level_values(1), medians)
+        return self
+
+    def _set_table(self, categories, codes, bin_idx, medians):
+        self.categories = pd.Index(categories)
+        self.table = np.full((len(categories), len(self.bins) - 1), np.nan)
+        self.table[codes, bin_idx] = medians.to_numpy()
+        self._init_lookup()
+
+    def category_codes(self, categories):
+        """
+        Row of the table for every category, -1 for unknown categories
+        """
+        if len(categories) < SMALL_BATCH:
+            return np.array([self._category_codes.get(cat, -1) for cat in categories], dtype=np.intp)
+        return self.categories.get_indexer(pd.Index(categories))
+
+    def predict(self, categories, space):
+        """
+        Baseline for arrays of categories and spaces, NaN for unknown categories or spaces outside of the bins
+        """
+        codes = self.category_codes(categories)
+        bin_idx = self.space_bin(space)
+        valid = (codes >= 0) & (bin_idx >= 0)
+        pred = np.full(len(codes), np.nan)
+        pred[valid] = self.table[codes[valid], bin_idx[valid]]
+        return pred
+
+    def predict_frame(self, df, category_col="CATEGORIES", space_col="SPACE"):
+        """
+        Baseline for every row of df
+        """
+        return self.predict(df[category_col], df[space_col].to_numpy())
+
+    def predict_one(self, category, space):
+        """
+        Baseline for a single request
+        """
+        code = self._category_codes.get(category)
+        idx = bisect.bisect_left(self._bins_list, space)
+        if code is None or idx < 1 or idx >= len(self._bins_list):
+            return float("nan")
+        return self._table_list[code][idx - 1]
+
+    def save(self, path):
+        """
+        Store the table as npz
+        """
+        np.savez(path, bins=self.bins, categories=np.asarray(self.categories, dtype=str), table=self.table)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a table stored with save
+        """
+        data = np.load(path)
+        model = cls(bins=data["bins"])
+        model.categories = pd.Index(data["categories"].tolist(), dtype=object)
+        model.table = data["table"]
+        model._init_lookup()
+        return model
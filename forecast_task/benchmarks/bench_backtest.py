@@ -0,0 +1,61 @@
+"""
+Rolling-origin back-test (backtest.backtest) against refitting serving.PriceModel with its features per fold
+
+Usage (from forecast_task):
+    python benchmarks/bench_backtest.py --first-origin 2021-01-03 --step 7D --horizon 7D --n-jobs -1
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import backtest as bt  # noqa: E402
+from serving import PriceModel  # noqa: E402
+
+
+def refit_per_fold(df, folds, params):
+    """
+    Back-test with features, tables and model built from scratch for every fold
+    """
+    predictions = []
+    for fold in folds.itertuples():
+        df_fold = df[(df["DATE"] >= fold.train_from) & (df["DATE"] <= fold.test_upto)]
+        model = PriceModel.fit(df_fold, date_upto=fold.train_upto, **params)
+        df_test = df_fold[df_fold["DATE"] > fold.train_upto]
+        pred = model.predict(df_test["DATE"].to_numpy(), df_test["SPACE"].to_numpy(), df_test["CATEGORIES"].to_numpy())
+        predictions.append(pred["ML FORECAST"])
+    return np.concatenate(predictions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="forecasting_cleaned.csv")
+    parser.add_argument("--first-origin", default="2021-01-03")
+    parser.add_argument("--step", default="7D")
+    parser.add_argument("--horizon", default="7D")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--n-jobs", type=int, default=1)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data, parse_dates=["DATE"])
+    folds = bt.rolling_origins(df["DATE"], args.first_origin, step=args.step, horizon=args.horizon)
+    params = {"n_estimators": args.n_estimators}
+    print(f"{len(folds)} folds, {len(df)} rows")
+
+    start = time.perf_counter()
+    refit_per_fold(df, folds, params)
+    t_refit = time.perf_counter() - start
+    start = time.perf_counter()
+    df_pred = bt.backtest(df, folds, params=params, n_jobs=args.n_jobs)
+    t_backtest = time.perf_counter() - start
+    print(f"refit per fold {t_refit:8.1f} s   backtest {t_backtest:8.1f} s   x{t_refit / t_backtest:.1f}")
+    print(bt.backtest_report(df_pred).tail(len(bt.PRED_NAMES)).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Cold and warm calls of KPI_per_agg_var_df and plot_weekly_per_agg / plot_daily_per_agg with a caching.ResultCache
+
+The warm calls only change the formatting (limit, label, limit_n_plots, title_text), so they are
+answered from the cache and only the KPI table is filtered or the charts are rebuilt.
+
+Usage (from forecast_task):
+    python benchmarks/bench_caching.py --rows 2000000 --categories 200 --cache-dir .cache/results
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import altair as alt  # noqa: E402
+
+import caching  # noqa: E402
+import kpi_calculation as kpi  # noqa: E402
+import timeseries_plots as tsp  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--categorical", action="store_true", help="categorical instead of string columns")
+    parser.add_argument("--cache-dir", default=None, help="directory of the disk cache, memory only if not given")
+    args = parser.parse_args()
+
+    df = make_forecasting_frame(args.rows, n_categories=args.categories, categorical=args.categorical)
+    # charts are built but not rendered
+    alt.TopLevelMixin.display = lambda self: None
+    cache = caching.ResultCache(directory=args.cache_dir)
+
+    kpi_args = dict(
+        var="CATEGORIES",
+        target_name="PRICE",
+        pred_name="ML FORECAST",
+        pred_name_comp="BASELINE",
+        granularity_list=["SPACE_binned", "CATEGORIES"],
+        pred_from="2019-01-01",
+        pred_upto="2021-12-31",
+        product_col="SPACE_binned",
+    )
+    plot_args = dict(
+        actuals_col="PRICE",
+        var_cols=["BASELINE", "ML FORECAST"],
+        agg_col="CATEGORIES",
+        agg="sum",
+        date_from="2021-01-01",
+        date_upto="2021-12-31",
+    )
+    print(f"{args.rows} rows, {args.categories} categories")
+    print(f"{'call':<22} {'uncached s':>10} {'cold s':>8} {'warm ms':>8}")
+    calls = [
+        ("KPI_per_agg_var_df", kpi.KPI_per_agg_var_df, [dict(limit=10, **kpi_args), dict(limit=20, **kpi_args)]),
+        (
+            "plot_weekly_per_agg",
+            tsp.plot_weekly_per_agg,
+            [dict(limit_n_plots=4, title_text="a", **plot_args), dict(limit_n_plots=6, title_text="b", **plot_args)],
+        ),
+        (
+            "plot_daily_per_agg",
+            tsp.plot_daily_per_agg,
+            [dict(limit_n_plots=4, title_text="a", **plot_args), dict(limit_n_plots=6, title_text="b", **plot_args)],
+        ),
+    ]
+    for name, func, (first, second) in calls:
+        uncached = timed(func, df, **first, **({"batch": True} if name != "KPI_per_agg_var_df" else {}))
+        cold = timed(func, df, **first, cache=cache)
+        warm = timed(func, df, **second, cache=cache)
+        print(f"{name:<22} {uncached:>10.2f} {cold:>8.2f} {warm * 1e3:>8.1f}")
+    start = time.perf_counter()
+    caching.fingerprint(df, ["CATEGORIES", "PRICE", "ML FORECAST", "BASELINE", "SPACE_binned", "C_DATE"])
+    print(f"fingerprint of the KPI columns: {(time.perf_counter() - start) * 1e3:.1f} ms")
+    print(cache.info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Build time and output size of timeseries_plots.plot_weekly_per_agg / plot_daily_per_agg: per-slice
+aggregation against batch (one aggregation for all slices) and faceted charts, each with embedded
+data and with one shared, downsampled data file
+
+Usage (from forecast_task):
+    python benchmarks/bench_chart_data.py --rows 1000000 --categories 50 --max-points 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import altair as alt  # noqa: E402
+
+import timeseries_plots as tsp  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def spec_bytes(plot_func, df, **kwargs):
+    """
+    Build time (s) and total size of the chart specs (bytes) displayed by plot_func
+    """
+    specs = []
+    display = alt.TopLevelMixin.display
+    alt.TopLevelMixin.display = lambda chart, *args, **kw: specs.append(json.dumps(chart.to_dict()))
+    try:
+        start = time.perf_counter()
+        plot_func(df.copy(), **kwargs)
+        seconds = time.perf_counter() - start
+    finally:
+        alt.TopLevelMixin.display = display
+    return seconds, sum(len(spec) for spec in specs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--max-points", type=int, default=200)
+    args = parser.parse_args()
+
+    df = make_forecasting_frame(args.rows, n_categories=args.categories)
+    common = {
+        "actuals_col": "PRICE",
+        "var_cols": ["BASELINE", "ML FORECAST"],
+        "agg_col": "CATEGORIES",
+        "limit_n_plots": args.categories,
+        "date_from": "2018-01-01",
+        "date_upto": "2030-01-01",
+    }
+    modes = {"per slice": {}, "batch": {"batch": True}, "batch facet": {"batch": True, "facet": True}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, plot_func in [("weekly", tsp.plot_weekly_per_agg), ("daily", tsp.plot_daily_per_agg)]:
+            for mode, mode_kwargs in modes.items():
+                t_embedded, embedded = spec_bytes(plot_func, df, **common, **mode_kwargs)
+                data_file = os.path.join(tmp, f"{name}.json")
+                t_shared, shared = spec_bytes(
+                    plot_func, df, max_points=args.max_points, data_file=data_file, **common, **mode_kwargs
+                )
+                file_size = os.path.getsize(data_file)
+                print(
+                    f"{name:<7} {mode:<12} embedded {embedded / 1e6:8.2f} MB {t_embedded:6.2f} s   "
+                    f"shared {shared / 1e6:8.2f} MB + file {file_size / 1e6:6.2f} MB {t_shared:6.2f} s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Training matrix of the price model served by feature_store.FeatureStore against the feature
+pipeline of 2_Modelling.ipynb (enrich_day, yearly median self-merge, LabelEncoder, drop of obs_cols),
+and the incremental update of the store with a new month against a full build, on synthetic data
+
+Usage (from forecast_task):
+    python benchmarks/bench_feature_store.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from sklearn.preprocessing import LabelEncoder  # noqa: E402
+
+import timeseries_plots as tsp  # noqa: E402
+from feature_store import FeatureStore  # noqa: E402
+from serving import FEATURE_COLUMNS  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def notebook_features(df):
+    # 2_Modelling.ipynb
+    df = tsp.enrich_day(df.copy(), time_col="DATE")
+    df_agg_prices = (
+        df.groupby(["CATEGORIES", "SPACE_binned", "YEAR"], observed=True)
+        .agg({"median_PRICE_CATEGORY_SPACE_binned_DATE": "median"})
+        .reset_index()
+    )
+    df_agg_prices["next_YEAR"] = df_agg_prices["YEAR"] + 1
+    df_agg_prices.drop(columns=["YEAR"], inplace=True)
+    df_agg_prices = df_agg_prices.rename(
+        columns={
+            "median_PRICE_CATEGORY_SPACE_binned_DATE": "median_PRICE_CATEGORY_SPACE_binned_last_YEAR",
+            "next_YEAR": "YEAR",
+        }
+    )
+    df = df.merge(df_agg_prices, on=["CATEGORIES", "SPACE_binned", "YEAR"], how="left")
+    df["CATEGORIES_ID"] = LabelEncoder().fit_transform(df["CATEGORIES"])
+    return df[FEATURE_COLUMNS]
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--categories", type=int, default=20)
+    args = parser.parse_args()
+
+    df = make_forecasting_frame(args.rows, n_categories=args.categories, categorical=True)
+    last_month = df["DATE"] >= df["DATE"].max() - pd.offsets.MonthBegin(1)
+    print(f"{len(df)} rows, {df['DATE'].nunique()} dates")
+
+    X_notebook, t_notebook = timed(notebook_features, df)
+    with tempfile.TemporaryDirectory() as tmp:
+        _, t_build = timed(FeatureStore(os.path.join(tmp, "full")).update, df)
+        store = FeatureStore(os.path.join(tmp, "incremental"))
+        store.update(df[~last_month])
+        entry, t_update = timed(store.update, df)
+        X_store, t_serve = timed(store.feature_matrix, df)
+
+    same = np.allclose(X_notebook.to_numpy(dtype=np.float64), X_store.to_numpy(dtype=np.float64), equal_nan=True)
+    print(f"notebook features           {t_notebook:8.2f} s")
+    print(f"store feature_matrix        {t_serve:8.2f} s   same values: {same}")
+    print(f"store full build            {t_build:8.2f} s")
+    months = f"{len(entry['computed'])} of {len(entry['partitions'])} months"
+    print(f"store update (new month)    {t_update:8.2f} s   {months}")
+
+
+if __name__ == "__main__":
+    main()
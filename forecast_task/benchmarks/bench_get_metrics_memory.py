@@ -0,0 +1,56 @@
+"""
+Peak memory and time of get_metrics with and without copy_free
+
+Usage (from forecast_task):
+    python benchmarks/bench_get_metrics_memory.py --rows 1000000 5000000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kpi_calculation as kpi  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def measure(func, **kwargs):
+    """
+    Wall time (s) and peak traced memory (MB) of one call
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(**kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'mode':>10} {'input MB':>10} {'time s':>8} {'peak MB':>9}")
+    for n_rows in args.rows:
+        df = make_forecasting_frame(n_rows)
+        df["n_Products"] = 0
+        input_mb = df.memory_usage(deep=True).sum() / 1e6
+        for copy_free in [False, True]:
+            elapsed, peak = measure(
+                kpi.get_metrics,
+                df=df,
+                pred_name="ML FORECAST",
+                target_name="PRICE",
+                copy_free=copy_free,
+                extra_kpis=True,
+            )
+            mode = "copy_free" if copy_free else "default"
+            print(f"{n_rows:>10} {mode:>10} {input_mb:>10.1f} {elapsed:>8.3f} {peak:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Year-over-year lags of calc_agg_weekly/calc_agg_daily against the former per-year merge loops
+
+Usage (from forecast_task):
+    python benchmarks/bench_lags.py --rows 2000000 --years 12 --categories 300
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import timeseries_plots as tsp  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def legacy_add_year_lag(df_total_aggregated, actuals_col, period_col, lag, name):
+    """
+    Former add_last_year_*/add_minus_2_year_* implementation
+    """
+    df_total_aggregated_week = pd.DataFrame()
+    for year in df_total_aggregated.YEAR.unique():
+        df_total_aggregated_last = df_total_aggregated[df_total_aggregated["YEAR"] == (year - lag)][
+            [period_col, actuals_col]
+        ]
+        df_total_aggregated_last[name] = df_total_aggregated_last[actuals_col]
+        df_total_aggregated_last["current_year"] = year
+        df_total_aggregated_last = df_total_aggregated_last.drop(columns=[actuals_col])
+        df_total_aggregated_week = pd.concat(
+            [
+                df_total_aggregated_week,
+                df_total_aggregated[["YEAR", period_col, actuals_col]].merge(
+                    df_total_aggregated_last[["current_year", period_col, name]],
+                    left_on=["YEAR", period_col],
+                    right_on=["current_year", period_col],
+                    how="inner",
+                ),
+            ]
+        )
+        df_total_aggregated_week = df_total_aggregated_week.drop(columns=["current_year"])
+    return df_total_aggregated_week
+
+
+def legacy_calc_agg(df, var_cols, agg, actuals_col, period_col, date_col):
+    """
+    Former calc_agg_weekly (period_col="WEEK") and calc_agg_daily (period_col="ISODAY")
+    """
+    agg_dict = {col: agg for col in var_cols}
+    agg_dict[actuals_col] = agg
+    agg_dict[date_col] = "first"
+    df_total_aggregated = df.groupby([period_col, "YEAR"]).agg(agg_dict).reset_index()
+    for lag, name in [(1, f"{actuals_col}_last_year"), (2, f"{actuals_col}_-2_years")]:
+        df_lag = legacy_add_year_lag(df_total_aggregated, actuals_col, period_col, lag, name)
+        df_total_aggregated = df_total_aggregated.merge(
+            df_lag[["YEAR", period_col, name]], on=[period_col, "YEAR"], how="outer"
+        )
+    return df_total_aggregated
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--years", type=int, default=12)
+    parser.add_argument("--categories", type=int, default=100)
+    args = parser.parse_args()
+
+    df = make_forecasting_frame(args.rows, n_categories=args.categories, n_days=365 * args.years + 3)
+    tsp.enrich_day(df)
+    print(f"{args.rows} rows, {args.years} years of daily data, {args.categories} categories")
+
+    for label, period_col, date_col, func in [
+        ("weekly", "WEEK", "THIS_WEEK_MONDAY", tsp.calc_agg_weekly),
+        ("daily", "ISODAY", "C_DATE", tsp.calc_agg_daily),
+    ]:
+        t_old, old = timed(legacy_calc_agg, df, ["BASELINE"], "sum", "PRICE", period_col, date_col)
+        t_new, new = timed(func, df, var_cols=["BASELINE"], agg="sum", actuals_col="PRICE")
+        pd.testing.assert_frame_equal(old, new)
+        print(f"calc_agg_{label:<7} legacy {t_old:8.3f} s   lag engine {t_new:8.3f} s   x{t_old / t_new:6.1f}")
+
+    # lags per category: one keyed pass instead of a per-category loop of the legacy functions
+    df_cat = df.groupby(["CATEGORIES", "ISODAY", "YEAR"]).agg({"PRICE": "sum"}).reset_index()
+    t_old, _ = timed(
+        lambda: [
+            legacy_add_year_lag(df_slice, "PRICE", "ISODAY", lag, str(lag))
+            for _, df_slice in df_cat.groupby("CATEGORIES")
+            for lag in [1, 2]
+        ]
+    )
+    t_new, _ = timed(
+        tsp.add_lagged_actuals, df_cat, "PRICE", lags=[1, 2], period_col="ISODAY", group_cols=["CATEGORIES"]
+    )
+    print(f"daily per category  legacy {t_old:8.3f} s   lag engine {t_new:8.3f} s   x{t_old / t_new:6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Scaling of KPI_per_agg_var_df and plot_weekly_per_agg with the number of processes
+
+Usage (from forecast_task):
+    python benchmarks/bench_parallel_kpi.py --rows 5000000 --categories 2000 --jobs 1 2 4 8 16 32
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import altair as alt  # noqa: E402
+
+import kpi_calculation as kpi  # noqa: E402
+import timeseries_plots as tsp  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--categories", type=int, default=500)
+    parser.add_argument("--plots", type=int, default=16, help="number of charts for plot_weekly_per_agg")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    df = make_forecasting_frame(args.rows, n_categories=args.categories)
+    tsp.enrich_day(df)
+    # charts are built but not rendered
+    alt.TopLevelMixin.display = lambda self: None
+
+    print(f"{args.rows} rows, {args.categories} categories, {os.cpu_count()} cores")
+    print(f"{'n_jobs':>6} {'KPI s':>8} {'speedup':>8} {'plots s':>8} {'speedup':>8}")
+    base = None
+    for n_jobs in args.jobs:
+        start = time.perf_counter()
+        kpi.KPI_per_agg_var_df(
+            df,
+            var="CATEGORIES",
+            limit=args.categories,
+            target_name="PRICE",
+            pred_name="ML FORECAST",
+            pred_name_comp="BASELINE",
+            granularity_list=["WEEK", "YEAR", "SPACE_binned"],
+            pred_from="2018-01-01",
+            pred_upto="2021-12-31",
+            product_col="SPACE_binned",
+            n_jobs=n_jobs,
+        )
+        t_kpi = time.perf_counter() - start
+        start = time.perf_counter()
+        tsp.plot_weekly_per_agg(
+            df,
+            actuals_col="PRICE",
+            var_cols=["BASELINE", "ML FORECAST"],
+            agg_col="CATEGORIES",
+            agg="median",
+            limit_n_plots=args.plots,
+            date_from="2021-01-01",
+            date_upto="2021-12-31",
+            n_jobs=n_jobs,
+        )
+        t_plots = time.perf_counter() - start
+        base = base or (t_kpi, t_plots)
+        print(f"{n_jobs:>6} {t_kpi:>8.2f} {base[0] / t_kpi:>8.2f} {t_plots:>8.2f} {base[1] / t_plots:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
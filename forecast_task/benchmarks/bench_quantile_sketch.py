@@ -0,0 +1,85 @@
+"""
+Accuracy and speed of quantile_sketch medians against exact pandas medians
+
+Usage (from forecast_task):
+    python benchmarks/bench_quantile_sketch.py --rows 5000000 --chunks 10 --alpha 0.005
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+import timeseries_plots as tsp  # noqa: E402
+from quantile_sketch import GroupedQuantileSketch  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def max_relative_error(approx, exact):
+    return float(np.nanmax(np.abs(approx.reindex(exact.index) / exact - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunks", type=int, default=10)
+    parser.add_argument("--alpha", type=float, default=0.005)
+    args = parser.parse_args()
+
+    df = make_forecasting_frame(args.rows)
+    tsp.enrich_day(df)
+    keys = ["CATEGORIES", "SPACE_binned", "YEAR"]
+    print(f"{args.rows} rows, alpha={args.alpha}")
+
+    t_exact, exact = timed(lambda: df.groupby(keys, observed=True)["PRICE"].median())
+    t_sketch, sketch = timed(lambda: GroupedQuantileSketch(keys, alpha=args.alpha).update(df, "PRICE"))
+    t_query, approx = timed(sketch.median)
+    print(
+        f"median per category/bin/year  exact {t_exact:7.3f} s   sketch {t_sketch:7.3f} s + query {t_query:6.3f} s"
+        f"   max rel. error {max_relative_error(approx, exact):.4f}   groups {len(exact)}"
+    )
+
+    # chunks (or workers) merged, exact medians need all rows at once
+    chunks = np.array_split(np.arange(len(df)), args.chunks)
+    t_merge, merged = timed(
+        lambda: [
+            GroupedQuantileSketch(keys, alpha=args.alpha).update(df.iloc[rows], "PRICE") for rows in chunks
+        ]
+    )
+    t_reduce, merged = timed(lambda: _merge(merged).compact())
+    approx = merged.median()
+    state = merged.counts()
+    print(
+        f"{args.chunks} merged chunk sketches   {t_merge + t_reduce:7.3f} s   max rel. error"
+        f" {max_relative_error(approx, exact):.4f}   state {len(state)} buckets"
+        f" ({state.memory_usage(deep=True) / 1e6:.1f} MB) vs {df['PRICE'].nbytes / 1e6:.1f} MB of values"
+    )
+
+    t_exact, exact = timed(tsp.calc_agg_weekly, df, var_cols=["BASELINE"], agg="median", actuals_col="PRICE")
+    t_approx, approx = timed(
+        tsp.calc_agg_weekly, df, var_cols=["BASELINE"], agg=tsp.APPROX_MEDIAN, actuals_col="PRICE"
+    )
+    error = np.nanmax(np.abs(approx["PRICE"] / exact["PRICE"] - 1))
+    print(
+        f"calc_agg_weekly median        exact {t_exact:7.3f} s   approx {t_approx:7.3f} s   max rel. error {error:.4f}"
+    )
+
+
+def _merge(sketches):
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    return merged
+
+
+if __name__ == "__main__":
+    main()
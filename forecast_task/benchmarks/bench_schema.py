@@ -0,0 +1,89 @@
+"""
+Memory of a forecasting frame with object strings and wide dtypes vs schema.compact, and the time
+of enrich_day, KPI_per_agg_var_df and the weekly chart data on both
+
+Usage (from forecast_task):
+    python benchmarks/bench_schema.py --rows 10000000 --categories 20
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+import kpi_calculation as kpi  # noqa: E402
+import schema  # noqa: E402
+import timeseries_plots as tsp  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def wide_calendar(df):
+    """
+    Calendar features as int64 columns, as from the former enrich_day
+    """
+    df = tsp.enrich_day(df.copy())
+    for col in ["ISODAY", "WEEKDAY", "YEAR", "WEEK", "MONTH_DAY", "MONTH", "WEEK_OF_MONTH", "TIMEDELTA"]:
+        df[col] = df[col].astype(np.int64)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--categories", type=int, default=20)
+    args = parser.parse_args()
+
+    df_wide = make_forecasting_frame(args.rows, n_categories=args.categories)
+    t_compact, df_compact = timed(schema.compact, df_wide)
+    report = schema.memory_savings(df_wide, df_compact)
+    report["MB_before"] = report["bytes_before"] / 1e6
+    report["MB_after"] = report["bytes_after"] / 1e6
+    print(report[["dtype_before", "dtype_after", "MB_before", "MB_after", "saved"]].round(3).to_string())
+    print(f"schema.compact: {t_compact:.2f} s")
+
+    df_wide = wide_calendar(df_wide)
+    t_enrich, df_compact = timed(tsp.enrich_day, df_compact)
+    print(f"enrich_day on the compact frame: {t_enrich:.2f} s, mismatches: {schema.mismatches(df_compact)}")
+    enriched = schema.memory_savings(df_wide, df_compact).loc["Total"]
+    print(f"enriched: {enriched['bytes_before'] / 1e6:.0f} MB -> {enriched['bytes_after'] / 1e6:.0f} MB")
+
+    kpi_args = dict(
+        var="CATEGORIES",
+        limit=10,
+        target_name="PRICE",
+        pred_name="ML FORECAST",
+        pred_name_comp="BASELINE",
+        granularity_list=["THIS_WEEK_MONDAY", "SPACE_binned"],
+        pred_from="2019-01-01",
+        pred_upto="2021-12-31",
+        product_col="SPACE_binned",
+    )
+    print(f"{'':<22} {'wide s':>8} {'compact s':>10} {'max rel diff':>13}")
+    for name, func, kwargs in [
+        ("KPI_per_agg_var_df", kpi.KPI_per_agg_var_df, kpi_args),
+        (
+            "calc_agg_weekly",
+            tsp.calc_agg_weekly,
+            dict(var_cols=["BASELINE", "ML FORECAST"], agg="sum", actuals_col="PRICE", group_cols=["CATEGORIES"]),
+        ),
+    ]:
+        t_wide, result_wide = timed(func, df_wide, **kwargs)
+        t_small, result_small = timed(func, df_compact, **kwargs)
+        wide = result_wide.select_dtypes("number").to_numpy(dtype=np.float64)
+        small = result_small.select_dtypes("number").to_numpy(dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            diff = np.nanmax(np.abs(small - wide) / np.abs(wide))
+        print(f"{name:<22} {t_wide:>8.2f} {t_small:>10.2f} {diff:>13.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Load test of the serving API: p50/p99 latency and throughput with and without micro-batching
+
+Usage (from forecast_task):
+    python benchmarks/bench_serving.py --clients 32 --requests 200
+    python benchmarks/bench_serving.py --model-dir models/price --url http://127.0.0.1:8000
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import serving  # noqa: E402
+import timeseries_plots as tsp  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+
+def make_requests(df, n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = df.iloc[rng.integers(0, len(df), n)]
+    return [
+        {"DATE": str(date.date()), "SPACE": float(space), "CATEGORIES": category}
+        for date, space, category in zip(rows["DATE"], rows["SPACE"], rows["CATEGORIES"])
+    ]
+
+
+def run_client(host, port, requests, latencies):
+    connection = http.client.HTTPConnection(host, port)
+    for request in requests:
+        body = json.dumps(request)
+        start = time.perf_counter()
+        connection.request("POST", "/predict", body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            raise RuntimeError(f"Request failed with status {response.status}")
+    connection.close()
+
+
+def load_test(host, port, requests, n_clients):
+    """
+    Send requests from n_clients threads with persistent connections
+
+    Returns:
+        latencies in seconds, wall time in seconds
+    """
+    latencies = []
+    threads = [
+        threading.Thread(target=run_client, args=(host, port, requests[i::n_clients], latencies))
+        for i in range(n_clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), time.perf_counter() - start
+
+
+def report(label, latencies, wall_time, n_batches=None):
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    batches = "" if n_batches is None else f"   {len(latencies) / max(n_batches, 1):6.1f} requests/batch"
+    print(
+        f"{label:<22} p50 {p50:7.2f} ms   p99 {p99:7.2f} ms   {len(latencies) / wall_time:8.0f} requests/s{batches}"
+    )
+
+
+def check_calendar_cache(model, dates):
+    """
+    Calendar features with a cache of 2 dates (evicted between the calls) equal the uncached ones,
+    every batch has new dates and one of the previous batch
+    """
+    dates = list(dict.fromkeys(dates))
+    max_cached_dates = serving.MAX_CACHED_DATES
+    serving.MAX_CACHED_DATES = 2
+    try:
+        model._calendar_cache.clear()
+        for start in range(0, len(dates), 3):
+            batch = dates[start : start + 3] + dates[max(start - 1, 0) : start + 1]
+            expected = np.column_stack(
+                [
+                    tsp.calendar_features(pd.DatetimeIndex(batch), [col], origin=model.origin)[col]
+                    for col in serving.CALENDAR_COLUMNS
+                ]
+            )
+            np.testing.assert_array_equal(model._calendar(batch), expected)
+    finally:
+        serving.MAX_CACHED_DATES = max_cached_dates
+        model._calendar_cache.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", help="model stored with PriceModel.save, trained on synthetic data if not set")
+    parser.add_argument("--url", help="test a running server instead of starting one")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per client")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    df = make_forecasting_frame(100_000)
+    requests = make_requests(df, args.clients * args.requests)
+
+    if args.url:
+        url = urlparse(args.url)
+        report("server", *load_test(url.hostname, url.port, requests, args.clients))
+        return
+
+    if args.model_dir:
+        model = serving.PriceModel.load(args.model_dir)
+    else:
+        model = serving.PriceModel.fit(df, date_upto=str(df["DATE"].quantile(0.75).date()), n_estimators=100)
+    check_calendar_cache(model, [request["DATE"] for request in requests[:100]])
+    print(f"{len(requests)} requests from {args.clients} clients")
+
+    for label, max_batch_size in [("no batching", 1), ("micro-batching", 256)]:
+        server = serving.make_server(model, port=0, max_batch_size=max_batch_size, max_wait=args.max_wait_ms / 1000)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            latencies, wall_time = load_test(*server.server_address, requests, args.clients)
+            report(label, latencies, wall_time, server.batcher.n_batches)
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.batcher.close()
+
+
+if __name__ == "__main__":
+    main()
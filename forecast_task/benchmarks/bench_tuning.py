@@ -0,0 +1,74 @@
+"""
+Successive halving with early stopping (tuning.successive_halving) against the GridSearchCV of 2_Modelling.ipynb
+
+Both searches tune on the rows up to --date-upto, the best model of each is evaluated on the later rows
+with the RMAD of kpi_calculation.get_metrics.
+
+Usage (from forecast_task):
+    python benchmarks/bench_tuning.py --grid small --n-jobs -1
+    python benchmarks/bench_tuning.py --grid full --skip-grid
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+import xgboost as xgb  # noqa: E402
+from sklearn.model_selection import GridSearchCV  # noqa: E402
+
+import tuning  # noqa: E402
+from serving import PriceModel  # noqa: E402
+
+SMALL_GRID = {
+    "learning_rate": [0.05, 0.1, 0.2],
+    "max_depth": [6, 8, 10],
+    "min_child_weight": [1, 5],
+    "gamma": [0.0, 0.3],
+    "colsample_bytree": [0.3, 0.8],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="forecasting_cleaned.csv")
+    parser.add_argument("--date-upto", default="2020-12-31", help="last date of the tuning data")
+    parser.add_argument("--grid", choices=["small", "full"], default="small", help="full: grid of the notebook")
+    parser.add_argument("--n-jobs", type=int, default=1)
+    parser.add_argument("--skip-grid", action="store_true", help="only run successive halving")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.data, parse_dates=["DATE"])
+    X = PriceModel.from_data(df, date_upto=args.date_upto).features_frame(df)
+    train = (df["DATE"] <= args.date_upto).to_numpy()
+    X_train, y_train, X_test, y_test = X[train], df["PRICE"][train], X[~train], df["PRICE"][~train]
+    grid = SMALL_GRID if args.grid == "small" else tuning.XGB_PARAM_GRID
+    print(f"{len(tuning.param_grid(grid))} parameter combinations, {len(X_train)} training rows")
+
+    start = time.perf_counter()
+    df_trials = tuning.successive_halving(X_train, y_train, df["DATE"][train], grid=grid, n_jobs=args.n_jobs)
+    best = tuning.best_estimator(df_trials, X_train, y_train, grid=grid)
+    t_halving = time.perf_counter() - start
+    rmad_halving = tuning.rmad(y_test, best.predict(X_test))
+    print(
+        f"successive halving  {t_halving:8.1f} s   test RMAD {rmad_halving:.4f}   {len(df_trials)} trials"
+        f"   best {tuning.best_params(df_trials, grid)} n_estimators={best.n_estimators}"
+    )
+
+    if args.skip_grid:
+        return
+    start = time.perf_counter()
+    search = GridSearchCV(
+        estimator=xgb.XGBRegressor(**tuning.BASE_PARAMS), param_grid=grid, cv=5, n_jobs=args.n_jobs, verbose=0
+    )
+    search.fit(X_train, y_train)
+    t_grid = time.perf_counter() - start
+    rmad_grid = tuning.rmad(y_test, search.best_estimator_.predict(X_test))
+    print(f"GridSearchCV        {t_grid:8.1f} s   test RMAD {rmad_grid:.4f}   best {search.best_params_}")
+    print(f"wall-clock saving   x{t_grid / t_halving:.1f}, RMAD difference {rmad_halving - rmad_grid:+.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Benchmark suite of the kpi_calculation and timeseries_plots hot paths
+
+Every case runs on synthetic data shaped like forecasting_cleaned.csv (see synthetic.py) for each
+size, reports the best wall time of --repeat runs and the peak traced memory of one more run, and
+appends the results with the git revision to a JSON lines store. --compare shows the change
+against the results of another revision, so regressions between commits are visible.
+
+Usage (from forecast_task):
+    python benchmarks/run_suite.py --sizes 10000 100000 1000000
+    python benchmarks/run_suite.py --sizes 50000000 --cases get_metrics enrich_day --repeat 1
+    python benchmarks/run_suite.py --compare HEAD~1
+    python benchmarks/run_suite.py --sizes 1000000 --no-store --trace trace.json --trace-memory
+    python benchmarks/run_suite.py --list
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+
+import instrumentation  # noqa: E402
+import kpi_calculation as kpi  # noqa: E402
+import timeseries_plots as tsp  # noqa: E402
+from synthetic import make_forecasting_frame  # noqa: E402
+
+DEFAULT_STORE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".benchmarks", "results.jsonl"
+)
+# relative slowdown or memory increase reported as regression by --compare
+REGRESSION_THRESHOLD = 0.1
+
+
+def _enriched(df):
+    return tsp.enrich_day(df.copy())
+
+
+def _kpi_per_agg_var_df(df):
+    return kpi.KPI_per_agg_var_df(
+        df,
+        var="CATEGORIES",
+        limit=10,
+        target_name="PRICE",
+        pred_name="ML FORECAST",
+        pred_name_comp="BASELINE",
+        granularity_list=["THIS_WEEK_MONDAY", "CATEGORIES"],
+        pred_from=df["C_DATE"].min(),
+        pred_upto=df["C_DATE"].max(),
+        product_col="CATEGORIES",
+    )
+
+
+def _plot_weekly(df):
+    chart = tsp.plot_weekly(
+        df,
+        agg="sum",
+        var_cols=["BASELINE", "ML FORECAST"],
+        actuals_col="PRICE",
+        date_from="2018-01-01",
+        date_upto="2030-01-01",
+    )
+    return chart.to_dict()
+
+
+def _plot_daily(df):
+    # plot_daily displays the chart, which is its serialization
+    with contextlib.redirect_stdout(io.StringIO()):
+        tsp.plot_daily(
+            df,
+            agg="sum",
+            var_cols=["BASELINE", "ML FORECAST"],
+            actuals_col="PRICE",
+            date_from="2018-01-01",
+            date_upto="2030-01-01",
+        )
+
+
+# name -> (setup(df) -> input of the timed function (not timed, called before every run), timed function)
+CASES = {
+    "get_metrics": (lambda df: df.assign(n_Products=0), lambda df: kpi.get_metrics(df, "ML FORECAST", "PRICE")),
+    "get_metrics_copy_free": (
+        lambda df: df.assign(n_Products=0),
+        lambda df: kpi.get_metrics(df, "ML FORECAST", "PRICE", copy_free=True),
+    ),
+    "KPI_per_agg_var_df": (_enriched, _kpi_per_agg_var_df),
+    "enrich_day": (lambda df: df[["C_DATE"]].copy(), lambda df: tsp.enrich_day(df)),
+    "calc_agg_weekly": (
+        _enriched,
+        lambda df: tsp.calc_agg_weekly(df, var_cols=["BASELINE", "ML FORECAST"], agg="sum", actuals_col="PRICE"),
+    ),
+    "calc_agg_daily": (
+        _enriched,
+        lambda df: tsp.calc_agg_daily(df, var_cols=["BASELINE", "ML FORECAST"], agg="sum", actuals_col="PRICE"),
+    ),
+    "plot_weekly": (_enriched, _plot_weekly),
+    "plot_daily": (_enriched, _plot_daily),
+}
+
+
+def git_revision():
+    """
+    Current commit, with "-dirty" if there are uncommitted changes
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=cwd, text=True).strip()
+        dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cwd, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return revision + ("-dirty" if dirty.strip() else "")
+
+
+def resolve_revision(revision):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", revision], cwd=cwd, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return revision
+
+
+def measure(setup, func, df, repeat):
+    """
+    Best wall time (s) of repeat calls and peak traced memory (MB) of one call, every call gets a fresh setup(df)
+    """
+    times = []
+    for _ in range(repeat):
+        data = setup(df)
+        start = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - start)
+    data = setup(df)
+    tracemalloc.start()
+    func(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 1e6
+
+
+def run(cases, sizes, repeat):
+    """
+    Results of cases for every size as list of dicts
+    """
+    revision = git_revision()
+    machine = f"{platform.node()} {platform.machine()} {os.cpu_count()} cores"
+    results = []
+    for n_rows in sizes:
+        df = make_forecasting_frame(n_rows, categorical=n_rows > 1_000_000)
+        for name in cases:
+            setup, func = CASES[name]
+            seconds, peak_mb = measure(setup, func, df, repeat)
+            results.append(
+                {
+                    "revision": revision,
+                    "time": pd.Timestamp.now().isoformat(timespec="seconds"),
+                    "machine": machine,
+                    "case": name,
+                    "rows": n_rows,
+                    "seconds": seconds,
+                    "peak_mb": peak_mb,
+                }
+            )
+            print(f"{name:<24} {n_rows:>10} rows {seconds:10.4f} s {peak_mb:10.1f} MB", flush=True)
+    return results
+
+
+def trace(cases, sizes, path, memory=False):
+    """
+    Run every case once per size with instrumentation, write a Chrome trace and print the summary per function
+    """
+    with instrumentation.recording(memory=memory) as recorder:
+        for n_rows in sizes:
+            df = make_forecasting_frame(n_rows, categorical=n_rows > 1_000_000)
+            for name in cases:
+                setup, func = CASES[name]
+                data = setup(df)
+                with instrumentation.span(name, "case", key=n_rows, rows_in=n_rows):
+                    func(data)
+    recorder.to_chrome_trace(path)
+    print(recorder.summary().to_string(index=False, float_format="{:.4f}".format))
+    print(f"Chrome trace written to {path}")
+
+
+def append_results(results, path=DEFAULT_STORE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+
+
+def load_results(path=DEFAULT_STORE):
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=["revision", "time", "machine", "case", "rows", "seconds", "peak_mb"])
+    return pd.read_json(path, lines=True, dtype={"revision": str})
+
+
+def compare(df_results, base, head, threshold=REGRESSION_THRESHOLD):
+    """
+    Latest results of revision head against revision base per case and size
+
+    Returns:
+        DataFrame with time and memory of both revisions, their ratios and a regression flag
+    """
+    df_results = df_results.sort_values(by="time")
+    latest = df_results.groupby(["revision", "case", "rows"]).last().reset_index()
+    keys = ["case", "rows"]
+    df_compare = latest[latest["revision"] == base][keys + ["seconds", "peak_mb"]].merge(
+        latest[latest["revision"] == head][keys + ["seconds", "peak_mb"]], on=keys, suffixes=("_base", "_head")
+    )
+    df_compare["time_ratio"] = df_compare["seconds_head"] / df_compare["seconds_base"]
+    df_compare["memory_ratio"] = df_compare["peak_mb_head"] / df_compare["peak_mb_base"]
+    df_compare["regression"] = (df_compare[["time_ratio", "memory_ratio"]] > 1 + threshold).any(axis=1)
+    return df_compare
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--store", default=DEFAULT_STORE, help="JSON lines file with the results")
+    parser.add_argument("--compare", metavar="REVISION", help="compare the stored results of REVISION with HEAD")
+    parser.add_argument("--no-run", action="store_true", help="only compare stored results")
+    parser.add_argument("--list", action="store_true", help="list the cases")
+    parser.add_argument("--no-store", action="store_true", help="do not store the results")
+    parser.add_argument("--trace", metavar="FILE", help="also run the cases instrumented, Chrome trace to FILE")
+    parser.add_argument("--trace-memory", action="store_true", help="trace peak memory per call (slow)")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(CASES))
+        return
+    if not args.no_run:
+        results = run(args.cases, args.sizes, args.repeat)
+        if not args.no_store:
+            append_results(results, args.store)
+    if args.trace:
+        trace(args.cases, args.sizes, args.trace, memory=args.trace_memory)
+    if args.compare:
+        base, head = resolve_revision(args.compare), git_revision()
+        df_compare = compare(load_results(args.store), base, head)
+        if len(df_compare) == 0:
+            print(f"No common results of {base} and {head} in {args.store}")
+        else:
+            print(df_compare.to_string(index=False, float_format="{:.3f}".format))
+
+
+if __name__ == "__main__":
+    main()
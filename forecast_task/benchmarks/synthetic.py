@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+SPACE_BINS = [0, 50, 100, 150, 200, 300, 400, 700]
+
+
+def make_forecasting_frame(
+    n_rows=10_000, n_categories=20, date_from="2018-01-01", n_days=1461, seed=42, categorical=False
+):
+    """
+    Synthetic data shaped like forecasting_cleaned.csv (dates x categories x space bins)
+    with a baseline and a ML forecast column
+
+    Args:
+        n_rows (int): number of rows
+        n_categories (int): number of categories
+        date_from (str): first date, format 'YYYY-MM-DD'
+        n_days (int): number of days covered
+        seed (int): random seed
+        categorical (bool): CATEGORIES, SPACE_binned and total as categoricals (as from data_loader),
+            strings take too much memory for tens of millions of rows
+
+    Returns:
+        DataFrame with DATE, PRICE, SPACE, SPACE_binned, CATEGORIES,
+        median_PRICE_CATEGORY_SPACE_binned_DATE, BASELINE, ML FORECAST, C_DATE and total columns
+    """
+    rng = np.random.default_rng(seed)
+    categories = np.array([f"CATEGORY_{i:03d}" for i in range(n_categories)])
+    # few big and many small categories, as in the real data
+    cat_weights = 1.0 / np.arange(1, n_categories + 1)
+    cat_codes = rng.choice(n_categories, size=n_rows, p=cat_weights / cat_weights.sum())
+    price_per_m2 = rng.uniform(10, 40, n_categories)
+
+    dates = pd.Timestamp(date_from) + pd.to_timedelta(np.sort(rng.integers(0, n_days, n_rows)), "D")
+    space = np.round(np.clip(rng.lognormal(np.log(75), 0.5, n_rows), 5, 699))
+    trend = 1 + 0.02 * (dates - dates.min()).days.to_numpy() / 365
+    price = np.round(space * price_per_m2[cat_codes] * trend * rng.lognormal(0, 0.2, n_rows), -1)
+
+    if categorical:
+        space_binned = pd.cut(space, SPACE_BINS)
+        category_values = pd.Categorical.from_codes(cat_codes, categories=categories)
+    else:
+        space_binned = pd.cut(space, SPACE_BINS).astype(str)
+        category_values = categories[cat_codes]
+    df = pd.DataFrame(
+        {
+            "DATE": dates,
+            "PRICE": price,
+            "SPACE": space,
+            "SPACE_binned": space_binned,
+            "CATEGORIES": category_values,
+        }
+    )
+    df["median_PRICE_CATEGORY_SPACE_binned_DATE"] = df.groupby(
+        ["CATEGORIES", "SPACE_binned", "DATE"], observed=True
+    )["PRICE"].transform("median")
+    df["BASELINE"] = df.groupby(["CATEGORIES", "SPACE_binned"], observed=True)[
+        "median_PRICE_CATEGORY_SPACE_binned_DATE"
+    ].transform("median")
+    df["ML FORECAST"] = np.round(price * rng.lognormal(0, 0.1, n_rows), -1)
+    df["C_DATE"] = df["DATE"]
+    df["total"] = pd.Categorical.from_codes(np.zeros(n_rows, dtype=np.int8), ["Total"]) if categorical else "Total"
+    return df
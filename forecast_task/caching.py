@@ -0,0 +1,190 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# cache of resolve(True)
+_default_cache = None
+
+# two rows of odd 64 bit weights of the block checksums of fingerprint
+_WEIGHTS = np.random.default_rng(0).integers(0, 2**63, size=(2, 2**16), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+
+def _checksums(buffer):
+    """
+    Weighted sums (mod 2**64) of the bits of buffer (as unsigned integers) per block of 2**16 values
+
+    The weights are odd, so a single changed value always changes the sums. It is about ten
+    times faster than a cryptographic hash of the buffer.
+    """
+    itemsize = buffer.dtype.itemsize if buffer.dtype.itemsize in (1, 2, 4, 8) else 1
+    values = np.ascontiguousarray(buffer).reshape(-1).view(f"u{itemsize}").astype(np.uint64, copy=False)
+    block = _WEIGHTS.shape[1]
+    sums = []
+    for start in range(0, len(values), block):
+        chunk = values[start : start + block]
+        sums.append(_WEIGHTS[:, : len(chunk)] @ chunk)
+    return np.concatenate(sums) if sums else np.array([], dtype=np.uint64)
+
+
+def fingerprint(df, columns=None):
+    """
+    Digest of the values, dtypes and names of columns of df (all columns if None)
+
+    Numeric, boolean and datetime columns are checksummed from their buffers, categoricals from
+    their codes and categories and only object columns are hashed value by value (about 10 times
+    slower), so a fingerprint costs a few milliseconds per million rows and column.
+    """
+    columns = list(df.columns) if columns is None else list(dict.fromkeys(columns))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((len(df), columns)).encode())
+    for col in columns:
+        values = df[col]
+        digest.update(str(values.dtype).encode())
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            digest.update(pd.util.hash_pandas_object(values.cat.categories, index=False).to_numpy())
+            buffer = values.cat.codes.to_numpy()
+        else:
+            buffer = values.to_numpy()
+        if buffer.dtype == object:
+            buffer = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        digest.update(_checksums(buffer))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of computed results (e.g. KPI tables, aggregated chart data), in memory and optionally on disk
+
+    Keys combine the fingerprint of the input columns with the parameters of the computation
+    (see key). At most max_entries results are kept in memory, with directory every result is
+    also pickled to directory, which keeps at most max_disk_bytes (least recently used files
+    are removed first), so the cache survives restarts of the notebook. Cached results are
+    shared between the calls, they must not be modified.
+
+    Example:
+        cache = ResultCache(directory=".cache/results")
+        kpi.KPI_per_agg_var(df, ..., cache=cache)
+        cache.stats
+    """
+
+    def __init__(self, max_entries=32, directory=None, max_disk_bytes=2**30):
+        """
+        Args:
+            max_entries (int): results kept in memory
+            directory (str): directory of the pickled results, memory only if None
+            max_disk_bytes (int): size limit of directory
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def key(name, df, columns, **params):
+        """
+        Key of the computation name on columns of df with params (repr of the values)
+        """
+        text = repr((name, fingerprint(df, columns), sorted(params.items())))
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, key, default=None):
+        """
+        Cached result of key, default if there is none
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return self._entries[key]
+        if self.directory is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), "rb") as f:
+                value = pickle.load(f)
+            # the modification time orders the files for the eviction
+            os.utime(self._path(key))
+            self._remember(key, value)
+            self.stats["disk_hits"] += 1
+            return value
+        self.stats["misses"] += 1
+        return default
+
+    def put(self, key, value):
+        """
+        Cache value as result of key
+        """
+        self._remember(key, value)
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(key) + ".tmp", "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self._path(key) + ".tmp", self._path(key))
+            self._trim_disk()
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached result of key, compute() (cached) on a miss
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _trim_disk(self):
+        files = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".pkl")]
+        files.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        total = sum(entry.stat().st_size for entry in files)
+        # the newest file stays, even if it is larger than the limit
+        for entry in files[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+            self.stats["evictions"] += 1
+
+    def clear(self, disk=True):
+        """
+        Remove all results (also the files in directory if disk) and reset the stats
+        """
+        self._entries.clear()
+        if disk and self.directory is not None and os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".pkl"):
+                    os.remove(entry.path)
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    def info(self):
+        """
+        stats with the number of results in memory and the hit rate
+        """
+        lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hit_rate = (self.stats["hits"] + self.stats["disk_hits"]) / lookups if lookups else float("nan")
+        return {**self.stats, "entries": len(self._entries), "hit_rate": hit_rate}
+
+
+def resolve(cache):
+    """
+    ResultCache of a cache argument: None / False for no caching, True for the default cache of the module
+    """
+    global _default_cache
+    if cache is None or cache is False:
+        return None
+    if cache is True:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
+    return cache
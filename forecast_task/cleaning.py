@@ -0,0 +1,225 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+RAW_COLUMNS = ["DATE", "PRICE", "SPACE", "CATEGORIES"]
+OUTPUT_COLUMNS = [
+    "DATE",
+    "PRICE",
+    "SPACE",
+    "SPACE_binned",
+    "CATEGORIES",
+    "median_PRICE_CATEGORY_SPACE_binned_DATE",
+    "CATEGORY_N_DATES",
+]
+MEDIAN_KEYS = ["CATEGORIES", "SPACE_binned", "DATE"]
+
+# categories with less dates are removed
+MIN_CATEGORY_DATES = 10
+# prices outside of this range relative to the category median are outliers
+PRICE_TO_CATEGORY_MEDIAN_RANGE = (0.01, 100)
+MAX_SPACE = 1000
+SPACE_BINS = [0, 50, 100, 150, 200, 300, 400, 700]
+# categories were renamed in the end of 2019
+CATEGORY_MAP = {
+    "ATTIC": "APARTMENT, ATTIC",
+    "ATTIC_FLAT": "APARTMENT, ATTIC_FLAT",
+    "ATELIER": "SHOP, ATELIER",
+    "BIFAMILIAR_HOUSE": "HOUSE, BIFAMILIAR_HOUSE",
+    "DUPLEX": "APARTMENT, DUPLEX, MAISONETTE",
+    "FURNISHED_FLAT": "APARTMENT, FURNISHED_FLAT",
+    "LOFT": "APARTMENT, LOFT",
+    "ROW_HOUSE": "HOUSE, ROW_HOUSE",
+    "SINGLE_HOUSE": "HOUSE, SINGLE_HOUSE",
+    "SINGLE_ROOM": "APARTMENT, SINGLE_ROOM",
+    "STUDIO": "APARTMENT, STUDIO",
+    "TERRACE_FLAT": "APARTMENT, TERRACE_FLAT",
+    "APARTMENT": "APARTMENT, FLAT",
+    "ROOF_FLAT": "APARTMENT, ROOF_FLAT",
+}
+
+
+def bin_space(space):
+    """
+    SPACE binned with SPACE_BINS
+    """
+    return pd.cut(space, SPACE_BINS)
+
+
+def clean_forecasting(df):
+    """
+    Full rebuild of forecasting_cleaned.csv from forecasting.csv as done in 1_EDA_and_cleaning.ipynb
+
+    Steps: remove duplicates and rows with missing data, remove categories with less than
+    MIN_CATEGORY_DATES dates, remove price outliers relative to the category median price and
+    spaces from MAX_SPACE on, bin SPACE, median price per category, space bin and date,
+    merge renamed categories (CATEGORY_MAP) and count dates per category.
+
+    Args:
+        df (DataFrame): raw data with RAW_COLUMNS, DATE parsed
+
+    Returns:
+        DataFrame with OUTPUT_COLUMNS sorted by DATE
+    """
+    df = df[RAW_COLUMNS].drop_duplicates(keep="first")
+    df = df[~(df["PRICE"].isna() | df["SPACE"].isna() | df["CATEGORIES"].isna())]
+
+    n_dates = df.groupby(["CATEGORIES"])["DATE"].transform("nunique")
+    df = df[n_dates >= MIN_CATEGORY_DATES]
+    price_ratio = df["PRICE"] / df.groupby(["CATEGORIES"])["PRICE"].transform("median")
+    df = df[(price_ratio > PRICE_TO_CATEGORY_MEDIAN_RANGE[0]) & (price_ratio < PRICE_TO_CATEGORY_MEDIAN_RANGE[1])]
+    df = df[df["SPACE"] < MAX_SPACE]
+
+    df = df.assign(SPACE_binned=bin_space(df["SPACE"]))
+    # stable: rows of the same date keep the input order (IncrementalCleaner gives the same order)
+    df = df.sort_values(by=["DATE"], kind="stable")
+    df["median_PRICE_CATEGORY_SPACE_binned_DATE"] = df.groupby(MEDIAN_KEYS, observed=True)["PRICE"].transform(
+        "median"
+    )
+    df["CATEGORIES"] = df["CATEGORIES"].replace(CATEGORY_MAP)
+    df["CATEGORY_N_DATES"] = df.groupby(["CATEGORIES"])["DATE"].transform("nunique")
+    return df[OUTPUT_COLUMNS].reset_index(drop=True)
+
+
+def _median_from_counts(counts):
+    """
+    Median of values given as value counts (pd.Series indexed by value)
+    """
+    counts = counts[counts > 0].sort_index()
+    cumulative = counts.to_numpy().cumsum()
+    n = cumulative[-1]
+    values = counts.index.to_numpy()
+    low = values[np.searchsorted(cumulative, (n + 1) // 2)]
+    high = values[np.searchsorted(cumulative, n // 2 + 1)]
+    return (low + high) / 2
+
+
+class IncrementalCleaner:
+    """
+    Incremental version of clean_forecasting for daily deltas
+
+    The deduplicated rows without missing data are kept per raw category together with mergeable
+    statistics of the category: the set of dates and the value counts of prices (exact median). A
+    delta only re-evaluates the filters of the rows of the categories it touches and recomputes the
+    median price of those (category, space bin, date) groups whose set of kept rows changed, so it
+    costs O(delta + rows of the touched categories), the other categories are not read. result()
+    after any sequence of deltas is identical (including the row order, ties of DATE keep the order
+    of arrival) to clean_forecasting on all of them concatenated.
+
+    Example:
+        cleaner = IncrementalCleaner.load("cleaning_state.pkl")
+        cleaner.update(pd.read_csv("delta.csv", parse_dates=["DATE"]))
+        cleaner.save("cleaning_state.pkl")
+        df = cleaner.result()
+    """
+
+    def __init__(self):
+        # raw category -> its rows in order of arrival
+        self._rows = {}
+        self._row_hashes = set()
+        self._n_rows = 0
+        self._category_dates = {}
+        self._category_prices = {}
+
+    @staticmethod
+    def _empty_rows():
+        return pd.DataFrame(
+            {
+                "DATE": pd.Series(dtype="datetime64[ns]"),
+                "PRICE": pd.Series(dtype=np.float64),
+                "SPACE": pd.Series(dtype=np.float64),
+                "CATEGORIES": pd.Series(dtype=object),
+                "SPACE_binned": bin_space(pd.Series(dtype=np.float64)),
+                "keep": pd.Series(dtype=bool),
+                "median_PRICE_CATEGORY_SPACE_binned_DATE": pd.Series(dtype=np.float64),
+                "ARRIVAL": pd.Series(dtype=np.int64),
+            }
+        )
+
+    def update(self, df):
+        """
+        Add a delta of raw rows with RAW_COLUMNS
+        """
+        df = df[RAW_COLUMNS]
+        df = df[~(df["PRICE"].isna() | df["SPACE"].isna() | df["CATEGORIES"].isna())]
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        seen = np.fromiter((h in self._row_hashes for h in hashes.tolist()), dtype=bool, count=len(hashes))
+        new = ~seen & ~pd.Series(hashes).duplicated(keep="first").to_numpy()
+        df, hashes = df[new], hashes[new]
+        if len(df) == 0:
+            return self
+        self._row_hashes.update(hashes.tolist())
+
+        df = df.assign(
+            SPACE_binned=bin_space(df["SPACE"]),
+            keep=False,
+            median_PRICE_CATEGORY_SPACE_binned_DATE=np.nan,
+            ARRIVAL=np.arange(self._n_rows, self._n_rows + len(df)),
+        )
+        self._n_rows += len(df)
+        categories = df["CATEGORIES"].unique()
+        for category, df_cat in df.groupby("CATEGORIES", sort=False):
+            self._category_dates.setdefault(category, set()).update(df_cat["DATE"].unique())
+            counts = df_cat["PRICE"].value_counts()
+            previous = self._category_prices.get(category)
+            self._category_prices[category] = counts if previous is None else previous.add(counts, fill_value=0)
+
+        # rows of the touched categories only, the new rows last (in order of arrival within every category)
+        previous = [self._rows[category] for category in categories if category in self._rows]
+        n_old = sum(len(rows) for rows in previous)
+        rows = pd.concat(previous + [df], ignore_index=True)
+
+        # filters depend on category statistics only
+        n_dates = rows["CATEGORIES"].map({cat: len(self._category_dates[cat]) for cat in categories})
+        median_price = rows["CATEGORIES"].map(
+            {cat: _median_from_counts(self._category_prices[cat]) for cat in categories}
+        )
+        price_ratio = rows["PRICE"] / median_price
+        keep = (
+            (n_dates >= MIN_CATEGORY_DATES)
+            & (price_ratio > PRICE_TO_CATEGORY_MEDIAN_RANGE[0])
+            & (price_ratio < PRICE_TO_CATEGORY_MEDIAN_RANGE[1])
+            & (rows["SPACE"] < MAX_SPACE)
+        ).to_numpy()
+        changed = (keep != rows["keep"].to_numpy().astype(bool)) | (np.arange(len(rows)) >= n_old)
+        rows["keep"] = keep
+
+        # median price only changes for groups which got or lost rows
+        in_group = pd.MultiIndex.from_frame(rows[MEDIAN_KEYS]).isin(
+            pd.MultiIndex.from_frame(rows.loc[changed, MEDIAN_KEYS])
+        )
+        groups = rows[in_group & keep]
+        rows.loc[in_group, "median_PRICE_CATEGORY_SPACE_binned_DATE"] = np.nan
+        rows.loc[groups.index, "median_PRICE_CATEGORY_SPACE_binned_DATE"] = groups.groupby(
+            MEDIAN_KEYS, observed=True
+        )["PRICE"].transform("median")
+
+        for category, rows_cat in rows.groupby("CATEGORIES", sort=False):
+            self._rows[category] = rows_cat.reset_index(drop=True)
+        return self
+
+    def result(self):
+        """
+        Cleaned data with OUTPUT_COLUMNS sorted by DATE (stable, in order of arrival)
+        """
+        df = pd.concat([self._empty_rows()] + [rows[rows["keep"]] for rows in self._rows.values()])
+        df = df.sort_values(by=["DATE", "ARRIVAL"], kind="stable")
+        df = df.assign(CATEGORIES=df["CATEGORIES"].replace(CATEGORY_MAP))
+        df["CATEGORY_N_DATES"] = df.groupby(["CATEGORIES"])["DATE"].transform("nunique")
+        return df[OUTPUT_COLUMNS].reset_index(drop=True)
+
+    def save(self, path):
+        """
+        Pickle the state
+        """
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        """
+        Load a pickled state
+        """
+        with open(path, "rb") as f:
+            return pickle.load(f)
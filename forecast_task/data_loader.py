@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import schema  # package
+
+CACHE_VERSION = 1
+ROW_GROUP_SIZE = 65_536
+CATEGORICAL_COLS = ["CATEGORIES"]
+INTERVAL_COLS = ["SPACE_binned"]
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    sha256 of a file
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _source_info(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _cache_paths(path, cache_dir):
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), ".cache")
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}.parquet"), os.path.join(cache_dir, f"{name}.meta.json")
+
+
+def _is_valid(path, meta_path):
+    """
+    Cache is valid if it was built from a source with the same hash (size and mtime are checked first)
+    """
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("version") != CACHE_VERSION:
+        return False
+    info = _source_info(path)
+    if meta["size"] == info["size"] and meta["mtime_ns"] == info["mtime_ns"]:
+        return True
+    if meta["size"] != info["size"] or meta["sha256"] != file_hash(path):
+        return False
+    # touched but unchanged source
+    meta.update(info)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return True
+
+
+def _parse_number(text):
+    number = float(text)
+    return int(number) if number.is_integer() else number
+
+
+def parse_intervals(values):
+    """
+    Categorical with pd.Interval categories from strings like "(50, 100]"
+    """
+    codes, uniques = pd.factorize(values)
+    intervals = []
+    for text in uniques:
+        match = re.fullmatch(r"\s*([\(\[])\s*([^,]+),\s*([^\]\)]+)\s*([\)\]])\s*", str(text))
+        if match is None:
+            raise ValueError(f"Can not parse interval {text}")
+        left, right = (_parse_number(match.group(i)) for i in [2, 3])
+        closed = {"([": "neither", "(]": "right", "[)": "left", "[]": "both"}[match.group(1) + match.group(4)]
+        intervals.append(pd.Interval(left, right, closed=closed))
+    categories = pd.IntervalIndex(intervals).sort_values()
+    return pd.Categorical.from_codes(
+        np.where(codes >= 0, categories.get_indexer(pd.IntervalIndex(intervals))[codes], -1), categories=categories
+    )
+
+
+def _to_table(df, date_col):
+    """
+    Arrow table with date32 dates and interval columns stored as codes, the breaks go to the metadata
+    """
+    intervals = {}
+    df = df.copy()
+    for col in INTERVAL_COLS:
+        if col in df.columns:
+            categories = df[col].cat.categories
+            intervals[col] = {
+                "left": categories.left.tolist(),
+                "right": categories.right.tolist(),
+                "closed": categories.closed,
+            }
+            df[col] = df[col].cat.codes.astype(np.int8)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.set_column(table.schema.get_field_index(date_col), date_col, table[date_col].cast(pa.date32()))
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"intervals"] = json.dumps(intervals).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def _from_table(table, date_col):
+    intervals = json.loads(table.schema.metadata.get(b"intervals", b"{}"))
+    df = table.to_pandas(date_as_object=False)
+    if date_col in df.columns:
+        df[date_col] = df[date_col].astype("datetime64[ns]")
+    for col, spec in intervals.items():
+        if col in df.columns:
+            categories = pd.IntervalIndex.from_arrays(spec["left"], spec["right"], closed=spec["closed"])
+            df[col] = pd.Categorical.from_codes(df[col].to_numpy(), categories=categories)
+    return df
+
+
+def build_cache(path="forecasting_cleaned.csv", cache_dir=None, date_col="DATE"):
+    """
+    Parse the csv once and write it as parquet sorted by date_col (one row group per ROW_GROUP_SIZE rows)
+
+    Returns:
+        path of the parquet file
+    """
+    cache_path, meta_path = _cache_paths(path, cache_dir)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+    source_hash = file_hash(path)
+    info = _source_info(path)
+    df = pd.read_csv(path, parse_dates=[date_col])
+    for col in CATEGORICAL_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col in INTERVAL_COLS:
+        if col in df.columns:
+            df[col] = parse_intervals(df[col])
+    df = df.sort_values(by=[date_col], kind="stable")
+
+    pq.write_table(_to_table(df, date_col), cache_path, row_group_size=ROW_GROUP_SIZE)
+    with open(meta_path, "w") as f:
+        json.dump({"version": CACHE_VERSION, "sha256": source_hash, **info}, f)
+    return cache_path
+
+
+def load_forecasting(
+    path="forecasting_cleaned.csv",
+    columns=None,
+    date_from=None,
+    date_upto=None,
+    cache_dir=None,
+    date_col="DATE",
+    categorical=True,
+    refresh=False,
+    compact=False,
+):
+    """
+    Load the (cleaned) forecasting csv from a parquet cache
+
+    The cache is rebuilt when the hash of the source file changes. Dates are stored as date32
+    and the file is sorted by date, so a date range only reads the matching row groups.
+
+    Args:
+        path (str): csv file, e.g. forecasting.csv or forecasting_cleaned.csv
+        columns (list(str)): columns to read, all if None
+        date_from (str): first date, format 'YYYY-MM-DD'
+        date_upto (str): last date (inclusive), format 'YYYY-MM-DD'
+        cache_dir (str): directory for the cache, ".cache" next to the csv if None
+        date_col (str): date column
+        categorical (bool): keep CATEGORIES and SPACE_binned as categoricals (SPACE_binned with pd.Interval
+            categories), otherwise they are returned as strings like from pd.read_csv
+        refresh (bool): rebuild the cache
+        compact (bool): cast the columns to the compact dtypes of schema.SCHEMA (float32 prices only if lossless)
+
+    Returns:
+        DataFrame sorted by date_col
+    """
+    cache_path, meta_path = _cache_paths(path, cache_dir)
+    if refresh or not os.path.exists(cache_path) or not _is_valid(path, meta_path):
+        build_cache(path, cache_dir=cache_dir, date_col=date_col)
+
+    filters = []
+    if date_from is not None:
+        filters.append((date_col, ">=", pd.Timestamp(date_from).date()))
+    if date_upto is not None:
+        filters.append((date_col, "<=", pd.Timestamp(date_upto).date()))
+    table = pq.read_table(cache_path, columns=columns, filters=filters or None)
+    df = _from_table(table, date_col)
+
+    if not categorical:
+        for col in CATEGORICAL_COLS + INTERVAL_COLS:
+            if col in df.columns:
+                df[col] = df[col].astype(str).where(df[col].notna())
+    if compact:
+        df = schema.compact(df, copy=False)
+    return df
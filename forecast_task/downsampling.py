@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Positions of the points kept by Largest-Triangle-Three-Buckets downsampling
+
+    The first and last point are kept, the points in between are split into n_out - 2 buckets
+    and from every bucket the point forming the largest triangle with the point kept from the
+    previous bucket and the mean of the next bucket is kept, so peaks and drops survive.
+
+    Args:
+        x (np.array): increasing x values (numbers or datetimes)
+        y (np.array): y values without NaN
+        n_out (int): number of points to keep
+
+    Returns:
+        np.array with the increasing positions of the kept points
+    """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])[:n_out]
+    x = np.asarray(x).astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i < n_out - 3:
+            next_x, next_y = x[end : edges[i + 2]].mean(), y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def downsample(df, x_col, y_col, group_cols=[], max_points=1000):
+    """
+    Downsample every series of a long frame with more than max_points points with LTTB
+
+    Rows with NaN in y_col are dropped (line charts skip them anyway).
+
+    Args:
+        df (DataFrame): long format, one row per series and x value
+        x_col (str): x column
+        y_col (str): y column
+        group_cols (list(str)): columns identifying a series (e.g. ["variable"])
+        max_points (int): point budget per series
+
+    Returns:
+        DataFrame with the kept rows, ordered by series and x_col
+    """
+    df = df[df[y_col].notna()].sort_values(by=list(group_cols) + [x_col], kind="stable")
+    if group_cols:
+        groups = df.groupby(group_cols, observed=True, sort=False).indices.values()
+    else:
+        groups = [np.arange(len(df))]
+    x = df[x_col].to_numpy()
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype("datetime64[ns]").astype(np.int64)
+    y = df[y_col].to_numpy(dtype=np.float64)
+    kept = [rows[lttb_indices(x[rows], y[rows], max_points)] for rows in groups]
+    return df.iloc[np.sort(np.concatenate(kept))] if kept else df
+
+
+def write_chart_data(frames, path):
+    """
+    Write the data of several charts into one JSON file (records), e.g. to reference it by alt.UrlData
+
+    Returns:
+        path
+    """
+    df = pd.concat(frames, ignore_index=True)
+    df.to_json(path, orient="records", date_format="iso")
+    return path
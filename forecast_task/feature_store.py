@@ -0,0 +1,312 @@
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import features as ftr  # package
+import timeseries_plots as tsp  # package
+from cleaning import bin_space
+from serving import CALENDAR_COLUMNS, FEATURE_COLUMNS
+
+GROUP_KEYS = ["CATEGORIES", "SPACE_binned"]
+KEYS = ["DATE"] + GROUP_KEYS
+MEDIAN_COL = "median_PRICE_CATEGORY_SPACE_binned_DATE"
+LAST_YEAR_COL = "median_PRICE_CATEGORY_SPACE_binned_last_YEAR"
+STORE_COLUMNS = KEYS + CALENDAR_COLUMNS + [LAST_YEAR_COL, "CATEGORIES_ID"]
+MANIFEST = "manifest.json"
+
+
+def _as_str(values):
+    """
+    Key column as strings like in the csv (e.g. "(50, 100]"), categoricals stay categoricals of strings
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(values.cat.codes, categories=values.cat.categories.astype(str))
+    return values.astype(str)
+
+
+def _partitions(dates):
+    """
+    Partition (month as YYYYMM) of every date
+    """
+    dates = pd.DatetimeIndex(dates)
+    return dates.year.to_numpy() * 100 + dates.month.to_numpy()
+
+
+def _last_complete_year(as_of):
+    """
+    Last ISO year that ended on or before as_of
+    """
+    as_of = pd.Timestamp(as_of)
+    year = as_of.isocalendar()[0]
+    return year - int((as_of + pd.Timedelta("1D")).isocalendar()[0] == year)
+
+
+def key_features(keys, yearly, categories, origin):
+    """
+    Features of 2_Modelling.ipynb per (DATE, CATEGORIES, SPACE_binned): enrich_day calendar, last year
+    median and CATEGORIES_ID
+
+    Args:
+        keys (DataFrame): KEYS columns, CATEGORIES and SPACE_binned as strings
+        yearly (pd.Series): features.yearly_medians indexed by CATEGORIES, SPACE_binned, YEAR
+        categories (list(str)): category vocabulary, the position is CATEGORIES_ID (-1 if unknown)
+        origin (str): date TIMEDELTA is counted from
+
+    Returns:
+        DataFrame with STORE_COLUMNS
+    """
+    frame = pd.DataFrame({"DATE": keys["DATE"].to_numpy()})
+    for col in GROUP_KEYS:
+        frame[col] = np.asarray(keys[col]).astype(str)
+    codes, dates = pd.factorize(frame["DATE"])
+    for col, values in tsp.calendar_features(pd.DatetimeIndex(dates), CALENDAR_COLUMNS, origin=origin).items():
+        frame[col] = values[codes]
+    ftr.add_last_year_median(frame, keys=GROUP_KEYS, name=LAST_YEAR_COL, medians=yearly)
+    frame["CATEGORIES_ID"] = pd.Index(categories).get_indexer(frame["CATEGORIES"]).astype(np.int32)
+    return frame[STORE_COLUMNS]
+
+
+class FeatureStore:
+    """
+    Versioned parquet store of the features of the price model (serving.FEATURE_COLUMNS without SPACE)
+
+    The features are materialized per (DATE, CATEGORIES, SPACE_binned) in one parquet file per
+    month. update writes a new version: only months whose rows changed (new or late data) are
+    computed, plus the months whose last year median depends on a changed year. Unchanged files
+    are shared with the previous version. CATEGORIES_ID is the position in a vocabulary that is
+    sorted at the first update (as the LabelEncoder of the notebook) and only appended to later,
+    so ids of a trained model stay valid.
+
+    feature_matrix serves FEATURE_COLUMNS for training rows and for batch scoring: keys found in
+    the store are read from their month files, others (e.g. future dates) are computed from the
+    stored yearly medians. With as_of the rows are point-in-time correct: the latest version
+    built on data up to as_of is used (the latest version if all are newer, e.g. a store built once
+    on all data) and last year medians of years not complete at as_of are NaN.
+
+    Example:
+        store = FeatureStore("feature_store")
+        store.update(load_forecasting())
+        X_train = store.feature_matrix(df_train, as_of="2020-12-31")
+        X_score = store.feature_matrix(df_requests, as_of="2020-12-31")
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): directory of the store
+        """
+        self.path = path
+        self._manifest = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            manifest_path = os.path.join(self.path, MANIFEST)
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {"origin": None, "versions": []}
+        return self._manifest
+
+    def versions(self):
+        """
+        DataFrame with version, data_upto, created and number of partitions of every version
+        """
+        return pd.DataFrame(
+            [
+                {
+                    "version": v["version"],
+                    "data_upto": v["data_upto"],
+                    "created": v["created"],
+                    "partitions": len(v["partitions"]),
+                }
+                for v in self.manifest["versions"]
+            ],
+            columns=["version", "data_upto", "created", "partitions"],
+        )
+
+    def version(self, version=None, as_of=None):
+        """
+        Manifest entry of version, of the latest version on data up to as_of, or the latest one
+
+        If every version has data after as_of the latest one is used as well, feature_matrix masks
+        the last year medians of years that are not complete at as_of.
+        """
+        versions = self.manifest["versions"]
+        if version is not None:
+            matches = [v for v in versions if v["version"] == version]
+        else:
+            matches = versions
+            if as_of is not None:
+                matches = [v for v in versions if pd.Timestamp(v["data_upto"]) <= pd.Timestamp(as_of)] or versions
+        if not matches:
+            raise ValueError(f"No feature store version for version={version}, as_of={as_of} in {self.path}")
+        return matches[-1]
+
+    def _write_manifest(self):
+        manifest_path = os.path.join(self.path, MANIFEST)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def update(self, df, date_col="DATE"):
+        """
+        Write a new version with the features of df, computing only changed and dependent months
+
+        Args:
+            df (DataFrame): all cleaned data (forecasting_cleaned.csv, e.g. from data_loader.load_forecasting),
+                months missing in df are not part of the new version
+
+        Returns:
+            manifest entry of the new version, of the latest one if nothing changed
+        """
+        rows = pd.DataFrame(
+            {
+                "DATE": df[date_col].to_numpy(),
+                "CATEGORIES": _as_str(df["CATEGORIES"]),
+                "SPACE_binned": _as_str(df["SPACE_binned"]),
+                MEDIAN_COL: df[MEDIAN_COL].to_numpy(),
+            }
+        )
+        tsp.enrich_day(rows, time_col="DATE", columns=["YEAR"])
+        rows["PARTITION"] = _partitions(rows["DATE"])
+        # order independent checksum of the rows of every month, detects new and late data
+        hashes = (
+            pd.Series(pd.util.hash_pandas_object(rows[KEYS + [MEDIAN_COL]], index=False).to_numpy())
+            .groupby(rows["PARTITION"].to_numpy())
+            .sum()
+            .astype(str)
+        )
+
+        manifest = self.manifest
+        previous = manifest["versions"][-1] if manifest["versions"] else None
+        old_partitions = previous["partitions"] if previous else {}
+        partitions = {str(part): {"hash": h} for part, h in hashes.items()}
+        changed = [
+            part for part, entry in partitions.items() if old_partitions.get(part, {}).get("hash") != entry["hash"]
+        ]
+        changed_years = set(rows.loc[rows["PARTITION"].isin([int(part) for part in changed]), "YEAR"].unique())
+        # the ISO years of a removed month, with the neighbours for the days around new year
+        for part in set(old_partitions) - set(partitions):
+            changed_years |= {int(part) // 100 - 1, int(part) // 100, int(part) // 100 + 1}
+
+        if previous is None:
+            manifest["origin"] = str(rows["DATE"].min().date())
+            categories = sorted(rows["CATEGORIES"].unique())
+            yearly = ftr.yearly_medians(rows, target_col=MEDIAN_COL, keys=GROUP_KEYS)
+        else:
+            categories = previous["categories"]
+            categories = categories + sorted(set(rows["CATEGORIES"].unique()) - set(categories))
+            yearly = self.yearly(previous["version"])
+            yearly = yearly[~yearly.index.get_level_values("YEAR").isin(changed_years)]
+            changed_rows = rows[rows["YEAR"].isin(changed_years)]
+            yearly = pd.concat([yearly, ftr.yearly_medians(changed_rows, target_col=MEDIAN_COL, keys=GROUP_KEYS)])
+        yearly = yearly.sort_index()
+
+        # months with rows of the year after a changed year get new last year medians
+        dependent = rows.loc[rows["YEAR"].isin([year + 1 for year in changed_years]), "PARTITION"].unique()
+        computed = sorted(set(changed) | {str(part) for part in dependent})
+        if previous is not None and not computed and set(partitions) == set(old_partitions):
+            return previous
+        version = (previous["version"] if previous else 0) + 1
+        os.makedirs(os.path.join(self.path, "partitions"), exist_ok=True)
+
+        for part in partitions:
+            if part not in computed:
+                partitions[part]["file"] = old_partitions[part]["file"]
+        keys = rows[rows["PARTITION"].isin([int(part) for part in computed])].drop_duplicates(subset=KEYS)
+        features = key_features(keys, yearly, categories, manifest["origin"]).sort_values(by=KEYS, kind="stable")
+        for part, part_features in features.groupby(_partitions(features["DATE"])):
+            file = os.path.join("partitions", f"{part}.v{version}.parquet")
+            pq.write_table(pa.Table.from_pandas(part_features, preserve_index=False), os.path.join(self.path, file))
+            partitions[str(part)]["file"] = file
+
+        yearly_file = f"yearly.v{version}.parquet"
+        yearly.rename(MEDIAN_COL).reset_index().to_parquet(os.path.join(self.path, yearly_file), index=False)
+        entry = {
+            "version": version,
+            "data_upto": str(rows["DATE"].max().date()),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "categories": categories,
+            "yearly": yearly_file,
+            "computed": computed,
+            "partitions": partitions,
+        }
+        manifest["versions"].append(entry)
+        self._write_manifest()
+        return entry
+
+    def yearly(self, version=None, as_of=None):
+        """
+        Yearly medians of a version (see version) as pd.Series indexed by CATEGORIES, SPACE_binned, YEAR
+        """
+        entry = self.version(version, as_of)
+        yearly = pd.read_parquet(os.path.join(self.path, entry["yearly"]))
+        return yearly.set_index(GROUP_KEYS + ["YEAR"])[MEDIAN_COL]
+
+    def read(self, date_from=None, date_upto=None, version=None, as_of=None):
+        """
+        Stored features (STORE_COLUMNS) of the months of a date range (inclusive, format 'YYYY-MM-DD')
+        """
+        entry = self.version(version, as_of)
+        first = _partitions([date_from])[0] if date_from is not None else 0
+        last = _partitions([date_upto])[0] if date_upto is not None else 999_999
+        files = [v["file"] for part, v in sorted(entry["partitions"].items()) if first <= int(part) <= last]
+        if not files:
+            return pd.DataFrame({col: [] for col in STORE_COLUMNS})
+        table = pa.concat_tables([pq.read_table(os.path.join(self.path, file)) for file in files])
+        df = table.to_pandas()
+        if date_from is not None:
+            df = df[df["DATE"] >= pd.Timestamp(date_from)]
+        if date_upto is not None:
+            df = df[df["DATE"] <= pd.Timestamp(date_upto)]
+        return df.reset_index(drop=True)
+
+    def feature_matrix(self, df, version=None, as_of=None, date_col="DATE"):
+        """
+        FEATURE_COLUMNS (X of 2_Modelling.ipynb) for the rows of df, for training and batch scoring
+
+        Args:
+            df (DataFrame): rows with date_col, SPACE and CATEGORIES (SPACE_binned is computed if missing)
+            version (int): version to read, see version
+            as_of (str): point in time, format 'YYYY-MM-DD': the latest version on data up to as_of,
+                last year medians of ISO years not complete at as_of are NaN
+            date_col (str): column with dates
+
+        Returns:
+            DataFrame with FEATURE_COLUMNS aligned with df, CATEGORIES_ID is NaN for unknown categories
+        """
+        entry = self.version(version, as_of)
+        keys = pd.DataFrame(
+            {
+                "DATE": pd.to_datetime(df[date_col]).to_numpy(),
+                "CATEGORIES": _as_str(df["CATEGORIES"]),
+                "SPACE_binned": _as_str(
+                    df["SPACE_binned"] if "SPACE_binned" in df.columns else pd.Series(bin_space(df["SPACE"]))
+                ),
+            }
+        )
+        stored = self.read(keys["DATE"].min(), keys["DATE"].max(), version=entry["version"])
+        pos = pd.MultiIndex.from_frame(stored[KEYS]).get_indexer(pd.MultiIndex.from_frame(keys))
+        missing = pos < 0
+        if missing.any():
+            # keys that are not materialized, e.g. dates after the data
+            new_keys = keys[missing].drop_duplicates()
+            yearly = self.yearly(entry["version"])
+            computed = key_features(new_keys, yearly, entry["categories"], self.manifest["origin"])
+            stored = pd.concat([stored, computed], ignore_index=True)
+            pos = pd.MultiIndex.from_frame(stored[KEYS]).get_indexer(pd.MultiIndex.from_frame(keys))
+
+        X = pd.DataFrame({"SPACE": df["SPACE"].to_numpy(dtype=np.float64)})
+        for col in FEATURE_COLUMNS[1:]:
+            X[col] = stored[col].to_numpy()[pos]
+        X["CATEGORIES_ID"] = X["CATEGORIES_ID"].where(X["CATEGORIES_ID"] >= 0)
+        if as_of is not None:
+            X.loc[(X["YEAR"] - 1 > _last_complete_year(as_of)).to_numpy(), LAST_YEAR_COL] = np.nan
+        return X
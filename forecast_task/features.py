@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from quantile_sketch import GroupedQuantileSketch
+
+
+def yearly_medians(
+    df,
+    target_col="median_PRICE_CATEGORY_SPACE_binned_DATE",
+    keys=["CATEGORIES", "SPACE_binned"],
+    year_col="YEAR",
+    alpha=None,
+):
+    """
+    Median of target_col per keys and year
+
+    Args:
+        df (DataFrame): input data with year_col (see timeseries_plots.enrich_day)
+        target_col (str): column to take the median of
+        keys (list(str)): group columns
+        year_col (str): column with years
+        alpha (float): relative accuracy of approximate medians from a quantile sketch, exact medians if None
+
+    Returns:
+        pd.Series indexed by keys + [year_col]
+    """
+    if alpha is not None:
+        return GroupedQuantileSketch(keys + [year_col], alpha=alpha).update(df, target_col).median()
+    return df.groupby(keys + [year_col], observed=True)[target_col].median()
+
+
+def add_last_year_median(
+    df,
+    target_col="median_PRICE_CATEGORY_SPACE_binned_DATE",
+    keys=["CATEGORIES", "SPACE_binned"],
+    year_col="YEAR",
+    name="median_PRICE_CATEGORY_SPACE_binned_last_YEAR",
+    alpha=None,
+    medians=None,
+):
+    """
+    Add the median of target_col per keys in the previous year as column name (feature of 2_Modelling.ipynb)
+
+    The rows look up their (keys, year - 1) group in the hash index of the yearly medians, instead of a merge.
+
+    Args as in yearly_medians, plus:
+        name (str): name of the new column
+        medians (pd.Series): precomputed yearly_medians (e.g. from a merged sketch), computed from df if None
+    """
+    if medians is None:
+        medians = yearly_medians(df, target_col=target_col, keys=keys, year_col=year_col, alpha=alpha)
+    index = pd.MultiIndex.from_arrays([df[key] for key in keys] + [df[year_col] - 1])
+    pos = medians.index.get_indexer(index)
+    values = np.where(pos >= 0, medians.to_numpy()[pos], np.nan)
+    df[name] = values
+    return df
@@ -0,0 +1,260 @@
+import contextlib
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# recorder of the running recording(), None while instrumentation is disabled
+_recorder = None
+
+RECORD_COLUMNS = [
+    "name",
+    "category",
+    "key",
+    "start",
+    "wall_time",
+    "rows_in",
+    "rows_out",
+    "peak_memory_delta",
+    "depth",
+    "pid",
+    "thread",
+]
+
+
+def _rows(obj):
+    """
+    Number of rows of a DataFrame / Series / array (of the first element of a tuple), None otherwise
+    """
+    if isinstance(obj, tuple) and obj:
+        obj = obj[0]
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(obj)
+    return None
+
+
+class Recorder:
+    """
+    Records of the instrumented calls of one recording()
+    """
+
+    def __init__(self, memory=False):
+        """
+        Args:
+            memory (bool): record the peak of the memory traced by tracemalloc during a call
+        """
+        self.memory = memory
+        self.records = []
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def enter(self, name, category, key=None, rows_in=None):
+        """
+        Open a record, closed by exit
+        """
+        stack = self._stack()
+        frame = {"name": name, "category": category, "key": key, "rows_in": rows_in, "depth": len(stack)}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # reset_peak below also resets the peak of the enclosing calls, they keep theirs in the frame
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame["memory_start"] = frame["peak"] = current
+        stack.append(frame)
+        frame["start"] = time.perf_counter()
+        return frame
+
+    def exit(self, frame, rows_out=None):
+        """
+        Close the record of frame
+        """
+        end = time.perf_counter()
+        stack = self._stack()
+        stack.pop()
+        peak_delta = None
+        if self.memory:
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            peak_delta = peak - frame["memory_start"]
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+        self.records.append(
+            {
+                "name": frame["name"],
+                "category": frame["category"],
+                "key": None if frame["key"] is None else str(frame["key"]),
+                "start": frame["start"] - self._origin,
+                "wall_time": end - frame["start"],
+                "rows_in": frame["rows_in"],
+                "rows_out": rows_out if rows_out is not None else frame.get("rows_out"),
+                "peak_memory_delta": peak_delta,
+                "depth": frame["depth"],
+                "pid": os.getpid(),
+                "thread": threading.get_ident(),
+            }
+        )
+
+    def to_frame(self):
+        """
+        DataFrame with a row per call (RECORD_COLUMNS), times in seconds and memory in bytes
+        """
+        return pd.DataFrame(self.records, columns=RECORD_COLUMNS)
+
+    def summary(self, by=["category", "name"]):
+        """
+        Calls, total / mean / max wall time, rows in / out and max peak memory delta per by, slowest first
+
+        by=["category", "name", "key"] breaks the calls down by their key (e.g. the chart or the forecast)
+        """
+        df = self.to_frame()
+        df["key"] = df["key"].fillna("")
+        summary = df.groupby(by, sort=False).agg(
+            calls=("wall_time", "size"),
+            total_time=("wall_time", "sum"),
+            mean_time=("wall_time", "mean"),
+            max_time=("wall_time", "max"),
+            rows_in=("rows_in", "sum"),
+            rows_out=("rows_out", "sum"),
+            peak_memory_delta=("peak_memory_delta", "max"),
+        )
+        # NaN instead of 0 for functions without rows (e.g. charts)
+        for col in ["rows_in", "rows_out"]:
+            summary[col] = summary[col].where(df.groupby(by, sort=False)[col].count() > 0)
+        return summary.sort_values(by="total_time", ascending=False).reset_index()
+
+    def to_json(self, path):
+        """
+        Write the records as a JSON list
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_frame().astype(object).where(lambda df: df.notna(), None).to_dict("records"), f)
+
+    def to_chrome_trace(self, path):
+        """
+        Write the records in the Chrome trace event format (chrome://tracing, https://ui.perfetto.dev)
+        """
+        events = []
+        for record in self.records:
+            args = {col: record[col] for col in ["key", "rows_in", "rows_out", "peak_memory_delta"]}
+            events.append(
+                {
+                    "name": record["name"],
+                    "cat": record["category"],
+                    "ph": "X",
+                    "ts": record["start"] * 1e6,
+                    "dur": record["wall_time"] * 1e6,
+                    "pid": record["pid"],
+                    "tid": record["thread"],
+                    "args": {col: value for col, value in args.items() if value is not None},
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+@contextlib.contextmanager
+def recording(memory=False):
+    """
+    Record the instrumented calls within the with block
+
+    Calls in worker processes (n_jobs > 1) are not recorded. With memory, tracemalloc is
+    started (if it is not running), which slows down allocation heavy code noticeably.
+
+    Example:
+        with instrumentation.recording(memory=True) as recorder:
+            kpi.KPI_per_agg_var_df(df, ...)
+        recorder.summary()
+        recorder.to_chrome_trace("trace.json")
+    """
+    global _recorder
+    previous = _recorder
+    recorder = Recorder(memory=memory)
+    start_tracing = memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+        if start_tracing:
+            tracemalloc.stop()
+
+
+def instrument(category, name=None, key_arg=None):
+    """
+    Decorator recording the calls of a function while a recording() is running
+
+    rows_in is the length of the first argument, rows_out the one of the result (if they are
+    DataFrames, Series or arrays). Without a recording the only overhead is one check of a global.
+
+    Args:
+        category (str): category of the calls, e.g. "kpi" or "charts"
+        name (str): name of the records, the function name if None
+        key_arg (str): argument whose value is the key of a record, e.g. the title of a chart
+    """
+
+    def decorator(func):
+        label = name or func.__name__
+        parameters = inspect.signature(func).parameters
+        key_pos = list(parameters).index(key_arg) if key_arg is not None else None
+
+        def key_of(args, kwargs):
+            if key_arg is None:
+                return None
+            if key_arg in kwargs:
+                return kwargs[key_arg]
+            if key_pos < len(args):
+                return args[key_pos]
+            return parameters[key_arg].default
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return func(*args, **kwargs)
+            first = args[0] if args else next(iter(kwargs.values()), None)
+            frame = recorder.enter(label, category, key_of(args, kwargs), _rows(first))
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                recorder.exit(frame, _rows(result))
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def span(name, category="span", key=None, rows_in=None):
+    """
+    Record a block of code while a recording() is running, rows_out can be set on the yielded dict
+
+    Example:
+        with instrumentation.span("load", "io") as record:
+            df = load_forecasting()
+            if record is not None:
+                record["rows_out"] = len(df)
+    """
+    recorder = _recorder
+    if recorder is None:
+        yield None
+        return
+    frame = recorder.enter(name, category, key, rows_in)
+    try:
+        yield frame
+    finally:
+        recorder.exit(frame)
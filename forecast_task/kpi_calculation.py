@@ -2,13 +2,51 @@ import altair as alt
 import numpy as np
 import pandas as pd
 
+import caching  # package
+import parallel  # package
 import style as stl  # package
+from instrumentation import instrument
 
+KPI_COLUMNS = [
+    "Total Actuals",
+    "Total Predictions",
+    "% predictions for 0 actuals",
+    "Categories",
+    "Mean Actuals",
+    "Mean Predictions",
+    "MD",
+    "Bias",
+    "RMAD",
+    "RMSE",
+]
 
-def get_metrics(df, pred_name="pred_mean_h30", target_name="target"):
+# computed by get_metrics but only reported with extra_kpis=True
+EXTRA_KPI_COLUMNS = [
+    "WMAPE",
+    "WMAPE (actuals > 0)",
+    "Net Accuracy",
+    "DFA",
+    "FA neglect zero FC",
+    "Outlier KPI",
+]
+
+
+@instrument("kpi", key_arg="pred_name")
+def get_metrics(df, pred_name="pred_mean_h30", target_name="target", copy_free=False, extra_kpis=False):
     """
     Calculate metrics
+
+    Args:
+        df (DataFrame): actuals and predictions, "n_Products" column is reported as "Categories"
+        pred_name (str): column with predictions
+        target_name (str): column with actuals
+        copy_free (bool): compute directly on the column buffers (see _get_metrics_copy_free),
+            the input is neither copied nor modified
+        extra_kpis (bool): add EXTRA_KPI_COLUMNS (WMAPE, forecast accuracies, outlier KPI)
     """
+    if copy_free:
+        return _get_metrics_copy_free(df, pred_name=pred_name, target_name=target_name, extra_kpis=extra_kpis)
+
     df = df.dropna(subset=[target_name, pred_name])
     total_target = df[target_name].sum()
     total_predictions = df[pred_name].sum()
@@ -75,41 +113,200 @@ def get_metrics(df, pred_name="pred_mean_h30", target_name="target"):
             ]
         ).T
 
-        df_stats.columns = [
-            "Total Actuals",
-            "Total Predictions",
-            "% predictions for 0 actuals",
-            "Categories",
-            "Mean Actuals",
-            "Mean Predictions",
-            "MD",
-            "Bias",
-            "RMAD",
-            "RMSE"
-        ]
+        df_stats.columns = KPI_COLUMNS
+        if extra_kpis:
+            df_stats[EXTRA_KPI_COLUMNS] = [wmape, wmape2, net_accuracy, dfa, fa_neglect_zero_fc, outlier_kpi]
 
     return df_stats
 
 
+def _get_metrics_copy_free(df, pred_name="pred_mean_h30", target_name="target", extra_kpis=False):
+    """
+    Calculate metrics of get_metrics on the NumPy buffers of the target and prediction columns
+
+    Rows with missing values are excluded with where= masks instead of dropna, and all
+    deviations are computed into two reused work arrays, so peak memory is two float
+    columns plus a few boolean masks (the columns themselves are only copied if they
+    are not float64).
+    """
+    target = df[target_name].to_numpy(dtype=np.float64)
+    pred = df[pred_name].to_numpy(dtype=np.float64)
+    diff = np.subtract(pred, target)
+    valid = ~np.isnan(diff)
+    n_rows = np.count_nonzero(valid)
+    if n_rows == 0:
+        return None
+    n_products = df["n_Products"].to_numpy()[np.argmax(valid)] if "n_Products" in df.columns else 0
+
+    target_sum = np.sum(target, where=valid)
+    pred_sum = np.sum(pred, where=valid)
+    mask = np.equal(target, 0)
+    np.logical_and(mask, valid, out=mask)
+    zero_pred = np.sum(pred, where=mask) / pred_sum
+    md = np.sum(diff, where=valid) / n_rows
+
+    work = np.abs(diff)
+    sum_ad = np.sum(work, where=valid)
+    np.greater(target, 0, out=mask)
+    np.logical_and(mask, valid, out=mask)
+    sum_ad_positive_target = np.sum(work, where=mask)
+    positive_target_sum = np.sum(target, where=mask)
+    np.not_equal(pred, 0, out=mask)
+    np.logical_and(mask, valid, out=mask)
+    sum_ad_nonzero_pred = np.sum(work, where=mask)
+
+    np.square(diff, out=work)
+    rmse = np.sqrt(np.sum(work, where=valid) / n_rows)
+
+    # outlier: actuals exceed twice the prediction, i.e. -d > pred, metric is -d - pred = target - 2 * pred
+    np.multiply(pred, -2.0, out=work)
+    np.add(work, target, out=work)
+    np.greater(work, 0, out=mask)
+    np.logical_and(mask, valid, out=mask)
+    outlier_sum = np.sum(work, where=mask)
+
+    mean_target = target_sum / n_rows
+    if mean_target > 0:
+        rmad = sum_ad / n_rows / mean_target
+        dfa = 1 - rmad
+    else:
+        rmad = np.nan
+        dfa = 0
+    bias = (pred_sum - target_sum) / target_sum
+
+    df_stats = pd.DataFrame(
+        [[target_sum, pred_sum, zero_pred, n_products, mean_target, pred_sum / n_rows, md, bias, rmad, rmse]],
+        columns=KPI_COLUMNS,
+        dtype=np.float64,
+    )
+    if extra_kpis:
+        df_stats[EXTRA_KPI_COLUMNS] = [
+            sum_ad / target_sum,
+            sum_ad_positive_target / positive_target_sum,
+            1 + bias,
+            dfa,
+            1 - sum_ad_nonzero_pred / target_sum,
+            outlier_sum / target_sum,
+        ]
+    return df_stats
+
+
 def get_metrics_comp(
-    df, pred_name_1="pred_mean_h30", pred_name_2="pred_mean_h30", pred_name_3=None, target_name="target"
+    df,
+    pred_name_1="pred_mean_h30",
+    pred_name_2="pred_mean_h30",
+    pred_name_3=None,
+    target_name="target",
+    pred_names=None,
 ):
     """
-    Calculate metrics for 2 predictions
+    Calculate metrics for several predictions
+
+    Either 2-3 predictions are given with pred_name_1..3 or any number of them with
+    pred_names. All predictions are evaluated against the shared target in one batched
+    pass (see get_metrics_grouped).
     """
-    df1 = get_metrics(df=df, pred_name=pred_name_1, target_name=target_name)
-    df1["fc_name"] = pred_name_1
-    df2 = get_metrics(df=df, pred_name=pred_name_2, target_name=target_name)
-    df2["fc_name"] = pred_name_2
-    if pred_name_3 is None:
-        df_stats_all = pd.concat([df1, df2])
-    else:
-        df3 = get_metrics(df=df, pred_name=pred_name_3, target_name=target_name)
-        df3["fc_name"] = pred_name_3
-        df_stats_all = pd.concat([df1, df2, df3])
+    if pred_names is None:
+        pred_names = [pred_name_1, pred_name_2] + ([] if pred_name_3 is None else [pred_name_3])
+    df_stats_all = get_metrics_grouped(df, group_col=None, pred_name=list(pred_names), target_name=target_name)
     return df_stats_all
 
 
+@instrument("kpi", key_arg="group_col")
+def get_metrics_grouped(df, group_col, pred_name="pred_mean_h30", target_name="target", n_products=None):
+    """
+    Calculate metrics of get_metrics for every value of group_col in one pass
+
+    Rows are sorted by integer group code once and all sums are segment-reduced with
+    np.add.reduceat, so the cost is linear in the number of rows independent of the
+    number of groups. Several predictions are evaluated as columns of one matrix,
+    everything derived from the target (group codes, sort order, zero-actuals mask,
+    sums) is computed once and shared between them.
+
+    Args:
+        df (DataFrame): rows to evaluate (e.g. actuals and predictions aggregated to some granularity)
+        group_col (str): column defining the slices, all rows form one slice if None
+        pred_name (str or list(str)): column(s) with predictions, a "fc_name" column is added for a list
+        target_name (str): column with actuals
+        n_products (Series): number of products per slice indexed by group_col values,
+            "n_Products" column of df is used if None (0 if it does not exist)
+
+    Returns:
+        DataFrame with KPI_COLUMNS (, fc_name) and group_col, one row per slice (and prediction)
+        in order of first appearance of the slice
+    """
+    pred_names = [pred_name] if isinstance(pred_name, str) else list(pred_name)
+    if group_col is None:
+        codes, groups = np.zeros(len(df), dtype=np.intp), pd.Index([0])
+    else:
+        codes, groups = pd.factorize(df[group_col])
+    keep = codes >= 0
+    order = np.argsort(codes[keep], kind="stable")
+    codes = codes[keep][order]
+    target = df[target_name].to_numpy(dtype=np.float64)[keep][order]
+    preds = df[pred_names].to_numpy(dtype=np.float64)[keep][order]
+    n_groups, n_preds = len(groups), len(pred_names)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.zeros(0, dtype=np.intp)
+    present = codes[starts]
+
+    def segment_sum(values):
+        sums = np.zeros((n_groups,) + values.shape[1:])
+        if len(starts):
+            sums[present] = np.add.reduceat(values, starts, axis=0)
+        return sums
+
+    valid = ~np.isnan(preds) & ~np.isnan(target)[:, None]
+    if valid.all():
+        n_rows = np.repeat(segment_sum(np.ones(len(target)))[:, None], n_preds, axis=1)
+        total_target = np.repeat(segment_sum(target)[:, None], n_preds, axis=1)
+        target_m = target[:, None]
+    else:
+        # dropna is done per prediction: invalid rows contribute nothing to that column
+        preds = np.where(valid, preds, 0.0)
+        target_m = np.where(valid, target[:, None], 0.0)
+        n_rows = segment_sum(valid.astype(np.float64))
+        total_target = segment_sum(target_m)
+    diff = preds - target_m
+    total_predictions = segment_sum(preds)
+    zero_target_predictions = segment_sum(np.where((target == 0)[:, None], preds, 0.0))
+    sum_d = segment_sum(diff)
+    sum_ad = segment_sum(np.abs(diff))
+    sum_se = segment_sum(diff**2)
+
+    if n_products is None:
+        if "n_Products" in df.columns:
+            n_products = pd.Series(df["n_Products"].to_numpy()[keep][order]).groupby(codes).first()
+            n_products = n_products.reindex(range(n_groups)).to_numpy(dtype=np.float64)
+        else:
+            n_products = np.zeros(n_groups)
+    else:
+        n_products = pd.Series(n_products).reindex(groups).fillna(0).to_numpy(dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_target = total_target / n_rows
+        rmad = np.where(mean_target > 0, (sum_ad / n_rows) / mean_target, np.nan)
+        df_stats = pd.DataFrame(
+            {
+                "Total Actuals": total_target.ravel(),
+                "Total Predictions": total_predictions.ravel(),
+                "% predictions for 0 actuals": (zero_target_predictions / total_predictions).ravel(),
+                "Categories": np.repeat(n_products, n_preds),
+                "Mean Actuals": mean_target.ravel(),
+                "Mean Predictions": (total_predictions / n_rows).ravel(),
+                "MD": (sum_d / n_rows).ravel(),
+                "Bias": ((total_predictions - total_target) / total_target).ravel(),
+                "RMAD": rmad.ravel(),
+                "RMSE": np.sqrt(sum_se / n_rows).ravel(),
+            }
+        )
+    if not isinstance(pred_name, str):
+        df_stats["fc_name"] = np.tile(pred_names, n_groups)
+    if group_col is not None:
+        df_stats[group_col] = groups.repeat(n_preds)
+    # slices without any valid row have no KPIs (get_metrics returns None for them)
+    return df_stats[n_rows.ravel() > 0].reset_index(drop=True)
+
+
 def color_negative(val):
     """
     Takes a scalar and returns a string with
@@ -145,6 +342,16 @@ def return_kpis(df_kpi, caption, pred_from, pred_upto):
     )
 
 
+def _as_list(cols):
+    """
+    Column name(s) as list, empty for None
+    """
+    if cols is None:
+        return []
+    return [cols] if isinstance(cols, str) else list(cols)
+
+
+@instrument("kpi", key_arg="var")
 def KPI_per_agg_var_df(
     df,
     var="pg_name_2",
@@ -160,70 +367,147 @@ def KPI_per_agg_var_df(
     product_col=None,
     time_col="C_DATE",
     debug=False,
+    n_jobs=1,
+    cache=None,
 ):
     """
     Dataframe with KPIs
+
+    pred_name_comp can also be a list of prediction columns to compare any number of forecasts.
+    With n_jobs > 1 (-1: all cores) the slices are aggregated on a process pool.
+    With cache (a caching.ResultCache, True for the default one) the KPIs of all slices are cached
+    under the fingerprint of the used columns and the parameters, so repeated calls that only differ
+    in limit or label are answered from the cache.
+    """
+    pred_names = [pred_name] + _as_list(pred_name_comp) + _as_list(pred_name_comp_2)
+    compare = pred_name_comp is not None
+    kpi_args = dict(
+        var=var,
+        target_name=target_name,
+        pred_names=pred_names,
+        compare=compare,
+        granularity_list=list(granularity_list),
+        pred_from=pd.to_datetime(pred_from),
+        pred_upto=pd.to_datetime(pred_upto),
+        product_col=product_col,
+        time_col=time_col,
+    )
+    cache = caching.resolve(cache)
+    if cache is None:
+        df_stats_all, _ = _kpis_per_slice(df, limit=limit, debug=debug, n_jobs=n_jobs, **kpi_args)
+        return df_stats_all
+
+    columns = [var, target_name, time_col] + pred_names + list(granularity_list) + _as_list(product_col)
+    key = cache.key("KPI_per_agg_var_df", df, columns, **kpi_args)
+    df_stats_all, var_list = cache.get_or_compute(
+        key, lambda: _kpis_per_slice(df, limit=None, debug=debug, n_jobs=n_jobs, **kpi_args)
+    )
+    # the slices are independent and filtering keeps the order, so this equals the uncached result
+    return df_stats_all[df_stats_all["category"].isin(var_list.head(limit))].reset_index(drop=True)
+
+
+def _kpis_per_slice(
+    df,
+    var,
+    limit,
+    target_name,
+    pred_names,
+    compare,
+    granularity_list,
+    pred_from,
+    pred_upto,
+    product_col,
+    time_col,
+    debug=False,
+    n_jobs=1,
+):
+    """
+    KPI table of KPI_per_agg_var_df of the limit slices with the highest actuals (all if None) and these slices
     """
-    df_calc = df[(df[time_col] >= pd.to_datetime(pred_from)) & (df[time_col] <= pd.to_datetime(pred_upto))]
-    var_list = (
-        df_calc.groupby([var])
-        .agg({target_name: "sum"})
-        .sort_values(by=target_name, ascending=False)
-        .reset_index()
-        .head(limit)[var]
+    df_calc = df[(df[time_col] >= pred_from) & (df[time_col] <= pred_upto)]
+    var_list = _top_slices(df_calc.groupby([var], observed=True).agg({target_name: "sum"}), var, target_name, limit)
+    df_calc = df_calc[df_calc[var].isin(var_list)]
+    if debug:
+        print("slices:", len(var_list))
+
+    groupvars = list(dict.fromkeys([var] + list(granularity_list)))
+    if parallel.n_workers(n_jobs) == 1:
+        df_PLC, n_products = _aggregate_slices(df_calc, var, groupvars, target_name, pred_names, product_col)
+    else:
+        # every slice is aggregated by exactly one worker, so the result is identical to the serial one
+        slice_rows = df_calc.groupby(var, observed=True).indices
+        shards = parallel.split_slices([slice_rows[var_] for var_ in var_list], parallel.n_workers(n_jobs))
+        results = parallel.map_slices(
+            _aggregate_slices,
+            df_calc,
+            shards,
+            n_jobs=n_jobs,
+            columns=list(dict.fromkeys(groupvars + [target_name] + pred_names + _as_list(product_col))),
+            var=var,
+            groupvars=groupvars,
+            target_name=target_name,
+            pred_names=pred_names,
+            product_col=product_col,
+        )
+        df_PLC = pd.concat([result[0] for result in results])
+        n_products = None if product_col is None else pd.concat([result[1] for result in results])
+
+    df_stats_all = _stats_per_slice(
+        df_PLC,
+        var,
+        var_list,
+        pred_names=pred_names,
+        target_name=target_name,
+        n_products=n_products,
+        compare=compare,
     )
-    df_stats_all = pd.DataFrame()
-    for var_ in var_list:
-        if debug:
-            print("slice:", var_)
-        df_slice = df_calc[(df_calc[var] == var_)]
-        if len(df_slice) > 0:
-            groupvars = granularity_list
-            if pred_name_comp is None:
-                df_PLC = df_slice.groupby(groupvars).agg({target_name: "sum", pred_name: "sum"}).reset_index()
-            else:
-                if pred_name_comp_2 is None:
-                    df_PLC = (
-                        df_slice.groupby(groupvars)
-                        .agg({target_name: "sum", pred_name: "sum", pred_name_comp: "sum"})
-                        .reset_index()
-                    )
-                else:
-                    df_PLC = (
-                        df_slice.groupby(groupvars)
-                        .agg({target_name: "sum", pred_name: "sum", pred_name_comp: "sum", pred_name_comp_2: "sum"})
-                        .reset_index()
-                    )
-
-            if product_col is None:
-                df_PLC["n_Products"] = 0
-            else:
-                df_PLC["n_Products"] = len(df_slice[product_col].unique())
-            if pred_name_comp is None:
-                df_stats = get_metrics(df_PLC, pred_name=pred_name, target_name=target_name)
-                df_stats[var] = var_
-            else:
-                if pred_name_comp_2 is None:
-                    df_stats = get_metrics_comp(
-                        df_PLC, pred_name_1=pred_name, pred_name_2=pred_name_comp, target_name=target_name
-                    )
-                else:
-                    df_stats = get_metrics_comp(
-                        df_PLC,
-                        pred_name_1=pred_name,
-                        pred_name_2=pred_name_comp,
-                        pred_name_3=pred_name_comp_2,
-                        target_name=target_name,
-                    )
-                df_stats[var] = df_stats["fc_name"] + " " + str(var_)
-                # df_stats.drop(columns=["fc_name"], inplace=True)
-            df_stats["category"] = var_
-            # df_stats = df_stats.set_index([var])
-            df_stats_all = pd.concat([df_stats_all,df_stats])
-            df_stats_all = df_stats_all.sort_values(by="Total Actuals", ascending=False)
     if debug:
         print("df_stats_all.shape:", df_stats_all.shape)
-    return df_stats_all
+    return df_stats_all, var_list
+
+
+@instrument("kpi")
+def _aggregate_slices(df_calc, var, groupvars, target_name, pred_names, product_col=None):
+    """
+    Actuals and predictions summed per slice and granularity, number of products per slice
+    """
+    # one groupby over all slices instead of one per slice: the slice column is just another key
+    agg_dict = {col: "sum" for col in [target_name] + pred_names}
+    df_PLC = df_calc.groupby(groupvars, observed=True).agg(agg_dict).reset_index()
+    if product_col is None:
+        n_products = None
+    else:
+        n_products = df_calc.groupby(var, observed=True)[product_col].nunique(dropna=False)
+    return df_PLC, n_products
+
+
+def _top_slices(df_totals, var, target_name, limit):
+    """
+    Slices with the highest total actuals from a table of totals per slice
+    """
+    return df_totals.sort_values(by=target_name, ascending=False).reset_index().head(limit)[var]
+
+
+@instrument("kpi")
+def _stats_per_slice(df_PLC, var, var_list, pred_names, target_name, n_products=None, compare=False):
+    """
+    KPI table of KPI_per_agg_var_df from actuals and predictions aggregated per slice and granularity
+    """
+    df_stats_all = get_metrics_grouped(
+        df_PLC, var, pred_name=pred_names, target_name=target_name, n_products=n_products
+    ).rename(columns={var: "category"})
+    if compare:
+        df_stats_all[var] = df_stats_all["fc_name"] + " " + df_stats_all["category"].astype(str)
+    else:
+        df_stats_all = df_stats_all.drop(columns=["fc_name"])
+        df_stats_all[var] = df_stats_all["category"]
+    df_stats_all = df_stats_all[[col for col in df_stats_all.columns if col != "category"] + ["category"]]
+
+    # slices in order of var_list, predictions in given order, then by actuals
+    slice_order = pd.Series(range(len(var_list)), index=var_list.values).reindex(df_stats_all["category"])
+    df_stats_all = df_stats_all.iloc[np.argsort(slice_order.to_numpy(), kind="stable")]
+    df_stats_all = df_stats_all.sort_values(by="Total Actuals", ascending=False, kind="stable")
+    return df_stats_all.reset_index(drop=True)
 
 
 # get KPI per some level
@@ -242,9 +526,11 @@ def KPI_per_agg_var(
     product_col=None,
     time_col="C_DATE",
     debug=False,
+    n_jobs=1,
+    cache=None,
 ):
     """
-    Nicely formated table with KPIs per aggregated level
+    Nicely formated table with KPIs per aggregated level, cache as in KPI_per_agg_var_df
     """
     df_stats_all = KPI_per_agg_var_df(
         df=df,
@@ -261,6 +547,8 @@ def KPI_per_agg_var(
         product_col=product_col,
         time_col=time_col,
         debug=debug,
+        n_jobs=n_jobs,
+        cache=cache,
     )
     if debug:
         print(df_stats_all.shape)
@@ -0,0 +1,153 @@
+import pandas as pd
+
+import kpi_calculation as kpi  # package
+
+
+def needs_compaction(partials, n_compacted, compact_rows):
+    """
+    True if the rows buffered since the last compaction exceed compact_rows and the compacted state
+
+    Args:
+        partials (list): buffered partial results, the first n_compacted rows are the compacted state
+        n_compacted (int): rows of the result of the last compaction
+        compact_rows (int): minimum number of new rows of a compaction
+
+    A compaction re-groups the state with the new rows, so compacting only after as many new rows as
+    the state has keeps the total cost linear in the number of rows, also when the number of distinct
+    groups alone exceeds compact_rows.
+    """
+    pending = sum(len(partial) for partial in partials) - n_compacted
+    return pending > max(compact_rows, n_compacted)
+
+
+class KPIAccumulator:
+    """
+    Incremental version of kpi_calculation.KPI_per_agg_var_df for data that does not fit in memory
+
+    The KPIs are computed on actuals and predictions summed to (var, granularity_list) level,
+    and deviations of a group are only known once the group is complete. The mergeable state
+    therefore is the per-group sums of actuals and predictions (plus per-slice totals and the
+    distinct products), which is much smaller than the rows. Row counts, sums, absolute and
+    squared deviations per slice are reduced from it in finalize with the same definitions
+    as get_metrics.
+
+    Example:
+        acc = KPIAccumulator(var="CATEGORIES", target_name="PRICE", pred_name="ML FORECAST",
+                             granularity_list=["WEEK", "CATEGORIES"], pred_from="2021-01-01", pred_upto="2021-12-31")
+        for chunk in pd.read_csv("evaluation.csv", parse_dates=["C_DATE"], chunksize=1_000_000):
+            acc.update(chunk)
+        df_kpi = acc.finalize(limit=10)
+    """
+
+    def __init__(
+        self,
+        var="pg_name_2",
+        target_name="Quantity",
+        pred_name="pred_mean_causal_h7",
+        pred_name_comp=None,
+        pred_name_comp_2=None,
+        granularity_list=["p_code", "U_CUSTOMER_AGGREGATION_NAME", "U_REGION_DESC_HIER", "THIS_WEEK_MONDAY"],
+        pred_from="2022-01-01",
+        pred_upto="2022-02-01",
+        product_col=None,
+        time_col="C_DATE",
+        compact_rows=1_000_000,
+    ):
+        """
+        Args as in KPI_per_agg_var_df, compact_rows: number of new partial rows after which they are summed up
+        (at least as many as the summed up state has, see needs_compaction)
+        """
+        self.var = var
+        self.target_name = target_name
+        self.pred_name_comp = pred_name_comp
+        self.pred_names = [pred_name] + kpi._as_list(pred_name_comp) + kpi._as_list(pred_name_comp_2)
+        self.groupvars = list(dict.fromkeys([var] + list(granularity_list)))
+        self.pred_from = pd.to_datetime(pred_from)
+        self.pred_upto = pd.to_datetime(pred_upto)
+        self.product_col = product_col
+        self.time_col = time_col
+        self.compact_rows = compact_rows
+        self.n_rows = 0
+        self._partials = []
+        self._n_compacted = 0
+        self._totals = []
+        self._products = []
+
+    def _config(self):
+        return (
+            self.var,
+            self.target_name,
+            self.pred_names,
+            self.groupvars,
+            self.pred_from,
+            self.pred_upto,
+            self.product_col,
+            self.time_col,
+        )
+
+    def update(self, df):
+        """
+        Add a chunk of rows
+        """
+        df = df[(df[self.time_col] >= self.pred_from) & (df[self.time_col] <= self.pred_upto)]
+        self.n_rows += len(df)
+        agg_dict = {col: "sum" for col in [self.target_name] + self.pred_names}
+        self._partials.append(df.groupby(self.groupvars, observed=True).agg(agg_dict).reset_index())
+        self._totals.append(df.groupby(self.var, observed=True).agg({self.target_name: "sum"}))
+        if self.product_col is not None:
+            self._products.append(df[[self.var, self.product_col]].drop_duplicates())
+        if needs_compaction(self._partials, self._n_compacted, self.compact_rows):
+            self.compact()
+        return self
+
+    def merge(self, other):
+        """
+        Add the state of another accumulator (e.g. from a parallel worker) with the same settings
+        """
+        if self._config() != other._config():
+            raise ValueError("Can only merge accumulators with the same settings")
+        self.n_rows += other.n_rows
+        self._partials += other._partials
+        self._totals += other._totals
+        self._products += other._products
+        return self
+
+    def compact(self):
+        """
+        Sum up the buffered partial results
+        """
+        agg_dict = {col: "sum" for col in [self.target_name] + self.pred_names}
+        if len(self._partials) > 1:
+            self._partials = [
+                pd.concat(self._partials).groupby(self.groupvars, observed=True).agg(agg_dict).reset_index()
+            ]
+        if len(self._totals) > 1:
+            self._totals = [pd.concat(self._totals).groupby(level=0, observed=True).sum()]
+        if len(self._products) > 1:
+            self._products = [pd.concat(self._products).drop_duplicates()]
+        self._n_compacted = len(self._partials[0]) if self._partials else 0
+        return self
+
+    def finalize(self, limit=100):
+        """
+        Table of KPI_per_agg_var_df for the rows added so far
+        """
+        self.compact()
+        if not self._partials:
+            return pd.DataFrame()
+        var_list = kpi._top_slices(self._totals[0], self.var, self.target_name, limit)
+        df_PLC = self._partials[0]
+        df_PLC = df_PLC[df_PLC[self.var].isin(var_list)]
+        if self.product_col is None:
+            n_products = None
+        else:
+            n_products = self._products[0].groupby(self.var, observed=True)[self.product_col].nunique(dropna=False)
+        return kpi._stats_per_slice(
+            df_PLC,
+            self.var,
+            var_list,
+            pred_names=self.pred_names,
+            target_name=self.target_name,
+            n_products=n_products,
+            compare=self.pred_name_comp is not None,
+        )
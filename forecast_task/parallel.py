@@ -0,0 +1,91 @@
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# frame inherited by forked workers, set only while a pool is running
+_shared_frame = None
+
+
+def n_workers(n_jobs):
+    """
+    Number of processes for n_jobs (-1: all cores)
+    """
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return n_jobs
+
+
+def split_slices(slice_rows, n_shards):
+    """
+    Distribute slices over shards round-robin
+
+    Args:
+        slice_rows (list(np.array)): positional row indices per slice, ordered by size
+        n_shards (int): number of shards
+
+    Returns:
+        list of positional row indices per shard (sorted, empty shards dropped)
+    """
+    shards = []
+    for shard in range(n_shards):
+        rows = slice_rows[shard::n_shards]
+        if len(rows) > 0:
+            shards.append(np.sort(np.concatenate(rows)))
+    return shards
+
+
+def _call_on_shared(func, rows, kwargs):
+    return func(_shared_frame.iloc[rows], **kwargs)
+
+
+def _call(func, df_slice, kwargs):
+    return func(df_slice, **kwargs)
+
+
+def map_slices(func, df, slice_rows, n_jobs=1, columns=None, slice_kwargs=None, **kwargs):
+    """
+    Apply func to row slices of df on a process pool, results are in the order of slice_rows
+
+    With the fork start method (Linux) the workers inherit df from the parent process and
+    only the row indices are sent to them. Otherwise each worker gets its slice pickled,
+    projected to columns.
+
+    Args:
+        func: module level function func(df_slice, **kwargs)
+        df (DataFrame): input data
+        slice_rows (list(np.array)): positional row indices of each slice
+        n_jobs (int): number of processes, -1 for all cores, 1 to run in the current process
+        columns (list(str)): columns needed by func
+        slice_kwargs (list(dict)): additional keyword arguments of func per slice
+        kwargs: passed to func
+
+    Returns:
+        list with the result per slice
+    """
+    global _shared_frame
+
+    n_jobs = min(n_workers(n_jobs), len(slice_rows))
+    if slice_kwargs is None:
+        slice_kwargs = [{}] * len(slice_rows)
+    calls = [(rows, {**kwargs, **extra}) for rows, extra in zip(slice_rows, slice_kwargs)]
+    if n_jobs <= 1:
+        return [func(df.iloc[rows], **call_kwargs) for rows, call_kwargs in calls]
+
+    if "fork" in mp.get_all_start_methods():
+        _shared_frame = df
+        try:
+            with ProcessPoolExecutor(n_jobs, mp_context=mp.get_context("fork")) as pool:
+                futures = [pool.submit(_call_on_shared, func, rows, call_kwargs) for rows, call_kwargs in calls]
+                return [future.result() for future in futures]
+        finally:
+            _shared_frame = None
+
+    if columns is not None:
+        df = df[columns]
+    with ProcessPoolExecutor(n_jobs) as pool:
+        futures = [pool.submit(_call, func, df.iloc[rows], call_kwargs) for rows, call_kwargs in calls]
+        return [future.result() for future in futures]
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+from kpi_streaming import needs_compaction
+
+# relative accuracy of the quantiles
+DEFAULT_ALPHA = 0.005
+# values with a smaller absolute value are counted as 0
+MIN_VALUE = 1e-9
+
+
+def _gamma(alpha):
+    return (1 + alpha) / (1 - alpha)
+
+
+def bucket_keys(values, alpha=DEFAULT_ALPHA, min_value=MIN_VALUE):
+    """
+    Logarithmic bucket of every value, the keys are ordered like the values
+
+    Bucket k > 0 holds values in (min_value * gamma^(k-2), min_value * gamma^(k-1)] with
+    gamma = (1 + alpha) / (1 - alpha), negative values get -k and |value| < min_value gets 0.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.abs(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        idx = np.ceil(np.log(magnitude / min_value) / np.log(_gamma(alpha)))
+    keys = np.where(magnitude >= min_value, idx + 1, 0)
+    return (np.sign(values) * keys).astype(np.int32)
+
+
+def bucket_values(keys, alpha=DEFAULT_ALPHA, min_value=MIN_VALUE):
+    """
+    Representative value of the buckets, within relative error alpha of every value in the bucket
+    """
+    keys = np.asarray(keys)
+    gamma = _gamma(alpha)
+    magnitude = np.where(keys != 0, min_value * 2 * gamma ** (np.abs(keys) - 1.0) / (gamma + 1), 0.0)
+    return np.sign(keys) * magnitude
+
+
+class GroupedQuantileSketch:
+    """
+    Mergeable quantile sketch per group (e.g. category, space bin, period)
+
+    Values are counted in logarithmic buckets (DDSketch), so the state per group is a bucket
+    histogram of at most log(max|x| / min|x|) / log(gamma) + 1 buckets per sign, independent of
+    the number of values, and sketches of chunks or workers are merged by adding the counts.
+
+    Error bound: every quantile (with pandas' linear interpolation between the neighbouring
+    ranks) is within relative error alpha of the exact quantile, i.e.
+    |approx - exact| <= alpha * |exact| for values of one sign (alpha=0.005: 0.5%).
+
+    Example:
+        sketch = GroupedQuantileSketch(["CATEGORIES", "SPACE_binned"])
+        for chunk in pd.read_csv("forecasting_cleaned.csv", chunksize=100_000):
+            sketch.update(chunk, "PRICE")
+        medians = sketch.quantile(0.5)
+    """
+
+    def __init__(self, keys, alpha=DEFAULT_ALPHA, min_value=MIN_VALUE, compact_rows=1_000_000):
+        """
+        Args:
+            keys (list(str)): group columns
+            alpha (float): relative accuracy
+            min_value (float): absolute values below are counted as 0
+            compact_rows (int): number of new bucket counts after which they are summed up (at least as
+                many as the summed up counts, see kpi_streaming.needs_compaction)
+        """
+        self.keys = list(keys)
+        self.alpha = alpha
+        self.min_value = min_value
+        self.compact_rows = compact_rows
+        self.n_values = 0
+        self._partials = []
+        self._n_compacted = 0
+
+    def _config(self):
+        return self.keys, self.alpha, self.min_value
+
+    def update(self, df, value_col):
+        """
+        Add the values of value_col of a chunk of rows, NaN values are skipped
+        """
+        values = df[value_col].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values)
+        df_keys = df.loc[valid, self.keys].assign(_bucket=bucket_keys(values[valid], self.alpha, self.min_value))
+        self.n_values += int(valid.sum())
+        self._partials.append(df_keys.groupby(self.keys + ["_bucket"], observed=True).size())
+        if needs_compaction(self._partials, self._n_compacted, self.compact_rows):
+            self.compact()
+        return self
+
+    def merge(self, other):
+        """
+        Add the counts of another sketch (e.g. from a parallel worker) with the same settings
+        """
+        if self._config() != other._config():
+            raise ValueError("Can only merge sketches with the same settings")
+        self.n_values += other.n_values
+        self._partials += other._partials
+        return self
+
+    def compact(self):
+        """
+        Sum up the buffered bucket counts
+        """
+        if len(self._partials) > 1:
+            counts = pd.concat(self._partials)
+            self._partials = [counts.groupby(level=list(range(counts.index.nlevels)), observed=True).sum()]
+        self._n_compacted = len(self._partials[0]) if self._partials else 0
+        return self
+
+    def counts(self):
+        """
+        Bucket counts indexed by keys and bucket, sorted
+        """
+        self.compact()
+        if not self._partials:
+            return pd.Series(dtype=np.int64)
+        return self._partials[0].sort_index()
+
+    def quantile(self, q=0.5):
+        """
+        Approximate quantile q per group
+
+        Returns:
+            pd.Series indexed by keys
+        """
+        counts = self.counts()
+        if len(counts) == 0:
+            return pd.Series(dtype=np.float64)
+        df_counts = counts.rename("count").reset_index()
+        group_ids = df_counts.groupby(self.keys, sort=False, observed=True).ngroup().to_numpy()
+        starts = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]])
+        count = df_counts["count"].to_numpy()
+        cumulative = np.cumsum(count)
+        n = np.add.reduceat(count, starts)
+        offset = cumulative[starts] - count[starts]
+
+        rank = (n - 1) * q
+        rank_low = np.floor(rank)
+        rank_high = np.ceil(rank)
+        values = bucket_values(df_counts["_bucket"].to_numpy(), self.alpha, self.min_value)
+        low = values[np.searchsorted(cumulative, offset + rank_low, side="right")]
+        high = values[np.searchsorted(cumulative, offset + rank_high, side="right")]
+
+        index = pd.MultiIndex.from_frame(df_counts.iloc[starts][self.keys])
+        if len(self.keys) == 1:
+            index = index.get_level_values(0)
+        return pd.Series(low + (rank - rank_low) * (high - low), index=index, name=q)
+
+    def median(self):
+        """
+        Approximate median per group
+        """
+        return self.quantile(0.5)
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+# compact dtype per column of the forecasting frames: cleaned data, enrich_day features and forecasts
+SCHEMA = {
+    "CATEGORIES": "category",
+    "SPACE_binned": "category",
+    "total": "category",
+    "WEEKDAY_NAME": "category",
+    "CATEGORY_N_DATES": "int16",
+    "ISODAY": "int16",
+    "WEEKDAY": "int8",
+    "YEAR": "int16",
+    "WEEK": "int8",
+    "MONTH_DAY": "int8",
+    "MONTH": "int8",
+    "WEEK_OF_MONTH": "int8",
+    "TIMEDELTA": "int16",
+    "PRICE": "float32",
+    "SPACE": "float32",
+    "median_PRICE_CATEGORY_SPACE_binned_DATE": "float32",
+    "BASELINE": "float32",
+    "ML FORECAST": "float32",
+}
+
+
+def _cast(values, dtype, float_rtol=0.0):
+    """
+    values as dtype if that is safe, None otherwise
+    """
+    if dtype == "category":
+        return values.astype("category")
+    dtype = np.dtype(dtype)
+    if not pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+        return None
+    array = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    if dtype.kind in "iu":
+        # missing values or values out of range stay in the wide dtype
+        info = np.iinfo(dtype)
+        if len(array) and (np.isnan(array).any() or array.min() < info.min or array.max() > info.max):
+            return None
+        if not np.array_equal(np.round(array), array):
+            return None
+        return values.astype(dtype)
+    compact = array.astype(dtype)
+    with np.errstate(over="ignore", invalid="ignore"):
+        error = np.abs(compact.astype(np.float64) - array)
+        safe = np.all((error <= float_rtol * np.abs(array)) | np.isnan(array))
+    return pd.Series(compact, index=values.index, name=values.name) if safe else None
+
+
+def compact(df, columns=None, schema=None, float_rtol=0.0, copy=True):
+    """
+    Cast the columns of df to the compact dtypes of schema where it is safe
+
+    Categoricals keep the values, integer columns are only downcast if all values fit (and none
+    is missing) and float32 is only used if every value round trips within float_rtol (relative,
+    0: exactly, e.g. prices in whole units). Columns that are missing in df, already have their
+    dtype or are not safe to cast are left unchanged.
+
+    Args:
+        df (DataFrame): input dataframe
+        columns (list(str)): columns to cast, all columns of schema if None
+        schema (dict): column -> dtype ("category", "int8", "float32", ...), SCHEMA if None
+        float_rtol (float): accepted relative error of float32 values
+        copy (bool): cast the columns of a (shallow) copy of df, otherwise df is modified in place
+
+    Returns:
+        df with the compact columns
+    """
+    schema = SCHEMA if schema is None else schema
+    columns = list(schema) if columns is None else columns
+    if copy:
+        df = df.copy(deep=False)
+    for col in columns:
+        if col not in df.columns or col not in schema or df[col].dtype == schema[col]:
+            continue
+        values = _cast(df[col], schema[col], float_rtol)
+        if values is not None:
+            df[col] = values
+    return df
+
+
+def mismatches(df, schema=None):
+    """
+    Columns of df with another dtype than in schema (SCHEMA if None), e.g. categoricals upcast to object
+
+    Returns:
+        dict column -> (dtype, dtype of schema)
+    """
+    schema = SCHEMA if schema is None else schema
+    return {
+        col: (str(df[col].dtype), schema[col])
+        for col in df.columns
+        if col in schema and str(df[col].dtype) != schema[col]
+    }
+
+
+def memory_savings(df_before, df_after):
+    """
+    Memory (bytes, including the strings of object columns) and dtype per column before and after compact
+
+    Returns:
+        DataFrame indexed by column with a "Total" row, saved is the fraction of memory saved
+    """
+    report = pd.DataFrame(
+        {
+            "dtype_before": df_before.dtypes.astype(str),
+            "dtype_after": df_after.dtypes.reindex(df_before.columns).astype(str),
+            "bytes_before": df_before.memory_usage(deep=True, index=False),
+            "bytes_after": df_after.memory_usage(deep=True, index=False).reindex(df_before.columns),
+        }
+    )
+    report.loc["Total"] = ["", "", report["bytes_before"].sum(), report["bytes_after"].sum()]
+    report["saved"] = 1 - report["bytes_after"] / report["bytes_before"]
+    return report
@@ -0,0 +1,424 @@
+"""
+Local HTTP serving of the price forecast
+
+Usage (from forecast_task):
+    python serving.py --model-dir models/price --train --data forecasting_cleaned.csv
+    curl -X POST localhost:8000/predict -d '{"DATE": "2022-01-03", "SPACE": 72, "CATEGORIES": "APARTMENT, FLAT"}'
+
+POST /predict takes one request or a list of requests (DATE, SPACE, CATEGORIES) and returns
+the ML FORECAST and BASELINE per request, GET /health returns the model info.
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+import features as ftr  # package
+import timeseries_plots as tsp  # package
+import tuning  # package
+from baseline import SMALL_BATCH, BaselineModel
+
+CALENDAR_COLUMNS = ["ISODAY", "WEEKDAY", "YEAR", "WEEK", "MONTH_DAY", "MONTH", "WEEK_OF_MONTH", "TIMEDELTA"]
+# columns of X_train in 2_Modelling.ipynb
+FEATURE_COLUMNS = (
+    ["SPACE"] + CALENDAR_COLUMNS + ["median_PRICE_CATEGORY_SPACE_binned_last_YEAR", "CATEGORIES_ID"]
+)
+# dates with cached calendar features
+MAX_CACHED_DATES = 100_000
+
+
+class PriceModel:
+    """
+    XGBoost price model of 2_Modelling.ipynb with the lookup tables its features need
+
+    Features of a request are computed without pandas merges: calendar features are cached per
+    date, the category id is a hash lookup and the last year median comes from a dense
+    (year x category x space bin) table, like the baseline table of BaselineModel.
+
+    Example:
+        model = PriceModel.fit(df, date_upto="2020-12-31")
+        model.save("models/price")
+        model = PriceModel.load("models/price")
+        model.predict(["2022-01-03"], [72.0], ["APARTMENT, FLAT"])
+    """
+
+    def __init__(self, regressor, baseline, categories, yearly_table, first_year, origin):
+        """
+        Args:
+            regressor (xgb.XGBRegressor): model trained on FEATURE_COLUMNS
+            baseline (BaselineModel): baseline table
+            categories (list(str)): sorted categories, their position is CATEGORIES_ID
+            yearly_table (np.array): median price per year, category id and space bin
+            first_year (int): year of yearly_table[0]
+            origin (str): date TIMEDELTA is counted from
+        """
+        self.regressor = regressor
+        self.baseline = baseline
+        self.categories = pd.Index(categories)
+        self._category_ids = {cat: i for i, cat in enumerate(self.categories)}
+        self.yearly_table = yearly_table
+        self.first_year = int(first_year)
+        self.origin = pd.Timestamp(origin)
+        self._calendar_cache = {}
+
+    @classmethod
+    def from_data(
+        cls,
+        df,
+        date_upto="2020-12-31",
+        date_col="DATE",
+        median_col="median_PRICE_CATEGORY_SPACE_binned_DATE",
+        regressor=None,
+    ):
+        """
+        Build the lookup tables from df, the regressor can be trained with fit or set later
+
+        Args:
+            df (DataFrame): cleaned data (forecasting_cleaned.csv)
+            date_upto (str): last date of the baseline, format 'YYYY-MM-DD'
+            date_col (str): column with dates
+            median_col (str): column with median prices per category, space bin and date
+            regressor (xgb.XGBRegressor): model trained on FEATURE_COLUMNS
+        """
+        df = tsp.enrich_day(df[[date_col, "SPACE", "CATEGORIES", median_col]].copy(), time_col=date_col)
+        baseline = BaselineModel().fit(df, date_upto=date_upto, target_col=median_col, date_col=date_col)
+
+        categories = pd.Index(np.sort(df["CATEGORIES"].unique()))
+        df["CATEGORIES_ID"] = categories.get_indexer(df["CATEGORIES"])
+        df["SPACE_BIN"] = baseline.space_bin(df["SPACE"].to_numpy())
+        df = df[df["SPACE_BIN"] >= 0]
+        medians = ftr.yearly_medians(df, target_col=median_col, keys=["CATEGORIES_ID", "SPACE_BIN"])
+        first_year = int(df["YEAR"].min())
+        n_years = int(df["YEAR"].max()) - first_year + 1
+        yearly_table = np.full((n_years, len(categories), len(baseline.bins) - 1), np.nan)
+        yearly_table[
+            medians.index.get_level_values("YEAR") - first_year,
+            medians.index.get_level_values("CATEGORIES_ID"),
+            medians.index.get_level_values("SPACE_BIN"),
+        ] = medians.to_numpy()
+        return cls(regressor, baseline, categories, yearly_table, first_year, df[date_col].min())
+
+    def features_frame(self, df, date_col="DATE"):
+        """
+        Matrix of FEATURE_COLUMNS for the rows of df
+        """
+        return self.features(df[date_col].to_numpy(), df["SPACE"].to_numpy(), df["CATEGORIES"].to_numpy())
+
+    @classmethod
+    def fit(
+        cls,
+        df,
+        date_upto="2020-12-31",
+        target_col="PRICE",
+        date_col="DATE",
+        median_col="median_PRICE_CATEGORY_SPACE_binned_DATE",
+        **params,
+    ):
+        """
+        Build the tables from df and train the regressor on the rows up to date_upto
+
+        Args as in from_data, plus:
+            target_col (str): column to forecast
+            params: XGBRegressor parameters (e.g. best_params_ of the grid search)
+        """
+        model = cls.from_data(df, date_upto=date_upto, date_col=date_col, median_col=median_col)
+        df_train = df[df[date_col] <= date_upto]
+        params = {**tuning.BASE_PARAMS, **params}
+        model.regressor = xgb.XGBRegressor(**params).fit(model.features_frame(df_train, date_col), df_train[target_col])
+        return model
+
+    def _calendar(self, dates):
+        """
+        CALENDAR_COLUMNS for an array of dates (datetime64 or 'YYYY-MM-DD' strings)
+        """
+        dates = list(dates)
+        # evicted before looking for missing dates, so every date of the batch is in the cache below
+        if len(self._calendar_cache) > MAX_CACHED_DATES:
+            self._calendar_cache.clear()
+        missing = [date for date in dict.fromkeys(dates) if date not in self._calendar_cache]
+        if missing:
+            calendar = tsp.calendar_features(pd.DatetimeIndex(missing), CALENDAR_COLUMNS, origin=self.origin)
+            rows = np.column_stack([calendar[col] for col in CALENDAR_COLUMNS]).astype(np.float64)
+            self._calendar_cache.update(zip(missing, rows))
+        return np.stack([self._calendar_cache[date] for date in dates])
+
+    def features(self, dates, space, categories):
+        """
+        Matrix of FEATURE_COLUMNS, NaN for unknown categories and spaces outside of the bins
+        """
+        space = np.asarray(space, dtype=np.float64)
+        calendar = self._calendar(dates)
+        if len(categories) < SMALL_BATCH:
+            category_id = np.array([self._category_ids.get(cat, -1) for cat in categories], dtype=np.intp)
+        else:
+            category_id = self.categories.get_indexer(pd.Index(categories))
+        bin_idx = self.baseline.space_bin(space)
+        year_idx = calendar[:, CALENDAR_COLUMNS.index("YEAR")].astype(np.int64) - 1 - self.first_year
+        valid = (category_id >= 0) & (bin_idx >= 0) & (year_idx >= 0) & (year_idx < len(self.yearly_table))
+        last_year = np.full(len(space), np.nan)
+        last_year[valid] = self.yearly_table[year_idx[valid], category_id[valid], bin_idx[valid]]
+        return np.column_stack([space, calendar, last_year, np.where(category_id >= 0, category_id, np.nan)])
+
+    def predict(self, dates, space, categories):
+        """
+        ML FORECAST and BASELINE for arrays of dates, spaces and categories, NaN for unknown categories
+        """
+        X = self.features(dates, space, categories)
+        pred = self.regressor.get_booster().inplace_predict(X).astype(np.float64)
+        pred[np.isnan(X[:, -1])] = np.nan
+        return {"ML FORECAST": pred, "BASELINE": self.baseline.predict(categories, space)}
+
+    def predict_records(self, records):
+        """
+        Predictions for a list of dicts with DATE, SPACE and CATEGORIES, NaN as None
+        """
+        pred = self.predict(
+            [record["DATE"] for record in records],
+            [record["SPACE"] for record in records],
+            [record["CATEGORIES"] for record in records],
+        )
+        return [
+            {col: (None if np.isnan(values[i]) else float(values[i])) for col, values in pred.items()}
+            for i in range(len(records))
+        ]
+
+    def save(self, path):
+        """
+        Store the model in directory path
+        """
+        os.makedirs(path, exist_ok=True)
+        self.regressor.save_model(os.path.join(path, "model.json"))
+        self.baseline.save(os.path.join(path, "baseline.npz"))
+        np.savez(
+            os.path.join(path, "tables.npz"),
+            categories=np.asarray(self.categories, dtype=str),
+            yearly_table=self.yearly_table,
+            first_year=self.first_year,
+            origin=str(self.origin.date()),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a model stored with save
+        """
+        regressor = xgb.XGBRegressor()
+        regressor.load_model(os.path.join(path, "model.json"))
+        tables = np.load(os.path.join(path, "tables.npz"))
+        return cls(
+            regressor,
+            BaselineModel.load(os.path.join(path, "baseline.npz")),
+            tables["categories"].tolist(),
+            tables["yearly_table"],
+            int(tables["first_year"]),
+            str(tables["origin"]),
+        )
+
+
+class MicroBatcher:
+    """
+    Collects requests of concurrent threads into single predict calls
+
+    A batch is closed when it has max_batch_size records or max_wait seconds after its first request.
+    """
+
+    def __init__(self, predict_records, max_batch_size=256, max_wait=0.002):
+        """
+        Args:
+            predict_records: function list(record) -> list(result)
+            max_batch_size (int): max number of records per predict call
+            max_wait (float): max seconds the first request of a batch waits for others
+        """
+        self.predict_records = predict_records
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.n_batches = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, records):
+        """
+        Results for a list of records, blocks until the batch with them is predicted
+        """
+        future = Future()
+        self._queue.put((records, future))
+        return future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        n_records = len(item[0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_records < self.max_batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+            n_records += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            records = [record for request, _ in batch for record in request]
+            try:
+                results = self.predict_records(records)
+            except Exception:
+                self._run_separately(batch)
+                continue
+            self.n_batches += 1
+            start = 0
+            for request, future in batch:
+                future.set_result(results[start : start + len(request)])
+                start += len(request)
+
+    def _run_separately(self, batch):
+        """
+        Predict the requests of a failed batch one by one, so a bad request only fails its own future
+        """
+        for request, future in batch:
+            try:
+                results = self.predict_records(request)
+            except Exception as error:
+                future.set_exception(error)
+                continue
+            self.n_batches += 1
+            future.set_result(results)
+
+
+def parse_record(record):
+    """
+    Check that record is a dict with a valid DATE, a numeric SPACE and CATEGORIES
+
+    Raises:
+        ValueError / TypeError describing the first invalid field
+    """
+    if not isinstance(record, dict):
+        raise TypeError(f"Records must be objects, got {type(record).__name__}")
+    missing = [col for col in ["DATE", "SPACE", "CATEGORIES"] if col not in record]
+    if missing:
+        raise ValueError(f"Missing fields {missing}")
+    try:
+        date = pd.Timestamp(record["DATE"])
+    except (ValueError, TypeError) as error:
+        raise ValueError(f"Invalid DATE {record['DATE']!r}: {error}") from None
+    if pd.isna(date):
+        raise ValueError(f"Invalid DATE {record['DATE']!r}")
+    if isinstance(record["SPACE"], bool):
+        raise ValueError(f"Invalid SPACE {record['SPACE']!r}")
+    try:
+        float(record["SPACE"])
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid SPACE {record['SPACE']!r}") from None
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    POST /predict and GET /health, the server has the attributes batcher and info
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._send_json(200, {"status": "ok", **self.server.info})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            records = request if isinstance(request, list) else [request]
+            for record in records:
+                parse_record(record)
+        except (ValueError, TypeError) as error:
+            self._send_json(400, {"error": str(error)})
+            return
+        try:
+            results = self.server.batcher.submit(records)
+        except Exception as error:
+            self._send_json(500, {"error": f"Prediction failed: {error}"})
+            return
+        self._send_json(200, results if isinstance(request, list) else results[0])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(model, host="127.0.0.1", port=8000, max_batch_size=256, max_wait=0.002):
+    """
+    HTTP server predicting with model, the model is warmed up with one request before
+
+    Returns:
+        ThreadingHTTPServer, run it with serve_forever()
+    """
+    model.predict_records([{"DATE": str(model.origin.date()), "SPACE": 1.0, "CATEGORIES": model.categories[0]}])
+    server = ThreadingHTTPServer((host, port), PredictionHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(model.predict_records, max_batch_size=max_batch_size, max_wait=max_wait)
+    server.info = {"categories": len(model.categories), "max_batch_size": max_batch_size}
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-dir", default="models/price")
+    parser.add_argument("--train", action="store_true", help="train the model on --data before serving")
+    parser.add_argument("--data", default="forecasting_cleaned.csv")
+    parser.add_argument("--date-upto", default="2020-12-31", help="last training date")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.train:
+        PriceModel.fit(pd.read_csv(args.data, parse_dates=["DATE"]), date_upto=args.date_upto).save(args.model_dir)
+    server = make_server(
+        PriceModel.load(args.model_dir),
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait_ms / 1000,
+    )
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.batcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,115 @@
+import os
+import re
 import warnings
 
 import altair as alt
 import pandas as pd
 import numpy as np
 
+import caching  # package
+import parallel  # package
+import schema  # package
 import style as stl  # package
+from downsampling import downsample, write_chart_data
+from instrumentation import instrument
+from quantile_sketch import GroupedQuantileSketch
 
 warnings.filterwarnings("ignore")
 
-def enrich_day(df, time_col="C_DATE"):
+ENRICH_DAY_COLUMNS = [
+    "ISODAY",
+    "WEEKDAY",
+    "WEEKDAY_NAME",
+    "THIS_WEEK_MONDAY",
+    "YEAR",
+    "WEEK",
+    "MONTH_DAY",
+    "MONTH",
+    "WEEK_OF_MONTH",
+    "TIMEDELTA",
+]
+
+# agg of a median from quantile_sketch, within 0.5% of the exact median and mergeable
+APPROX_MEDIAN = "approx_median"
+
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def calendar_features(dates, columns=ENRICH_DAY_COLUMNS, origin=None):
     """
-    Add time related features from time_col
+    Time related features of enrich_day for a DatetimeIndex of (distinct) dates
+
+    TIMEDELTA counts weeks from origin, the first of dates if None
+
+    Returns:
+        dict column -> np.array / Categorical aligned with dates
+    """
+    features = {}
+    weekday = dates.weekday.to_numpy().astype(np.int8)
+    if "ISODAY" in columns:
+        features["ISODAY"] = dates.dayofyear.to_numpy().astype(np.int16)
+    if "WEEKDAY" in columns:
+        features["WEEKDAY"] = weekday
+    if "WEEKDAY_NAME" in columns:
+        features["WEEKDAY_NAME"] = pd.Categorical.from_codes(weekday, categories=WEEKDAY_NAMES)
+    if "THIS_WEEK_MONDAY" in columns:
+        features["THIS_WEEK_MONDAY"] = (dates - pd.to_timedelta(weekday, "D")).to_numpy()
+    if "YEAR" in columns or "WEEK" in columns:
+        isocalendar = dates.isocalendar()
+        features["YEAR"] = isocalendar["year"].to_numpy().astype(np.int16)
+        features["WEEK"] = isocalendar["week"].to_numpy().astype(np.int8)
+    if "MONTH_DAY" in columns:
+        features["MONTH_DAY"] = dates.day.to_numpy().astype(np.int8)
+    if "MONTH" in columns:
+        features["MONTH"] = dates.month.to_numpy().astype(np.int8)
+    if "WEEK_OF_MONTH" in columns:
+        features["WEEK_OF_MONTH"] = dates.day.to_numpy().astype(np.int8) // 7
+    if "TIMEDELTA" in columns:
+        # weeks, for data weighting in training
+        origin = dates.min() if origin is None else pd.Timestamp(origin)
+        features["TIMEDELTA"] = ((dates - origin).days.to_numpy() // 7).astype(np.int16)
+    return {col: features[col] for col in columns}
+
+
+@instrument("features")
+def enrich_day(df, time_col="C_DATE", columns=None, force=False):
     """
-    df["ISODAY"] = df[time_col].dt.dayofyear
-    df["WEEKDAY"] = df[time_col].dt.weekday.astype(np.int8)
-    df["WEEKDAY_NAME"] = df[time_col].dt.day_name()
-    #df["PREVIOUS_WEEK_SATURDAY"] = df[time_col] - pd.to_timedelta(2 + df["WEEKDAY"].values, "D")
+    Add time related features from time_col
 
-    df["THIS_WEEK_MONDAY"] = df[time_col] - pd.to_timedelta(df["WEEKDAY"].values, "D")
+    Features are computed once per distinct date and broadcast to the rows via the date codes,
+    with compact dtypes (int8/int16, categorical day names). Columns which already exist are
+    not recomputed unless force is set, so enriching an enriched frame (or a slice of it) is free,
+    but they are cast to the dtypes of schema.SCHEMA if they are wider (e.g. int64 from older code).
+    Note that TIMEDELTA counts weeks from the first date of the frame it was computed on.
 
-    df["YEAR"] = pd.to_datetime(df[time_col]).dt.isocalendar().year
-    df["WEEK"] = pd.to_datetime(df[time_col]).dt.isocalendar().week
-    df["MONTH_DAY"] = pd.to_datetime(df[time_col]).dt.day
-    df["MONTH"] = pd.to_datetime(df[time_col]).dt.month.astype(np.int8)
-    df["WEEK_OF_MONTH"] = df[time_col].dt.day.astype(np.int8) // 7
-    #df["TIMEDELTA_2000"] = ((df[time_col] - pd.to_datetime("2000-01-01")).dt.days / 7).astype(int)  # weeks, for trend
-    df["TIMEDELTA"] = pow(
-        ((df[time_col] - df[time_col].min()).dt.days / 7).astype(int), 1
-    )  # weeks, for data weighting in training
+    Args:
+        df (DataFrame): input dataframe, modified in place
+        time_col (str): datetime column
+        columns (list(str)): subset of ENRICH_DAY_COLUMNS to add, all if None
+        force (bool): recompute existing columns
 
+    Returns:
+        df with the added columns
+    """
+    columns = ENRICH_DAY_COLUMNS if columns is None else columns
+    missing = [col for col in columns if force or col not in df.columns]
+    schema.compact(df, columns=[col for col in columns if col not in missing], copy=False)
+    if not missing:
+        return df
+
+    codes, dates = pd.factorize(df[time_col])
+    dates = pd.DatetimeIndex(dates)
+    has_nat = (codes < 0).any()
+    for col, values in calendar_features(dates, missing).items():
+        if isinstance(values, pd.Categorical):
+            df[col] = pd.Categorical.from_codes(np.where(codes >= 0, values.codes[codes], -1), dtype=values.dtype)
+        elif has_nat:
+            df[col] = pd.api.extensions.take(values, codes, allow_fill=True)
+        else:
+            df[col] = values[codes]
     return df
-    
+
+
 def define_colors(var_cols, actuals_col, plot_last_year, plot_two_years_ago):
     """
     Define color scheme for the plotting
@@ -86,11 +165,43 @@ def define_colors(var_cols, actuals_col, plot_last_year, plot_two_years_ago):
     return mycolors_map, stroke_dash_map
 
 
+@instrument("charts")
+def chart_series(df, xaxis=["c_date"], var_list=None, max_points=None):
+    """
+    Long format (xaxis, variable, value) of the var_list columns as plotted by plot_pred_shipment_ts
+
+    Args:
+        df (DataFrame): aggregated data, one row per xaxis value
+        xaxis (list(str)): x column, further columns (e.g. a facet column) are kept and separate the series
+        var_list (list(str)): columns to plot
+        max_points (int): point budget per series, longer series are downsampled with LTTB
+            (see downsampling.lttb_indices), all points if None
+    """
+    df_melted = pd.melt(df, id_vars=xaxis, value_vars=var_list)
+    if max_points is not None:
+        df_melted = downsample(df_melted, xaxis[0], "value", list(xaxis[1:]) + ["variable"], max_points)
+    return df_melted
+
+
+@instrument("charts", key_arg="lable")
 def plot_pred_shipment_ts(
-    df, xaxis=["c_date"], xaxis_label="date", lable="total sum", var_list=None, color_list=None, stroke_list=None
+    df,
+    xaxis=["c_date"],
+    xaxis_label="date",
+    lable="total sum",
+    var_list=None,
+    color_list=None,
+    stroke_list=None,
+    max_points=None,
+    data_url=None,
+    facet_col=None,
 ):
     """
     Plot timeseries
+
+    The data is embedded into the chart, or with data_url read from a shared JSON file with the
+    chart_series of several charts (see write_chart_data), this chart uses its rows with CHART == lable.
+    With facet_col (part of xaxis for embedded data) there is one row of the chart per value of facet_col.
     """
 
     if "daily" or "weekly" in lable:
@@ -98,78 +209,350 @@ def plot_pred_shipment_ts(
     else:
         xaxis_conv = xaxis[0] + ":O"
     interval = alt.selection_interval(encodings=["x"])
-    df_melted = pd.melt(df, id_vars=xaxis, value_vars=var_list).reset_index()
+    if data_url is None:
+        chart = alt.Chart(chart_series(df, xaxis, var_list, max_points).reset_index())
+    elif facet_col is None:
+        chart = alt.Chart(alt.UrlData(data_url, format=alt.DataFormat(type="json"))).transform_filter(
+            alt.datum.CHART == lable
+        )
+    else:
+        chart = alt.Chart(alt.UrlData(data_url, format=alt.DataFormat(type="json")))
     chart = (
-        alt.Chart(df_melted)
-        .mark_line()
+        chart.mark_line()
         .encode(
             x=alt.X(
                 xaxis_conv,
                 axis=alt.Axis(title=xaxis_label, labelAngle=-45),
             ),
             y=alt.Y("value:Q", axis=alt.Axis(title="QTY")),
-            tooltip=[xaxis_conv, "variable", "value"],
+            tooltip=[xaxis_conv, "variable:N", "value:Q"],
             color=alt.Color(
-                "variable",
+                "variable:N",
                 scale=alt.Scale(domain=var_list, range=color_list),
                 legend=alt.Legend(title="", orient="right", symbolLimit=0, labelLimit=1000),
             ),
-            strokeDash=alt.StrokeDash("variable", scale=alt.Scale(domain=var_list, range=stroke_list)),
+            strokeDash=alt.StrokeDash("variable:N", scale=alt.Scale(domain=var_list, range=stroke_list)),
         )
-        .properties(title=lable)
-        .add_selection(interval)
     )
+    if facet_col is not None:
+        return chart.add_selection(interval).facet(row=alt.Row(f"{facet_col}:N", title=None), title=lable)
+    chart = chart.properties(title=lable).add_selection(interval)
 
     return chart
 
 
+def _series_styles(var_cols, actuals_col, plot_last_year, plot_two_years_ago):
+    """
+    Plotted columns with their colors and line types
+    """
+    mycolors_map, stroke_dash_map = define_colors(var_cols, actuals_col, plot_last_year, plot_two_years_ago)
+    var_list = []
+    var_list += [actuals_col]
+    if plot_last_year:
+        var_list += [f"{actuals_col}_last_year"]
+    if plot_two_years_ago:
+        var_list += [f"{actuals_col}_-2_years"]
+    var_list += var_cols
+
+    color_list = []
+    stroke_list = []
+    for var in var_list:
+        color_list.append(mycolors_map[var])
+        stroke_list.append(stroke_dash_map[var])
+    return var_list, color_list, stroke_list
+
+
+def _shared_data_charts(slice_series, data_file, data_url, xaxis, var_list, color_list, stroke_list):
+    """
+    Write the chart_series of all slices to data_file and build one chart per slice reading it from data_url
+    """
+    slice_series = [series for series in slice_series if series is not None]
+    write_chart_data([df_series.assign(CHART=lable) for lable, df_series in slice_series], data_file)
+    charts = []
+    for lable, _ in slice_series:
+        chart_ts = plot_pred_shipment_ts(
+            None,
+            xaxis=xaxis,
+            xaxis_label="",
+            lable=lable,
+            var_list=var_list,
+            color_list=color_list,
+            stroke_list=stroke_list,
+            data_url=data_url or data_file,
+        )
+        charts.append(alt.concat(chart_ts, columns=1).configure_axis(grid=False))
+    return charts
+
+
+def _slice_charts(slice_data, xaxis, var_list, color_list, stroke_list, max_points=None, data_file=None, data_url=None):
+    """
+    One chart per (title, aggregated data) of slice_data, with its data embedded or in the shared data_file
+    """
+    if data_file is not None:
+        slice_series = [(lable, chart_series(df, xaxis, var_list, max_points)) for lable, df in slice_data]
+        return _shared_data_charts(slice_series, data_file, data_url, xaxis, var_list, color_list, stroke_list)
+    charts = []
+    for lable, df_total_aggregated in slice_data:
+        chart_ts = plot_pred_shipment_ts(
+            df_total_aggregated,
+            xaxis=xaxis,
+            xaxis_label="",
+            lable=lable,
+            var_list=var_list,
+            color_list=color_list,
+            stroke_list=stroke_list,
+            max_points=max_points,
+        )
+        charts.append(alt.concat(chart_ts, columns=1).configure_axis(grid=False))
+    return charts
+
+
+def _facet_chart(
+    slice_data, lable, xaxis, var_list, color_list, stroke_list, max_points=None, data_file=None, data_url=None
+):
+    """
+    One chart with a row per (title, aggregated data) of slice_data, the data is embedded once or in data_file
+    """
+    df_all = pd.concat([df.assign(CHART=title) for title, df in slice_data], ignore_index=True)
+    if data_file is not None:
+        write_chart_data([chart_series(df_all, xaxis + ["CHART"], var_list, max_points)], data_file)
+        df_all = None
+    chart_ts = plot_pred_shipment_ts(
+        df_all,
+        xaxis=xaxis + ["CHART"],
+        xaxis_label="",
+        lable=lable,
+        var_list=var_list,
+        color_list=color_list,
+        stroke_list=stroke_list,
+        max_points=max_points,
+        data_url=None if data_file is None else data_url or data_file,
+        facet_col="CHART",
+    )
+    return alt.concat(chart_ts, columns=1).configure_axis(grid=False)
+
+
+@instrument("charts", key_arg="agg_col")
+def _batch_chart_data(
+    df, chart_data, agg_col, var_list, lable_text, agg, var_cols, actuals_col, date_from, date_upto, skip_empty
+):
+    """
+    (title, aggregated data) of every slice of var_list from one aggregation with agg_col as additional key
+
+    Args:
+        chart_data: weekly_chart_data or daily_chart_data
+        skip_empty (bool): leave out slices without data after date_from
+    """
+    df = df[df[agg_col].isin(var_list)]
+    df_total_aggregated = chart_data(df, agg, var_cols, actuals_col, date_from, date_upto, group_cols=[agg_col])
+    slice_rows = df_total_aggregated.groupby(agg_col, observed=True).indices
+    last_dates = df.groupby(agg_col, observed=True)["C_DATE"].max()
+    slice_data = []
+    for var in var_list:
+        if skip_empty and not last_dates.get(var, pd.NaT) > pd.Timestamp(date_from):
+            continue
+        rows = slice_rows.get(var, np.array([], dtype=np.int64))
+        slice_data.append((str(var) + lable_text, df_total_aggregated.iloc[rows]))
+    return slice_data
+
+
+def _top_slices(df, agg_col, actuals_col, agg, limit):
+    """
+    limit values of agg_col (all if None) ordered by agg of actuals_col, highest first
+    """
+    return (
+        aggregate(df, [agg_col], {actuals_col: agg})
+        .sort_values(by=actuals_col, ascending=False)
+        .reset_index()
+        .head(limit)[agg_col]
+    )
+
+
+def _cached_slice_data(
+    cache, df, chart_data, agg_col, limit, lable_text, agg, var_cols, actuals_col, date_from, date_upto, skip_empty
+):
+    """
+    slice_data of _batch_chart_data for the top limit slices, from the aggregated data of all slices in cache
+
+    The cached data only depends on the used columns of df and the aggregation parameters, calls
+    with another limit or title text only select and rename the cached slices.
+    """
+    columns = list(dict.fromkeys(["C_DATE", agg_col, actuals_col] + list(var_cols)))
+    date_from, date_upto = pd.Timestamp(date_from), pd.Timestamp(date_upto)
+
+    def compute():
+        df_slices = enrich_day(df[columns].copy())
+        var_list = _top_slices(df_slices, agg_col, actuals_col, agg, None)
+        slice_data = _batch_chart_data(
+            df_slices, chart_data, agg_col, var_list, "", agg, var_cols, actuals_col, date_from, date_upto, False
+        )
+        last_dates = df_slices.groupby(agg_col, observed=True)["C_DATE"].max()
+        nonempty = [last_dates.get(var, pd.NaT) > date_from for var in var_list]
+        return [(var, data, has_data) for var, (_, data), has_data in zip(var_list, slice_data, nonempty)]
+
+    key = cache.key(
+        chart_data.__name__,
+        df,
+        columns,
+        agg_col=agg_col,
+        agg=agg,
+        var_cols=list(var_cols),
+        actuals_col=actuals_col,
+        date_from=date_from,
+        date_upto=date_upto,
+    )
+    slices = cache.get_or_compute(key, compute)[:limit]
+    return [(str(var) + lable_text, data) for var, data, has_data in slices if has_data or not skip_empty]
+
+
+def _show(charts, output_dir=None, output_format="html"):
+    """
+    Display the charts, or save them as output_dir/<title>.<output_format> (see alt.Chart.save)
+
+    Titles which only differ in punctuation (e.g. "A/B" and "A B") map to the same file name, the
+    later charts get a suffix _2, _3, ... instead of overwriting the first one.
+    """
+    stl.def_style()
+    used = set()
+    for chart in charts:
+        if chart is None:
+            continue
+        if output_dir is None:
+            chart.display()
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+            base = re.sub(r"[^\w.-]+", "_", chart.concat[0].title).strip("_")
+            name, n = base, 1
+            # case-insensitive, as the file names on Windows / macOS
+            while name.lower() in used:
+                n += 1
+                name = f"{base}_{n}"
+            used.add(name.lower())
+            chart.save(os.path.join(output_dir, f"{name}.{output_format}"))
+
+
+def lag_column_name(actuals_col, lag, lag_unit="year"):
+    """
+    Name of the column with actuals from lag years/weeks/days ago
+    """
+    if lag_unit == "year":
+        return f"{actuals_col}_last_year" if lag == 1 else f"{actuals_col}_-{lag}_years"
+    return f"{actuals_col}_-{lag}_{lag_unit}s"
+
+
+def _lag_positions(df_total_aggregated, lags, lag_unit="year", period_col="WEEK", date_col=None, group_cols=[]):
+    """
+    Row position of the lagged row for every row and lag (-1 if it does not exist)
+
+    Rows are identified by group_cols and (YEAR, period_col) for year lags or by date_col for
+    week/day lags; the lagged key is looked up in a hash index of all keys at once.
+    """
+    if lag_unit == "year":
+        base = df_total_aggregated["YEAR"].to_numpy(dtype=np.int64) * 1000 + df_total_aggregated[period_col].to_numpy(
+            dtype=np.int64
+        )
+        step = 1000
+    elif lag_unit in ["week", "day"]:
+        base = df_total_aggregated[date_col].to_numpy(dtype="datetime64[D]").astype(np.int64)
+        step = 7 if lag_unit == "week" else 1
+    else:
+        raise ValueError(f"lag_unit must be 'year', 'week' or 'day', got {lag_unit}")
+
+    groups = [df_total_aggregated[col].to_numpy() for col in group_cols]
+    index = pd.MultiIndex.from_arrays(groups + [base]) if groups else pd.Index(base)
+    if not index.is_unique:
+        raise ValueError("Lags need unique keys, aggregate the data first")
+
+    positions = {}
+    for lag in lags:
+        shifted = base - lag * step
+        lookup = pd.MultiIndex.from_arrays(groups + [shifted]) if groups else pd.Index(shifted)
+        positions[lag] = index.get_indexer(lookup)
+    return positions
+
+
+@instrument("lags", key_arg="lag_unit")
+def add_lagged_actuals(
+    df_total_aggregated,
+    actuals_col,
+    lags=[1, 2],
+    lag_unit="year",
+    period_col="WEEK",
+    date_col=None,
+    group_cols=[],
+):
+    """
+    Add actuals from previous years/weeks/days in one vectorized pass
+
+    Args:
+        df_total_aggregated (DataFrame): data aggregated per YEAR and period_col (and group_cols)
+        actuals_col (str): column with actuals
+        lags (list(int)): lags in units of lag_unit
+        lag_unit (str): "year" (same period_col in YEAR - lag), "week" or "day" (date_col - lag weeks/days)
+        period_col (str): period within a year for year lags, "WEEK" for weekly and "ISODAY" for daily data
+        date_col (str): date column for week/day lags, e.g. "THIS_WEEK_MONDAY" or "C_DATE"
+        group_cols (list(str)): additional key columns, e.g. category to lag each category separately
+
+    Returns:
+        df_total_aggregated with a column per lag named by lag_column_name, float32 for float32 actuals
+    """
+    dtype = df_total_aggregated[actuals_col].dtype
+    # the smallest float dtype holding the actuals and NaN, float32 actuals (see schema) stay float32
+    dtype = np.promote_types(dtype, np.float32) if isinstance(dtype, np.dtype) else np.dtype(np.float64)
+    values = df_total_aggregated[actuals_col].to_numpy(dtype=dtype)
+    positions = _lag_positions(df_total_aggregated, lags, lag_unit, period_col, date_col, group_cols)
+    for lag, pos in positions.items():
+        lagged = np.where(pos >= 0, values[pos], dtype.type(np.nan))
+        df_total_aggregated[lag_column_name(actuals_col, lag, lag_unit)] = lagged
+    return df_total_aggregated
+
+
+@instrument("lags", key_arg="period_col")
+def _legacy_lag_frame(df_total_aggregated, actuals_col, lag, period_col):
+    """
+    Rows with a match lag years ago, in the layout of the former per-year merge loop
+    """
+    pos = _lag_positions(df_total_aggregated, [lag], "year", period_col)[lag]
+    out = df_total_aggregated[["YEAR", period_col, actuals_col]].iloc[np.flatnonzero(pos >= 0)]
+    out = out.assign(**{lag_column_name(actuals_col, lag): df_total_aggregated[actuals_col].to_numpy()[pos[pos >= 0]]})
+    year_order = pd.factorize(df_total_aggregated["YEAR"])[0][pos >= 0]
+    return out.iloc[np.argsort(year_order, kind="stable")].reset_index(drop=True)
+
+
 def add_last_year_weekly_actuals(df_total_aggregated, actuals_col):
     """
     Calculate actuals from one year ago
     """
-    df_total_aggregated_week = pd.DataFrame()
-    for year in df_total_aggregated.YEAR.unique():
-        df_total_aggregated_last = df_total_aggregated[df_total_aggregated["YEAR"] == (year - 1)][["WEEK", actuals_col]]
-        df_total_aggregated_last[f"{actuals_col}_last_year"] = df_total_aggregated_last[actuals_col]
-        df_total_aggregated_last["current_year"] = year
-        df_total_aggregated_last = df_total_aggregated_last.drop(columns=[actuals_col])
-        df_total_aggregated_week = pd.concat([df_total_aggregated_week,
-            df_total_aggregated[["YEAR", "WEEK", actuals_col]].merge(
-                df_total_aggregated_last[["current_year", "WEEK", f"{actuals_col}_last_year"]],
-                left_on=["YEAR", "WEEK"],
-                right_on=["current_year", "WEEK"],
-                how="inner",
-            )]
-        )
-        df_total_aggregated_week = df_total_aggregated_week.drop(columns=["current_year"])
-    return df_total_aggregated_week
+    return _legacy_lag_frame(df_total_aggregated, actuals_col, 1, "WEEK")
 
 
 def add_minus_2_year_weekly_actuals(df_total_aggregated, actuals_col):
     """
     Calculate actuals from 2 years ago
     """
-    df_total_aggregated_week = pd.DataFrame()
-    for year in df_total_aggregated.YEAR.unique():
-        df_total_aggregated_last = df_total_aggregated[df_total_aggregated["YEAR"] == (year - 2)][["WEEK", actuals_col]]
-        df_total_aggregated_last[f"{actuals_col}_-2_years"] = df_total_aggregated_last[actuals_col]
-        df_total_aggregated_last["current_year"] = year
-        df_total_aggregated_last = df_total_aggregated_last.drop(columns=[actuals_col])
-        df_total_aggregated_week = pd.concat([df_total_aggregated_week,
-            df_total_aggregated[["YEAR", "WEEK", actuals_col]].merge(
-                df_total_aggregated_last[["current_year", "WEEK", f"{actuals_col}_-2_years"]],
-                left_on=["YEAR", "WEEK"],
-                right_on=["current_year", "WEEK"],
-                how="inner",
-            )]
-        )
-        df_total_aggregated_week = df_total_aggregated_week.drop(columns=["current_year"])
-    return df_total_aggregated_week
+    return _legacy_lag_frame(df_total_aggregated, actuals_col, 2, "WEEK")
 
 
-def calc_agg_weekly(df, var_cols=["PREDICTIONS"], agg="sum", actuals_col="N_SALES"):
+def aggregate(df, keys, agg_dict):
     """
-    Calculate weekly aggregated data
+    df.groupby(keys).agg(agg_dict) with support of agg APPROX_MEDIAN (see quantile_sketch.GroupedQuantileSketch)
+    """
+    exact = {col: agg for col, agg in agg_dict.items() if agg != APPROX_MEDIAN}
+    results = [df.groupby(keys, observed=True).agg(exact)] if exact else []
+    results += [
+        GroupedQuantileSketch(keys).update(df, col).median().to_frame(col)
+        for col, agg in agg_dict.items()
+        if agg == APPROX_MEDIAN
+    ]
+    if len(results) == 1:
+        return results[0][list(agg_dict)]
+    return pd.concat(results, axis=1).sort_index()[list(agg_dict)]
+
+
+@instrument("aggregation", key_arg="agg")
+def calc_agg_weekly(df, var_cols=["PREDICTIONS"], agg="sum", actuals_col="N_SALES", lags=[1, 2], group_cols=[]):
+    """
+    Calculate weekly aggregated data with actuals from lags years ago, per group_cols (e.g. category) if given
     """
     agg_dict = {}
     for col in var_cols:
@@ -177,21 +560,37 @@ def calc_agg_weekly(df, var_cols=["PREDICTIONS"], agg="sum", actuals_col="N_SALE
     agg_dict[actuals_col] = agg
     agg_dict["THIS_WEEK_MONDAY"] = "first"
 
-    df_total_aggregated = df.groupby(["WEEK", "YEAR"]).agg(agg_dict).reset_index()
-
-    df_total_aggregated_week_lastyear = add_last_year_weekly_actuals(df_total_aggregated, actuals_col)
-    df_total_aggregated = df_total_aggregated.merge(
-        df_total_aggregated_week_lastyear[["YEAR", "WEEK", f"{actuals_col}_last_year"]],
-        on=["WEEK", "YEAR"],
-        how="outer",
+    df_total_aggregated = aggregate(df, list(group_cols) + ["WEEK", "YEAR"], agg_dict).reset_index()
+    return add_lagged_actuals(
+        df_total_aggregated, actuals_col, lags=lags, lag_unit="year", period_col="WEEK", group_cols=group_cols
     )
-    df_total_aggregated_week_minus2 = add_minus_2_year_weekly_actuals(df_total_aggregated, actuals_col)
-    df_total_aggregated = df_total_aggregated.merge(
-        df_total_aggregated_week_minus2[["YEAR", "WEEK", f"{actuals_col}_-2_years"]], on=["WEEK", "YEAR"], how="outer"
+
+
+def _in_range(dates, date_from=None, date_upto=None):
+    """
+    Mask of dates in [date_from, date_upto), a bound that is None is not applied
+    """
+    mask = pd.Series(True, index=dates.index)
+    if date_from is not None:
+        mask &= dates >= date_from
+    if date_upto is not None:
+        mask &= dates < date_upto
+    return mask
+
+
+def weekly_chart_data(
+    df, agg="sum", var_cols=["PREDICTIONS"], actuals_col="N_SALES", date_from=None, date_upto=None, group_cols=[]
+):
+    """
+    Weekly aggregated data of plot_weekly with weeks in [date_from, date_upto), all weeks before / after if None
+    """
+    df_total_aggregated = calc_agg_weekly(
+        enrich_day(df), var_cols=var_cols, agg=agg, actuals_col=actuals_col, group_cols=group_cols
     )
-    return df_total_aggregated
+    return df_total_aggregated[_in_range(df_total_aggregated["THIS_WEEK_MONDAY"], date_from, date_upto)]
 
 
+@instrument("charts", key_arg="lable")
 def plot_weekly(
     df,
     lable="weekly total sum",
@@ -202,40 +601,23 @@ def plot_weekly(
     date_upto="2020-01-31",
     plot_last_year=True,
     plot_two_years_ago=True,
+    max_points=None,
 ):
     """
-    Plot weekly data per slice
+    Plot weekly data per slice, with max_points (see chart_series) every line is downsampled to max_points
     """
-    mycolors_map, stroke_dash_map = define_colors(var_cols, actuals_col, plot_last_year, plot_two_years_ago)
-    df = enrich_day(df)
+    var_list, color_list, stroke_list = _series_styles(var_cols, actuals_col, plot_last_year, plot_two_years_ago)
 
     charts = []
-    df_total_aggregated = calc_agg_weekly(df, var_cols=var_cols, agg=agg, actuals_col=actuals_col)
-    var_list = []
-    var_list += [actuals_col]
-    if plot_last_year:
-        var_list += [f"{actuals_col}_last_year"]
-    if plot_two_years_ago:
-        var_list += [f"{actuals_col}_-2_years"]
-    var_list += var_cols
-
-    color_list = []
-    stroke_list = []
-    for var in var_list:
-        color_list.append(mycolors_map[var])
-        stroke_list.append(stroke_dash_map[var])
-
     chart_ts = plot_pred_shipment_ts(
-        df_total_aggregated[
-            (df_total_aggregated["THIS_WEEK_MONDAY"] >= date_from)
-            & (df_total_aggregated["THIS_WEEK_MONDAY"] < date_upto)
-        ],
+        weekly_chart_data(df, agg, var_cols, actuals_col, date_from, date_upto),
         xaxis=["THIS_WEEK_MONDAY"],
         xaxis_label="",
         lable=lable,
         var_list=var_list,
         color_list=color_list,
         stroke_list=stroke_list,
+        max_points=max_points,
     )
     charts.append(chart_ts)
 
@@ -244,6 +626,7 @@ def plot_weekly(
     return chart_out
 
 
+@instrument("charts", key_arg="agg_col")
 def plot_weekly_per_agg(
     df,
     actuals_col="N_SALES",
@@ -256,48 +639,173 @@ def plot_weekly_per_agg(
     date_upto="2020-01-31",
     plot_last_year=True,
     plot_two_years_ago=True,
+    n_jobs=1,
+    max_points=None,
+    data_file=None,
+    data_url=None,
+    batch=False,
+    facet=False,
+    output_dir=None,
+    output_format="html",
+    cache=None,
 ):
     """
     Plot aggregated weekly time series
 
+    By default every chart embeds its data. With data_file the aggregated (and with max_points
+    downsampled) series of all charts are written once to the JSON file data_file and every
+    chart only references it, so the notebook/HTML output stays small.
+
+    By default every slice is enriched and aggregated on its own (on n_jobs processes). With batch
+    the data is enriched once and the weekly aggregates and lags of all slices come from one
+    groupby keyed by (agg_col, WEEK, YEAR), the charts are built from that result. With facet
+    (batch only) all slices are rows of one faceted chart instead of separate charts.
+
+    With cache (a caching.ResultCache, True for the default one) the batch aggregates of all slices
+    are cached under the fingerprint of the used columns and the aggregation parameters, so calls
+    that only differ in limit_n_plots, title_text or the chart options only rebuild the charts.
+
     Parameters:
         df (DataFrame): input dataframe
         actuals_col (str): column with actuals
         val_cols (list(str)): other columns to plot on Y-axis (e.g predictions)
         agg_col (str): aggregation column (e.g product-group, location, etc)
-        agg (str): aggregation function (only "sum" or "mean" are supported)
+        agg (str): aggregation function ("sum", "mean", "median", APPROX_MEDIAN, ...)
         limit_n_plots (str): number of plots to show. Plots are ordered by max(actuals_col.agg)
         title_text (str): text to be added to title
         date_from (str): first date on the plot, format 'YYYY-MM-DD'
         date_upto (str): last date on the plot, format 'YYYY-MM-DD'
         plot_last_year (bool): plot last year actuals
         plot_two_years_ago (bool): plot actuals from 2 years ago
+        n_jobs (int): number of processes building the charts (-1: all cores)
+        max_points (int): point budget per line, longer lines are downsampled with LTTB
+        data_file (str): JSON file for the data of all charts, data embedded into the charts if None
+        data_url (str): URL of data_file as seen by the browser (relative to the notebook/HTML), data_file if None
+        batch (bool): aggregate all slices in one pass, n_jobs is not used
+        facet (bool): with batch or cache, one chart with a row per slice
+        output_dir (str): save the charts to files in output_dir instead of displaying them
+        output_format (str): file format of the saved charts, "html" or "json" (png/svg need vl-convert)
+        cache (caching.ResultCache): cache of the aggregated data of all slices (implies batch), no caching if None
 
     """
-    var_list = (
-        df.groupby([agg_col])
-        .agg({actuals_col: agg})
-        .sort_values(by=actuals_col, ascending=False)
-        .reset_index()
-        .head(limit_n_plots)[agg_col]
+    lable_text = f" weekly {agg}" + f" {title_text}"
+    columns = list(dict.fromkeys(["C_DATE", agg_col, actuals_col] + list(var_cols)))
+    cache = caching.resolve(cache)
+    if cache is not None:
+        slice_data = _cached_slice_data(
+            cache,
+            df,
+            weekly_chart_data,
+            agg_col,
+            limit_n_plots,
+            lable_text,
+            agg,
+            var_cols,
+            actuals_col,
+            date_from,
+            date_upto,
+            skip_empty=True,
+        )
+    elif batch:
+        slice_data = _batch_chart_data(
+            enrich_day(df[columns].copy()),
+            weekly_chart_data,
+            agg_col,
+            _top_slices(df, agg_col, actuals_col, agg, limit_n_plots),
+            lable_text,
+            agg,
+            var_cols,
+            actuals_col,
+            date_from,
+            date_upto,
+            skip_empty=True,
+        )
+    if cache is not None or batch:
+        styles = _series_styles(var_cols, actuals_col, plot_last_year, plot_two_years_ago)
+        if facet:
+            lable = f"{agg_col} weekly {agg}" + f" {title_text}"
+            charts = [_facet_chart(slice_data, lable, ["THIS_WEEK_MONDAY"], *styles, max_points, data_file, data_url)]
+        else:
+            charts = _slice_charts(slice_data, ["THIS_WEEK_MONDAY"], *styles, max_points, data_file, data_url)
+        _show(charts, output_dir, output_format)
+        return
+    var_list = _top_slices(df, agg_col, actuals_col, agg, limit_n_plots)
+    slice_rows = df.groupby(agg_col, observed=True).indices
+    charts = parallel.map_slices(
+        _plot_weekly_slice,
+        df,
+        [slice_rows[var] for var in var_list],
+        n_jobs=n_jobs,
+        columns=columns,
+        agg_col=agg_col,
+        lable_text=lable_text,
+        series_only=data_file is not None,
+        agg=agg,
+        var_cols=var_cols,
+        actuals_col=actuals_col,
+        date_from=date_from,
+        date_upto=date_upto,
+        plot_last_year=plot_last_year,
+        plot_two_years_ago=plot_two_years_ago,
+        max_points=max_points,
     )
-    for var in var_list:
-        df_slice = df[df[agg_col] == var]
-        if df_slice[df_slice['C_DATE']>date_from].shape[0]>0:
-            chart = plot_weekly(
-                df_slice,
-                lable=str(var) + f" weekly {agg}" + f" {title_text}",
-                agg=agg,
-                var_cols=var_cols,
-                actuals_col=actuals_col,
-                date_from=date_from,
-                date_upto=date_upto,
-                plot_last_year=plot_last_year,
-                plot_two_years_ago=plot_two_years_ago,
-            )
-            chart.display()
+    if data_file is not None:
+        charts = _shared_data_charts(
+            charts,
+            data_file,
+            data_url,
+            ["THIS_WEEK_MONDAY"],
+            *_series_styles(var_cols, actuals_col, plot_last_year, plot_two_years_ago),
+        )
+    _show(charts, output_dir, output_format)
+
+
+def _plot_weekly_slice(df_slice, agg_col, lable_text, series_only=False, **kwargs):
+    """
+    Weekly chart of one slice of plot_weekly_per_agg, None if there is no data after date_from
+
+    With series_only the title and the chart_series of the chart are returned instead of the chart.
+    """
+    if df_slice[df_slice["C_DATE"] > kwargs["date_from"]].shape[0] == 0:
+        return None
+    lable = str(df_slice[agg_col].iloc[0]) + lable_text
+    if not series_only:
+        return plot_weekly(df_slice.copy(), lable=lable, **kwargs)
+    return lable, _slice_series(df_slice.copy(), weekly_chart_data, ["THIS_WEEK_MONDAY"], **kwargs)
+
+
+def _slice_series(
+    df,
+    chart_data,
+    xaxis,
+    agg,
+    var_cols,
+    actuals_col,
+    date_from,
+    date_upto,
+    plot_last_year,
+    plot_two_years_ago,
+    max_points,
+):
+    """
+    chart_series of the chart of a slice, chart_data is weekly_chart_data or daily_chart_data
+    """
+    var_list, _, _ = _series_styles(var_cols, actuals_col, plot_last_year, plot_two_years_ago)
+    df_total_aggregated = chart_data(df, agg, var_cols, actuals_col, date_from, date_upto)
+    return chart_series(df_total_aggregated, xaxis, var_list, max_points)
+
+
+def daily_chart_data(
+    df, agg="sum", var_cols=["PREDICTIONS"], actuals_col="N_SALES", date_from=None, date_upto=None, group_cols=[]
+):
+    """
+    Daily aggregated data of plot_daily with dates in [date_from, date_upto), all dates before / after if None
+    """
+    df_total_aggregated = calc_agg_daily(df, var_cols=var_cols, agg=agg, actuals_col=actuals_col, group_cols=group_cols)
+    return df_total_aggregated[_in_range(df_total_aggregated["C_DATE"], date_from, date_upto)]
 
 
+@instrument("charts", key_arg="lable")
 def plot_daily(
     df,
     lable="daily total sum",
@@ -308,37 +816,24 @@ def plot_daily(
     date_upto="2020-01-31",
     plot_last_year=True,
     plot_two_years_ago=True,
+    max_points=None,
 ):
     """
-    Plot daily data per slice
+    Plot daily data per slice, with max_points (see chart_series) every line is downsampled to max_points
     """
 
-    mycolors_map, stroke_dash_map = define_colors(var_cols, actuals_col, plot_last_year, plot_two_years_ago)
+    var_list, color_list, stroke_list = _series_styles(var_cols, actuals_col, plot_last_year, plot_two_years_ago)
 
     charts = []
-    df_total_aggregated = calc_agg_daily(df, var_cols=var_cols, agg=agg, actuals_col=actuals_col)
-    var_list = []
-    var_list += [actuals_col]
-    if plot_last_year:
-        var_list += [f"{actuals_col}_last_year"]
-    if plot_two_years_ago:
-        var_list += [f"{actuals_col}_-2_years"]
-    var_list += var_cols
-
-    color_list = []
-    stroke_list = []
-    for var in var_list:
-        color_list.append(mycolors_map[var])
-        stroke_list.append(stroke_dash_map[var])
-
     chart_ts = plot_pred_shipment_ts(
-        df_total_aggregated[(df_total_aggregated["C_DATE"] >= date_from) & (df_total_aggregated["C_DATE"] < date_upto)],
+        daily_chart_data(df, agg, var_cols, actuals_col, date_from, date_upto),
         xaxis=["C_DATE"],
         xaxis_label="",
         lable=lable,
         var_list=var_list,
         color_list=color_list,
         stroke_list=stroke_list,
+        max_points=max_points,
     )
     charts.append(chart_ts)
 
@@ -351,53 +846,20 @@ def add_last_year_daily_actuals(df_total_aggregated, actuals_col):
     """
     Calculate daily actuals from one year ago
     """
-    df_total_aggregated_week = pd.DataFrame()
-    for year in df_total_aggregated.YEAR.unique():
-        df_total_aggregated_last = df_total_aggregated[df_total_aggregated["YEAR"] == (year - 1)][
-            ["ISODAY", actuals_col]
-        ]
-        df_total_aggregated_last[f"{actuals_col}_last_year"] = df_total_aggregated_last[actuals_col]
-        df_total_aggregated_last["current_year"] = year
-        df_total_aggregated_last = df_total_aggregated_last.drop(columns=[actuals_col])
-        df_total_aggregated_week = pd.concat([df_total_aggregated_week,
-            df_total_aggregated[["YEAR", "ISODAY", actuals_col]].merge(
-                df_total_aggregated_last[["current_year", "ISODAY", f"{actuals_col}_last_year"]],
-                left_on=["YEAR", "ISODAY"],
-                right_on=["current_year", "ISODAY"],
-                how="inner",
-            )]
-        )
-        df_total_aggregated_week = df_total_aggregated_week.drop(columns=["current_year"])
-    return df_total_aggregated_week
+    return _legacy_lag_frame(df_total_aggregated, actuals_col, 1, "ISODAY")
 
 
 def add_minus_2_year_daily_actuals(df_total_aggregated, actuals_col):
     """
     Calculate daily actuals from 2 years ago
     """
-    df_total_aggregated_week = pd.DataFrame()
-    for year in df_total_aggregated.YEAR.unique():
-        df_total_aggregated_last = df_total_aggregated[df_total_aggregated["YEAR"] == (year - 2)][
-            ["ISODAY", actuals_col]
-        ]
-        df_total_aggregated_last[f"{actuals_col}_-2_years"] = df_total_aggregated_last[actuals_col]
-        df_total_aggregated_last["current_year"] = year
-        df_total_aggregated_last = df_total_aggregated_last.drop(columns=[actuals_col])
-        df_total_aggregated_week = pd.concat([df_total_aggregated_week,
-            df_total_aggregated[["YEAR", "ISODAY", actuals_col]].merge(
-                df_total_aggregated_last[["current_year", "ISODAY", f"{actuals_col}_-2_years"]],
-                left_on=["YEAR", "ISODAY"],
-                right_on=["current_year", "ISODAY"],
-                how="inner",
-            )]
-        )
-        df_total_aggregated_week = df_total_aggregated_week.drop(columns=["current_year"])
-    return df_total_aggregated_week
+    return _legacy_lag_frame(df_total_aggregated, actuals_col, 2, "ISODAY")
 
 
-def calc_agg_daily(df, var_cols=["PREDICTIONS"], agg="sum", actuals_col="N_SALES"):
+@instrument("aggregation", key_arg="agg")
+def calc_agg_daily(df, var_cols=["PREDICTIONS"], agg="sum", actuals_col="N_SALES", lags=[1, 2], group_cols=[]):
     """
-    Calculate daily aggregated data
+    Calculate daily aggregated data with actuals from lags years ago, per group_cols (e.g. category) if given
     """
     agg_dict = {}
     for col in var_cols:
@@ -405,23 +867,13 @@ def calc_agg_daily(df, var_cols=["PREDICTIONS"], agg="sum", actuals_col="N_SALES
     agg_dict[actuals_col] = agg
     agg_dict["C_DATE"] = "first"
 
-    df_total_aggregated = df.groupby(["ISODAY", "YEAR"]).agg(agg_dict).reset_index()
-
-    df_total_aggregated_week_lastyear = add_last_year_daily_actuals(df_total_aggregated, actuals_col)
-    df_total_aggregated = df_total_aggregated.merge(
-        df_total_aggregated_week_lastyear[["YEAR", "ISODAY", f"{actuals_col}_last_year"]],
-        on=["ISODAY", "YEAR"],
-        how="outer",
-    )
-    df_total_aggregated_week_minus2 = add_minus_2_year_daily_actuals(df_total_aggregated, actuals_col)
-    df_total_aggregated = df_total_aggregated.merge(
-        df_total_aggregated_week_minus2[["YEAR", "ISODAY", f"{actuals_col}_-2_years"]],
-        on=["ISODAY", "YEAR"],
-        how="outer",
+    df_total_aggregated = aggregate(df, list(group_cols) + ["ISODAY", "YEAR"], agg_dict).reset_index()
+    return add_lagged_actuals(
+        df_total_aggregated, actuals_col, lags=lags, lag_unit="year", period_col="ISODAY", group_cols=group_cols
     )
-    return df_total_aggregated
 
 
+@instrument("charts", key_arg="agg_col")
 def plot_daily_per_agg(
     df,
     actuals_col="N_SALES",
@@ -434,43 +886,82 @@ def plot_daily_per_agg(
     date_upto="2020-01-31",
     plot_last_year=True,
     plot_two_years_ago=True,
+    max_points=None,
+    data_file=None,
+    data_url=None,
+    batch=False,
+    facet=False,
+    output_dir=None,
+    output_format="html",
+    cache=None,
 ):
     """
     Plot aggregated daily time series
 
+    By default every chart embeds its data, with data_file all charts share one data file. With batch
+    all slices are aggregated in one groupby keyed by (agg_col, ISODAY, YEAR), with facet (batch or cache)
+    they are rows of one faceted chart, with cache the aggregates of all slices are cached (see plot_weekly_per_agg).
+
     Parameters:
         df (DataFrame): input dataframe
         actuals_col (str): column with actuals
         val_cols (list(str)): other columns to plot on Y-axis (e.g predictions)
         agg_col (str): aggregation column (e.g product-group, location, etc)
-        agg (str): aggregation function (only "sum" or "mean" are supported)
+        agg (str): aggregation function ("sum", "mean", "median", APPROX_MEDIAN, ...)
         limit_n_plots (str): number of plots to show. Plots are ordered by max(actuals_col.agg)
         title_text (str): text to be added to title
         date_from (str): first date on the plot, format 'YYYY-MM-DD'
         date_upto (str): last date on the plot, format 'YYYY-MM-DD'
         plot_last_year (bool): plot last year actuals
         plot_two_years_ago (bool): plot actuals from 2 years ago
+        max_points (int): point budget per line, longer lines are downsampled with LTTB
+        data_file (str): JSON file for the data of all charts, data embedded into the charts if None
+        data_url (str): URL of data_file as seen by the browser (relative to the notebook/HTML), data_file if None
+        batch (bool): aggregate all slices in one pass
+        facet (bool): with batch or cache, one chart with a row per slice
+        output_dir (str): save the charts to files in output_dir instead of displaying them
+        output_format (str): file format of the saved charts, "html" or "json" (png/svg need vl-convert)
+        cache (caching.ResultCache): cache of the aggregated data of all slices (implies batch), no caching if None
 
     """
 
-    df = enrich_day(df)
-    var_list = (
-        df.groupby([agg_col])
-        .agg({actuals_col: agg})
-        .sort_values(by=actuals_col, ascending=False)
-        .reset_index()
-        .head(limit_n_plots)[agg_col]
-    )
-    for var in var_list:
-        df_slice = df[df[agg_col] == var]
-        plot_daily(
-            df_slice,
-            lable=str(var) + f" daily {agg}" + f" {title_text}",
-            agg=agg,
-            var_cols=var_cols,
-            actuals_col=actuals_col,
-            date_from=date_from,
-            date_upto=date_upto,
-            plot_last_year=plot_last_year,
-            plot_two_years_ago=plot_two_years_ago,
+    lable_text = f" daily {agg}" + f" {title_text}"
+    cache = caching.resolve(cache)
+    if cache is not None:
+        slice_data = _cached_slice_data(
+            cache,
+            df,
+            daily_chart_data,
+            agg_col,
+            limit_n_plots,
+            lable_text,
+            agg,
+            var_cols,
+            actuals_col,
+            date_from,
+            date_upto,
+            skip_empty=False,
+        )
+    elif batch:
+        df = enrich_day(df)
+        var_list = _top_slices(df, agg_col, actuals_col, agg, limit_n_plots)
+        slice_data = _batch_chart_data(
+            df, daily_chart_data, agg_col, var_list, lable_text, agg, var_cols, actuals_col, date_from, date_upto, False
         )
+    else:
+        df = enrich_day(df)
+        var_list = _top_slices(df, agg_col, actuals_col, agg, limit_n_plots)
+        slice_data = [
+            (
+                str(var) + lable_text,
+                daily_chart_data(df[df[agg_col] == var], agg, var_cols, actuals_col, date_from, date_upto),
+            )
+            for var in var_list
+        ]
+    styles = _series_styles(var_cols, actuals_col, plot_last_year, plot_two_years_ago)
+    if (batch or cache is not None) and facet:
+        lable = f"{agg_col} daily {agg}" + f" {title_text}"
+        charts = [_facet_chart(slice_data, lable, ["C_DATE"], *styles, max_points, data_file, data_url)]
+    else:
+        charts = _slice_charts(slice_data, ["C_DATE"], *styles, max_points, data_file, data_url)
+    _show(charts, output_dir, output_format)
@@ -0,0 +1,171 @@
+import itertools
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+import kpi_calculation as kpi  # package
+import parallel  # package
+
+# grid of GridSearchCV in 2_Modelling.ipynb
+XGB_PARAM_GRID = {
+    "learning_rate": [0.05, 0.1, 0.2],
+    "max_depth": [6, 8, 9, 10],
+    "min_child_weight": [1, 3, 5, 7],
+    "gamma": [0.0, 0.1, 0.2, 0.3],
+    "colsample_bytree": [0.3, 0.4, 0.6, 0.8],
+}
+BASE_PARAMS = {"seed": 42, "objective": "reg:absoluteerror"}
+
+# DMatrix of the train and validation fold, built once per process
+_data = None
+
+
+def param_grid(grid=XGB_PARAM_GRID):
+    """
+    List of all parameter combinations of grid
+    """
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def time_split(dates, valid_fraction=0.2):
+    """
+    Masks of a time-ordered train and validation fold, the validation fold is the last valid_fraction of dates
+    """
+    dates = pd.Series(dates)
+    valid_from = dates.quantile(1 - valid_fraction)
+    valid = (dates > valid_from).to_numpy()
+    return ~valid, valid
+
+
+def rmad(y_true, y_pred):
+    """
+    RMAD of kpi_calculation.get_metrics
+    """
+    df = pd.DataFrame({"target": y_true, "prediction": y_pred, "n_Products": 1})
+    return kpi.get_metrics(df, pred_name="prediction", target_name="target", copy_free=True)["RMAD"].iloc[0]
+
+
+def _init_data(X_train, y_train, X_valid, y_valid, nthread):
+    global _data
+    _data = {
+        "train": xgb.DMatrix(X_train, label=y_train, nthread=nthread),
+        "valid": xgb.DMatrix(X_valid, label=y_valid, nthread=nthread),
+        "y_valid": np.asarray(y_valid),
+        "nthread": nthread,
+    }
+
+
+def _run_trial(params, num_boost_round, early_stopping_rounds):
+    """
+    Train params for up to num_boost_round rounds with early stopping on the validation fold
+    """
+    start = time.perf_counter()
+    booster = xgb.train(
+        {**BASE_PARAMS, **params, "nthread": _data["nthread"]},
+        _data["train"],
+        num_boost_round=num_boost_round,
+        evals=[(_data["valid"], "valid")],
+        early_stopping_rounds=early_stopping_rounds,
+        verbose_eval=False,
+    )
+    n_rounds = booster.best_iteration + 1
+    y_pred = booster.predict(_data["valid"], iteration_range=(0, n_rounds))
+    return {
+        "n_rounds": n_rounds,
+        "RMAD": rmad(_data["y_valid"], y_pred),
+        "fit_time": time.perf_counter() - start,
+    }
+
+
+def successive_halving(
+    X,
+    y,
+    dates,
+    grid=XGB_PARAM_GRID,
+    valid_fraction=0.2,
+    min_rounds=30,
+    max_rounds=1000,
+    eta=3,
+    early_stopping_rounds=20,
+    n_jobs=1,
+):
+    """
+    Hyperparameter search with successive halving and early stopping
+
+    All combinations of grid are trained with a budget of min_rounds boosting rounds, the best
+    1/eta of them (by RMAD on a time-ordered validation fold) get eta times the budget, and so
+    on until max_rounds. Every trial stops early when the validation MAE does not improve for
+    early_stopping_rounds rounds. The DMatrix of both folds is built once per process.
+
+    Args:
+        X (DataFrame or np.array): features (e.g. X_train of 2_Modelling.ipynb)
+        y (np.array): target
+        dates (array): date of every row, defines the validation fold
+        grid (dict): parameter name -> list of values
+        valid_fraction (float): fraction of the latest dates used for validation
+        min_rounds (int): budget of the first rung
+        max_rounds (int): max budget
+        eta (int): reduction factor per rung
+        early_stopping_rounds (int): patience of early stopping
+        n_jobs (int): number of processes, -1 for all cores
+
+    Returns:
+        DataFrame with one row per trial (params, rung, budget, n_rounds, RMAD, fit_time), best trial first
+    """
+    train, valid = time_split(dates, valid_fraction)
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n_jobs = parallel.n_workers(n_jobs)
+    nthread = max(1, (os.cpu_count() or 1) // n_jobs)
+    data = (X[train], y[train], X[valid], y[valid], nthread)
+
+    configs = param_grid(grid)
+    n_rungs = max(1, math.floor(math.log(max_rounds / min_rounds, eta)) + 1)
+    trials = []
+    if n_jobs > 1:
+        pool = ProcessPoolExecutor(n_jobs, initializer=_init_data, initargs=data)
+    else:
+        pool = None
+        _init_data(*data)
+    try:
+        for rung in range(n_rungs):
+            budget = min(min_rounds * eta**rung, max_rounds)
+            if pool is None:
+                results = [_run_trial(params, budget, early_stopping_rounds) for params in configs]
+            else:
+                futures = [pool.submit(_run_trial, params, budget, early_stopping_rounds) for params in configs]
+                results = [future.result() for future in futures]
+            rung_trials = [
+                {**params, "rung": rung, "budget": budget, **result} for params, result in zip(configs, results)
+            ]
+            trials += rung_trials
+            ranked = sorted(range(len(configs)), key=lambda i: rung_trials[i]["RMAD"])
+            configs = [configs[i] for i in ranked[: max(1, len(configs) // eta)]]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    df_trials = pd.DataFrame(trials)
+    # trials of the last rung first, they had the largest budget
+    return df_trials.sort_values(by=["rung", "RMAD"], ascending=[False, True], kind="stable").reset_index(drop=True)
+
+
+def best_params(df_trials, grid=XGB_PARAM_GRID):
+    """
+    Parameters of the best trial of successive_halving, with the types of the grid values
+    """
+    best = df_trials.iloc[0]
+    return {name: type(values[0])(best[name]) for name, values in grid.items()}
+
+
+def best_estimator(df_trials, X, y, grid=XGB_PARAM_GRID):
+    """
+    XGBRegressor with the best trial of successive_halving refit on X, y
+    """
+    n_estimators = int(df_trials.iloc[0]["n_rounds"])
+    return xgb.XGBRegressor(**BASE_PARAMS, **best_params(df_trials, grid), n_estimators=n_estimators).fit(X, y)
@@ -0,0 +1,75 @@
+"""
+ReviewClusterer (sparse TF-IDF + MiniBatchKMeans, vocabulary or hashing) against the
+TfidfVectorizer(max_features=240) + KMeans(n_clusters=60) pipeline of 2_Modeling.ipynb
+
+Fit + predict time on synthetic reviews (see synthetic.py) and the adjusted Rand index of the
+clusters with the topics the reviews were generated from.
+
+Usage (from recommendation_task):
+    python benchmarks/bench_clustering.py --reviews 200000 --features 10000 --clusters 300
+    python benchmarks/bench_clustering.py --reviews 2000000 --skip-notebook
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.cluster import KMeans  # noqa: E402
+from sklearn.metrics import adjusted_rand_score  # noqa: E402
+from sklearn.pipeline import Pipeline  # noqa: E402
+
+from clustering import STOP_WORDS, ReviewClusterer  # noqa: E402
+from sklearn.feature_extraction.text import TfidfVectorizer  # noqa: E402
+from synthetic import make_reviews  # noqa: E402
+
+
+def notebook_pipeline(texts):
+    pipeline = Pipeline(
+        steps=[
+            ("tfidf", TfidfVectorizer(lowercase=True, max_features=240, stop_words=STOP_WORDS)),
+            ("model", KMeans(n_clusters=60, n_init=10)),
+        ]
+    )
+    model = pipeline.fit(texts)
+    return model.predict(texts)
+
+
+def report(name, seconds, labels, topics):
+    print(f"{name:<28} {seconds:8.1f} s   ARI with topics {adjusted_rand_score(topics, labels):.3f}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=200_000)
+    parser.add_argument("--topics", type=int, default=100)
+    parser.add_argument("--features", type=int, default=10_000, help="vocabulary size of ReviewClusterer")
+    parser.add_argument("--clusters", type=int, default=300, help="clusters of ReviewClusterer")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="texts per partial_fit of the hashing mode")
+    parser.add_argument("--skip-notebook", action="store_true", help="do not run the notebook pipeline")
+    args = parser.parse_args()
+
+    df = make_reviews(args.reviews, n_listings=max(args.reviews // 20, args.topics), n_topics=args.topics)
+    texts = df["comments"]
+    print(f"{len(df)} reviews, {args.topics} topics")
+
+    if not args.skip_notebook:
+        start = time.perf_counter()
+        labels = notebook_pipeline(texts)
+        report("notebook (240 / 60)", time.perf_counter() - start, labels, df["topic"])
+
+    start = time.perf_counter()
+    clusterer = ReviewClusterer(n_clusters=args.clusters, max_features=args.features).fit(texts)
+    labels = clusterer.predict(texts)
+    report(f"tfidf ({args.features} / {args.clusters})", time.perf_counter() - start, labels, df["topic"])
+
+    start = time.perf_counter()
+    clusterer = ReviewClusterer(n_clusters=args.clusters, vectorizer="hashing")
+    clusterer.fit_chunks(texts[i : i + args.chunk_size] for i in range(0, len(texts), args.chunk_size))
+    labels = clusterer.predict(texts)
+    report(f"hashing ({2**16} / {args.clusters})", time.perf_counter() - start, labels, df["topic"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Daily updates of OnlineRecommender (assign + running-mean centroids + index update) against a full
+refit on all reviews, on synthetic reviews (see synthetic.py): days with reviews like the fitted ones,
+then days with reviews in a new vocabulary (e.g. a new market), which raise the drift and trigger a refit
+on the first of them; the following days of the new vocabulary are measured against it and do not refit
+(with the fixed number of clusters the refit puts the small new market in one cluster, hence its ARI of 0)
+
+Usage (from recommendation_task):
+    python benchmarks/bench_online.py --reviews 500000 --daily 5000 --days 5
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd  # noqa: E402
+from sklearn.metrics import adjusted_rand_score  # noqa: E402
+
+from online import OnlineRecommender  # noqa: E402
+from synthetic import make_reviews  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=500_000, help="reviews of the initial fit")
+    parser.add_argument("--daily", type=int, default=5_000, help="new reviews per day")
+    parser.add_argument("--days", type=int, default=5, help="days of each kind of reviews")
+    parser.add_argument("--topics", type=int, default=60)
+    parser.add_argument("--clusters", type=int, default=60)
+    parser.add_argument("--features", type=int, default=10_000)
+    parser.add_argument("--threshold", type=float, default=1.2, help="refit_threshold")
+    args = parser.parse_args()
+
+    n_listings = max(args.reviews // 20, args.topics)
+    df = make_reviews(args.reviews, n_listings=n_listings, n_topics=args.topics)
+    start = time.perf_counter()
+    recommender = OnlineRecommender.fit(
+        df, refit_threshold=args.threshold, n_clusters=args.clusters, max_features=args.features
+    )
+    print(f"fit on {len(df)} reviews: {time.perf_counter() - start:.1f} s")
+
+    reviews = [df]
+    for day in range(2 * args.days):
+        new = make_reviews(args.daily, n_listings=n_listings, n_topics=args.topics, seed=1000 + day)
+        shifted = day >= args.days
+        if shifted:
+            new["comments"] = new["comments"].str.replace("w", "v")
+        reviews.append(new)
+        start = time.perf_counter()
+        refitted = recommender.update(new, load_reviews=lambda: pd.concat(reviews, ignore_index=True))
+        seconds = time.perf_counter() - start
+        ari = adjusted_rand_score(new["topic"], recommender.clusterer.predict(new["comments"]))
+        kind = "new vocabulary" if shifted else "fitted vocabulary"
+        drift = "refit" if refitted else f"drift {recommender.drift:.3f}"
+        print(f"day {day} ({kind}): update {seconds:5.2f} s, ARI with topics {ari:.3f}, {drift}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Latency and recall@k of the IVF ranking (ranking.ListingRanker) against brute-force cosine, over all
+listings and within the unseen listings of the reviewer's cluster, on synthetic reviews (see synthetic.py)
+
+Usage (from recommendation_task):
+    python benchmarks/bench_ranking.py --reviews 200000 --listings 20000 --k 10
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from clustering import ReviewClusterer  # noqa: E402
+from ranking import ListingRanker, profiles, recall_at_k  # noqa: E402
+from recommend_index import RecommendationIndex  # noqa: E402
+from synthetic import make_reviews  # noqa: E402
+
+
+def latency_ms(index, queries, k, candidates, exact):
+    start = time.perf_counter()
+    for i in range(queries.shape[0]):
+        index.query(queries[i], k, None if candidates is None else candidates[i], exact=exact)
+    return (time.perf_counter() - start) / queries.shape[0] * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=200_000)
+    parser.add_argument("--listings", type=int, default=20_000)
+    parser.add_argument("--topics", type=int, default=60)
+    parser.add_argument("--clusters", type=int, default=60)
+    parser.add_argument("--features", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, default=8)
+    parser.add_argument("--exact-below", type=int, default=1000, help="0: IVF for every query")
+    args = parser.parse_args()
+
+    df = make_reviews(args.reviews, n_listings=args.listings, n_topics=args.topics)
+    clusterer = ReviewClusterer(n_clusters=args.clusters, max_features=args.features).fit(df["comments"])
+    df["Cluster"] = clusterer.predict(df["comments"])
+    recommendation_index = RecommendationIndex.from_reviews(df)
+
+    start = time.perf_counter()
+    ranker = ListingRanker.from_reviews(df, clusterer, n_probe=args.n_probe, exact_below=args.exact_below)
+    print(f"{len(ranker.listing_ids)} listings, IVF index built in {time.perf_counter() - start:.1f} s")
+
+    reviewer_ids, queries = profiles(clusterer.transform(df["comments"]), df["reviewer_id"].to_numpy())
+    sample = np.random.default_rng(0).choice(len(reviewer_ids), min(args.queries, len(reviewer_ids)), replace=False)
+    reviewer_ids, queries = reviewer_ids[sample], queries[sample]
+    in_cluster = [
+        ranker.positions(
+            np.setdiff1d(
+                recommendation_index.listings(recommendation_index.clusters(reviewer_id)[0]),
+                recommendation_index.seen(reviewer_id),
+            )
+        )
+        for reviewer_id in reviewer_ids
+    ]
+
+    for name, candidates in [("all listings", None), ("unseen in cluster", in_cluster)]:
+        t_exact = latency_ms(ranker.index, queries, args.k, candidates, exact=True)
+        t_ivf = latency_ms(ranker.index, queries, args.k, candidates, exact=False)
+        recall = recall_at_k(ranker.index, queries, args.k, candidates)
+        print(f"{name:<18} brute force {t_exact:7.3f} ms   IVF {t_ivf:7.3f} ms   recall@{args.k} {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Requests/sec of RecommendationIndex.suggest (in memory and memory-mapped) against suggest_listings of
+2_Modeling.ipynb on synthetic reviews (see synthetic.py), with the topic of a listing as its cluster
+
+Usage (from recommendation_task):
+    python benchmarks/bench_recommend_index.py --reviews 1000000 --requests 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from recommend_index import RecommendationIndex  # noqa: E402
+from synthetic import make_reviews  # noqa: E402
+
+
+def suggest_listings(df, reviewer_id):
+    # 2_Modeling.ipynb (sampling from a sorted list, sampling from a set fails on Python >= 3.11)
+    list_seen_listings = set(df[df["reviewer_id"] == reviewer_id]["listing_id"].values)
+    cluster = df[df["reviewer_id"] == reviewer_id]["Cluster"].values[0]
+    list_cluster_listings = set(df[df["Cluster"] == cluster]["listing_id"].values)
+    return random.sample(sorted(list_cluster_listings.difference(list_seen_listings)), 3)
+
+
+def requests_per_second(suggest, reviewer_ids):
+    start = time.perf_counter()
+    for reviewer_id in reviewer_ids:
+        suggest(reviewer_id)
+    return len(reviewer_ids) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", type=int, default=1_000_000)
+    parser.add_argument("--topics", type=int, default=60)
+    parser.add_argument("--requests", type=int, default=100_000)
+    parser.add_argument("--notebook-requests", type=int, default=20, help="requests of the notebook version")
+    args = parser.parse_args()
+
+    df = make_reviews(args.reviews, n_listings=max(args.reviews // 20, args.topics), n_topics=args.topics)
+    df["Cluster"] = df["topic"]
+    rng = np.random.default_rng(0)
+    reviewer_ids = rng.choice(df["reviewer_id"].unique(), args.requests).tolist()
+
+    start = time.perf_counter()
+    index = RecommendationIndex.from_reviews(df, seed=0)
+    print(f"{len(df)} reviews, index built in {time.perf_counter() - start:.2f} s")
+
+    notebook_ids = reviewer_ids[: args.notebook_requests]
+    rps = requests_per_second(lambda reviewer_id: suggest_listings(df, reviewer_id), notebook_ids)
+    print(f"notebook suggest_listings  {rps:12.1f} requests/s")
+    print(f"index in memory            {requests_per_second(index.suggest, reviewer_ids):12.1f} requests/s")
+    with tempfile.TemporaryDirectory() as tmp:
+        index.save(tmp)
+        mapped = RecommendationIndex.load(tmp, mmap=True, seed=0)
+        print(f"index memory-mapped        {requests_per_second(mapped.suggest, reviewer_ids):12.1f} requests/s")
+        del mapped
+
+
+if __name__ == "__main__":
+    main()
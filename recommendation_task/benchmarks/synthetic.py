@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+
+def make_reviews(
+    n_reviews=100_000,
+    n_listings=5_000,
+    n_reviewers=50_000,
+    n_topics=50,
+    vocab_size=20_000,
+    words_per_review=40,
+    seed=42,
+):
+    """
+    Synthetic data shaped like review_listings_merged.csv: every listing has a topic, its reviews
+    draw their words mostly from the (Zipf-distributed) words of the topic and partly from common words
+
+    Args:
+        n_reviews (int): number of (listing, reviewer) rows
+        n_listings (int): number of listings
+        n_reviewers (int): number of reviewers
+        n_topics (int): number of topics
+        vocab_size (int): number of distinct words
+        words_per_review (int): words per review text
+        seed (int): random seed
+
+    Returns:
+        DataFrame with listing_id, reviewer_id, comments and topic (the topic of the listing)
+    """
+    rng = np.random.default_rng(seed)
+    vocab = np.array([f"w{i}" for i in range(vocab_size)])
+    listing_topic = rng.integers(0, n_topics, n_listings)
+    # popular listings and active reviewers get more reviews
+    listing_weights = 1.0 / np.arange(1, n_listings + 1) ** 0.5
+    listings = rng.choice(n_listings, size=n_reviews, p=listing_weights / listing_weights.sum())
+    reviewer_weights = 1.0 / np.arange(1, n_reviewers + 1) ** 0.8
+    reviewers = rng.choice(n_reviewers, size=n_reviews, p=reviewer_weights / reviewer_weights.sum())
+
+    topics = listing_topic[listings]
+    ranks = np.minimum(rng.zipf(1.3, size=(n_reviews, words_per_review)) - 1, vocab_size - 1)
+    topic_words = (ranks + topics[:, None] * (vocab_size // n_topics)) % vocab_size
+    common = rng.random((n_reviews, words_per_review)) < 0.3
+    words = vocab[np.where(common, ranks, topic_words)]
+    return pd.DataFrame(
+        {
+            "listing_id": 10_000_000 + listings,
+            "reviewer_id": 1_000_000 + reviewers,
+            "comments": [" ".join(row) for row in words],
+            "topic": topics,
+        }
+    )
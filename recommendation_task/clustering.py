@@ -0,0 +1,170 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+STOP_WORDS = list(ENGLISH_STOP_WORDS)
+# rows transformed at once by predict, bounds the memory of the sparse matrix
+PREDICT_CHUNK = 100_000
+
+
+class HashingTfidf:
+    """
+    TF-IDF on hashed tokens (HashingVectorizer), for texts that arrive in chunks
+
+    The hashing needs no vocabulary, the only state are the document frequencies per hash bucket,
+    which partial_fit adds up chunk by chunk. The weights are those of TfidfVectorizer
+    (smooth idf, l2 normalised rows) with the vocabulary replaced by n_features hash buckets.
+    """
+
+    def __init__(self, n_features=2**16, stop_words=STOP_WORDS, dtype=np.float32):
+        """
+        Args:
+            n_features (int): number of hash buckets
+            stop_words (list(str)): words to drop
+            dtype: dtype of the TF-IDF matrix
+        """
+        self.n_features = n_features
+        self.hasher = HashingVectorizer(
+            n_features=n_features, alternate_sign=False, norm=None, stop_words=stop_words, dtype=dtype
+        )
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self.n_docs = 0
+
+    def _add_counts(self, counts):
+        # the column indices of a CSR row are unique, so a bincount gives the document frequency
+        self.doc_freq += np.bincount(counts.indices, minlength=self.n_features)
+        self.n_docs += counts.shape[0]
+
+    def _weight(self, counts):
+        idf = np.log((1 + self.n_docs) / (1 + self.doc_freq)) + 1
+        return normalize(counts @ sp.diags(idf.astype(counts.dtype)), copy=False)
+
+    def partial_fit(self, texts):
+        self._add_counts(self.hasher.transform(texts))
+        return self
+
+    def fit(self, texts):
+        self.doc_freq[:] = 0
+        self.n_docs = 0
+        return self.partial_fit(texts)
+
+    def partial_fit_transform(self, texts):
+        """
+        Add texts to the document frequencies and return their TF-IDF matrix (one hashing pass)
+        """
+        counts = self.hasher.transform(texts)
+        self._add_counts(counts)
+        return self._weight(counts)
+
+    def fit_transform(self, texts):
+        self.doc_freq[:] = 0
+        self.n_docs = 0
+        return self.partial_fit_transform(texts)
+
+    def transform(self, texts):
+        return self._weight(self.hasher.transform(texts))
+
+
+def make_vectorizer(kind="tfidf", max_features=10_000, n_features=2**16):
+    """
+    Sparse float32 TF-IDF vectorizer without stop words
+
+    Args:
+        kind (str): "tfidf" (TfidfVectorizer with a vocabulary of the max_features most frequent
+            words, needs all texts in fit) or "hashing" (HashingTfidf, can be fitted chunk by chunk)
+        max_features (int): vocabulary size of "tfidf"
+        n_features (int): number of hash buckets of "hashing"
+    """
+    if kind == "tfidf":
+        return TfidfVectorizer(lowercase=True, max_features=max_features, stop_words=STOP_WORDS, dtype=np.float32)
+    if kind == "hashing":
+        return HashingTfidf(n_features=n_features)
+    raise ValueError(f"kind must be 'tfidf' or 'hashing', got {kind}")
+
+
+class ReviewClusterer:
+    """
+    TF-IDF + k-means clustering of review texts (the pipeline of 2_Modeling.ipynb) for large corpora
+
+    The TF-IDF matrix stays sparse (float32) end-to-end and MiniBatchKMeans updates the
+    centroids from batches of rows, so the cost per pass is linear in the number of non-zeros
+    instead of running full Lloyd iterations over all reviews with n_init restarts. Only the
+    dense centroids (n_clusters x n_features) are held in memory in addition to the matrix.
+    With vectorizer="hashing" the model is fitted chunk by chunk with partial_fit (the matrix of
+    all reviews never exists), the first chunk needs at least n_clusters reviews.
+
+    Example:
+        clusterer = ReviewClusterer(n_clusters=300).fit(df_reviews["comments"])
+        df_reviews["Cluster"] = clusterer.predict(df_reviews["comments"])
+    """
+
+    def __init__(
+        self,
+        n_clusters=300,
+        vectorizer="tfidf",
+        max_features=10_000,
+        n_features=2**16,
+        batch_size=4096,
+        n_init=3,
+        random_state=42,
+    ):
+        """
+        Args:
+            n_clusters (int): number of clusters
+            vectorizer (str): "tfidf" or "hashing", see make_vectorizer
+            max_features (int): vocabulary size of "tfidf"
+            n_features (int): number of hash buckets of "hashing"
+            batch_size (int): rows per mini-batch
+            n_init (int): number of initialisations of fit
+            random_state (int): random seed
+        """
+        self.vectorizer = make_vectorizer(vectorizer, max_features=max_features, n_features=n_features)
+        self.kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters, batch_size=batch_size, n_init=n_init, random_state=random_state
+        )
+
+    @property
+    def n_clusters(self):
+        return self.kmeans.n_clusters
+
+    def fit(self, texts):
+        """
+        Fit the vectorizer and the clusters on all texts
+        """
+        self.kmeans.fit(self.vectorizer.fit_transform(texts))
+        return self
+
+    def partial_fit(self, texts):
+        """
+        Update the document frequencies and the centroids with a chunk of texts (vectorizer="hashing" only)
+        """
+        if not isinstance(self.vectorizer, HashingTfidf):
+            raise ValueError("partial_fit needs vectorizer='hashing', the tfidf vocabulary is fixed by fit")
+        self.kmeans.partial_fit(self.vectorizer.partial_fit_transform(texts))
+        return self
+
+    def fit_chunks(self, chunks):
+        """
+        One partial_fit pass over an iterable of text chunks, e.g. of pd.read_csv(..., chunksize=...)
+        """
+        for texts in chunks:
+            self.partial_fit(texts)
+        return self
+
+    def transform(self, texts):
+        """
+        Sparse TF-IDF matrix of texts
+        """
+        return self.vectorizer.transform(texts)
+
+    def predict(self, texts, chunk_size=PREDICT_CHUNK):
+        """
+        Cluster of every text
+        """
+        labels = [
+            self.kmeans.predict(self.transform(texts[start : start + chunk_size]))
+            for start in range(0, len(texts), chunk_size)
+        ]
+        return np.concatenate(labels) if labels else np.array([], dtype=np.int32)
@@ -0,0 +1,196 @@
+import numpy as np
+import scipy.sparse as sp
+
+from clustering import ReviewClusterer
+from recommend_index import RecommendationIndex
+
+# rows assigned at once, bounds the dense (rows x n_clusters) score matrix
+ASSIGN_CHUNK = 20_000
+
+
+def assign(centers, X):
+    """
+    Nearest centroid (as kmeans.predict) and cosine distance to it of every row of X
+
+    Args:
+        centers (np.array): n_clusters x n_features centroids
+        X (sparse matrix): TF-IDF rows
+
+    Returns:
+        labels (np.array int32), cosine distances (np.array float64), 1 for rows without known words
+    """
+    labels = []
+    distances = []
+    center_norms = np.sqrt(np.einsum("ij,ij->i", centers, centers))
+    for start in range(0, X.shape[0], ASSIGN_CHUNK):
+        chunk = X[start : start + ASSIGN_CHUNK]
+        # the sparse x dense product is the only pass over the rows: |x - c|^2 = |x|^2 - 2 x.c + |c|^2
+        dots = np.asarray(chunk @ centers.T)
+        chunk_labels = (center_norms[None, :] ** 2 - 2 * dots).argmin(axis=1)
+        rows = np.arange(len(chunk_labels))
+        row_norms = np.sqrt(np.asarray(chunk.multiply(chunk).sum(axis=1)).ravel())
+        norms = np.maximum(row_norms * center_norms[chunk_labels], np.finfo(np.float32).tiny)
+        labels.append(chunk_labels.astype(np.int32))
+        distances.append(1 - dots[rows, chunk_labels] / norms)
+    if not labels:
+        return np.array([], dtype=np.int32), np.array([], dtype=np.float64)
+    return np.concatenate(labels), np.concatenate(distances).astype(np.float64)
+
+
+class OnlineRecommender:
+    """
+    ReviewClusterer + RecommendationIndex with daily updates instead of refits
+
+    New reviews are vectorised with the frozen vectorizer and assigned to the nearest centroid,
+    every centroid stays the mean of the reviews assigned to it (running mean with the review
+    count per cluster) and the index gets the new reviews with add_reviews. Listings without
+    reviews are assigned by their text (e.g. the description) and added to the index, their texts
+    are kept to assign them again after a refit.
+
+    The drift statistic is the mean cosine distance of the reviews added since the last fit to
+    their centroid, relative to a baseline: new topics that do not match any cluster and words
+    outside the vocabulary (a review without known words has distance 1) make it grow. Reviews
+    without known words do not move the centroids. update refits everything when the drift exceeds
+    refit_threshold. The baseline of the first fit is the distance of the fitted reviews, after a
+    refit of update it is the distance of the reviews that triggered it, so a lasting shift (e.g.
+    a new market) refits once and not every day because the whole corpus is still mostly the old
+    reviews.
+
+    Example:
+        recommender = OnlineRecommender.fit(df_reviews, n_clusters=300)
+        recommender.update(df_new_reviews, load_reviews=lambda: pd.read_csv(...))
+        recommender.index.suggest(1621287)
+    """
+
+    def __init__(self, clusterer, refit_threshold=1.2, text_col="comments"):
+        """
+        Args:
+            clusterer (ReviewClusterer): clusterer, fitted on the reviews passed to refit
+            refit_threshold (float): drift above which update refits
+            text_col (str): column of the review texts
+        """
+        self.clusterer = clusterer
+        self.refit_threshold = refit_threshold
+        self.text_col = text_col
+        self.index = None
+        self.listing_ids = np.array([], dtype=np.int64)
+        self.listing_texts = []
+
+    @classmethod
+    def fit(cls, df, refit_threshold=1.2, text_col="comments", seed=None, **clusterer_kwargs):
+        """
+        Fit the clusterer on all reviews of df and index them
+
+        Args:
+            df (pd.DataFrame): reviews with reviewer_id, listing_id and text_col
+            refit_threshold (float): drift above which update refits
+            text_col (str): column of the review texts
+            seed (int): seed of the sampling of the index
+            clusterer_kwargs: arguments of ReviewClusterer
+        """
+        recommender = cls(ReviewClusterer(**clusterer_kwargs), refit_threshold=refit_threshold, text_col=text_col)
+        return recommender.refit(df, seed=seed)
+
+    def refit(self, df, seed=None, baseline_reviews=None):
+        """
+        Refit the clusterer (vectorizer and centroids) on all reviews of df and rebuild the index,
+        listings added with add_listings are assigned again with the new clusters
+
+        Args:
+            df (pd.DataFrame): all reviews
+            seed (int): seed of the sampling of the index, the generator of the index is kept if None
+            baseline_reviews (pd.DataFrame): reviews of the drift baseline (e.g. the recent ones), df if None
+        """
+        centers = self.clusterer.fit(df[self.text_col]).kmeans.cluster_centers_
+        labels, distances = assign(centers, self.clusterer.transform(df[self.text_col]))
+        index = RecommendationIndex.from_reviews(df.assign(Cluster=labels), seed=seed)
+        if self.index is not None and seed is None:
+            index.rng = self.index.rng
+        if len(self.listing_ids):
+            listing_labels, _ = assign(centers, self.clusterer.transform(self.listing_texts))
+            index = index.add_listings(self.listing_ids, listing_labels)
+        self.index = index
+        self.counts = np.bincount(labels, minlength=self.clusterer.n_clusters).astype(np.int64)
+        if baseline_reviews is not None:
+            _, distances = assign(centers, self.clusterer.transform(baseline_reviews[self.text_col]))
+        self.baseline = float(distances.mean()) if len(distances) else 0.0
+        self.n_added = 0
+        self.added_distance = 0.0
+        return self
+
+    @property
+    def drift(self):
+        """
+        Mean cosine distance to the centroid of the reviews added since the last fit relative to the baseline
+        """
+        if self.n_added == 0 or self.baseline == 0:
+            return 1.0
+        return self.added_distance / self.n_added / self.baseline
+
+    def _update_centroids(self, X, labels):
+        """
+        Move every centroid to the mean of its reviews including the rows of X assigned to it
+        """
+        n_clusters = self.clusterer.n_clusters
+        known = X.getnnz(axis=1) > 0
+        X, labels = X[known], labels[known]
+        membership = sp.csr_matrix(
+            (np.ones(len(labels), dtype=X.dtype), (labels, np.arange(len(labels)))), shape=(n_clusters, X.shape[0])
+        )
+        sums = (membership @ X).toarray()
+        new_counts = np.bincount(labels, minlength=n_clusters)
+        counts = self.counts + new_counts
+        updated = new_counts > 0
+        centers = self.clusterer.kmeans.cluster_centers_
+        # predict of the clusterer uses the updated centroids as well
+        centers[updated] = (self.counts[updated, None] * centers[updated] + sums[updated]) / counts[updated, None]
+        self.counts = counts
+
+    def add_reviews(self, df):
+        """
+        Assign the reviews of df to the clusters, update the centroids and add the reviews to the index
+
+        Returns:
+            cluster of every review
+        """
+        X = self.clusterer.transform(df[self.text_col])
+        labels, distances = assign(self.clusterer.kmeans.cluster_centers_, X)
+        self._update_centroids(X, labels)
+        self.index = self.index.add_reviews(df.assign(Cluster=labels))
+        self.n_added += len(labels)
+        self.added_distance += float(distances.sum())
+        return labels
+
+    def add_listings(self, listing_ids, texts):
+        """
+        Add listings without reviews to the cluster of their text (e.g. name + description), the
+        centroids are not changed. The texts are kept, refit assigns the listings again.
+
+        Returns:
+            cluster of every listing
+        """
+        listing_ids = np.asarray(listing_ids, dtype=np.int64)
+        texts = list(texts)
+        labels, _ = assign(self.clusterer.kmeans.cluster_centers_, self.clusterer.transform(texts))
+        self.index = self.index.add_listings(listing_ids, labels)
+        self.listing_ids = np.concatenate([self.listing_ids, listing_ids])
+        self.listing_texts += texts
+        return labels
+
+    def update(self, df, load_reviews=None):
+        """
+        Daily update: add_reviews(df), then a full refit on load_reviews() if the drift exceeds refit_threshold,
+        the reviews of df are the baseline of the drift after the refit
+
+        Args:
+            df (pd.DataFrame): new reviews
+            load_reviews (callable): returns all reviews (including df) for a refit, no refit if None
+
+        Returns:
+            True if the model was refitted
+        """
+        self.add_reviews(df)
+        if load_reviews is None or self.drift <= self.refit_threshold:
+            return False
+        self.refit(load_reviews(), baseline_reviews=df)
+        return True
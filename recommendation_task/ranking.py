@@ -0,0 +1,200 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import normalize
+
+
+def profiles(X, keys):
+    """
+    TF-IDF profile per key (listing or reviewer): l2 normalised sum of the rows of its reviews
+
+    Args:
+        X (sparse matrix): TF-IDF rows of the reviews
+        keys (array): listing or reviewer id of every row
+
+    Returns:
+        sorted unique keys, CSR matrix with the profile of every key
+    """
+    unique_keys, codes = np.unique(np.asarray(keys), return_inverse=True)
+    membership = sp.csr_matrix(
+        (np.ones(len(codes), dtype=X.dtype), (codes, np.arange(len(codes)))), shape=(len(unique_keys), X.shape[0])
+    )
+    return unique_keys, normalize(membership @ X, copy=False).tocsr()
+
+
+class IVFIndex:
+    """
+    Inverted file (IVF) index for cosine similarity of sparse, l2 normalised vectors
+
+    The vectors are partitioned by MiniBatchKMeans into n_lists lists. A query scores the list
+    centroids, visits the lists in the order of their score and re-ranks the (allowed) vectors of
+    the visited lists by exact cosine. It visits at least n_probe lists and continues until
+    min_candidates allowed vectors are collected, so a query scores the n_lists centroids and
+    about n_probe / n_lists of the vectors instead of all of them. Queries restricted to at most
+    exact_below candidates (e.g. the listings of a small cluster) are exact, that is faster.
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, min_candidates=50, exact_below=1000, seed=42):
+        """
+        Args:
+            n_lists (int): number of lists, about sqrt(number of vectors) if None
+            n_probe (int): minimal number of visited lists
+            min_candidates (int): minimal number of re-ranked vectors
+            exact_below (int): brute-force queries with at most this number of candidates
+            seed (int): random seed of the k-means
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_candidates = min_candidates
+        self.exact_below = exact_below
+        self.seed = seed
+
+    def fit(self, vectors):
+        """
+        Index the rows of vectors (CSR matrix)
+        """
+        self.vectors = vectors.tocsr()
+        n_lists = self.n_lists or max(1, int(np.sqrt(self.vectors.shape[0])))
+        # a rough partition is enough, k-means++ on a small sample keeps the build fast
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_lists, batch_size=4096, n_init=1, init_size=10 * n_lists, random_state=self.seed
+        )
+        labels = kmeans.fit_predict(self.vectors)
+        self.centroids = np.ascontiguousarray(normalize(kmeans.cluster_centers_), dtype=np.float32)
+        self.list_members = np.argsort(labels, kind="stable")
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+        return self
+
+    def _probe(self, q, candidates):
+        """
+        Allowed rows of the lists nearest to the dense vector q
+        """
+        order = np.argsort(-(self.centroids @ q))
+        found = []
+        n_found = 0
+        for n_visited, lst in enumerate(order, start=1):
+            members = self.list_members[self.list_offsets[lst] : self.list_offsets[lst + 1]]
+            if candidates is not None:
+                pos = np.minimum(np.searchsorted(candidates, members), len(candidates) - 1)
+                members = members[candidates[pos] == members]
+            found.append(members)
+            n_found += len(members)
+            if n_visited >= self.n_probe and n_found >= self.min_candidates:
+                break
+        return np.concatenate(found)
+
+    def query(self, vector, k=10, candidates=None, exact=False):
+        """
+        Approximate top k rows by cosine similarity to vector
+
+        Args:
+            vector (sparse matrix or np.array): one l2 normalised row
+            k (int): number of results
+            candidates (np.array): sorted row positions allowed in the result, all rows if None
+            exact (bool): brute-force cosine over all candidates
+
+        Returns:
+            row positions and cosine similarities, best first
+        """
+        if candidates is not None and len(candidates) == 0:
+            return candidates, np.array([], dtype=np.float32)
+        # sparse matrix x dense vector products are much faster than sparse x sparse
+        q = np.asarray(vector.todense() if sp.issparse(vector) else vector, dtype=np.float32).ravel()
+        if exact or (candidates is not None and len(candidates) <= self.exact_below):
+            rows = np.arange(self.vectors.shape[0]) if candidates is None else candidates
+        else:
+            rows = self._probe(q, candidates)
+        scores = self.vectors[rows] @ q
+        top = np.argsort(-scores, kind="stable")[:k]
+        return rows[top], scores[top]
+
+
+def recall_at_k(index, queries, k=10, candidates=None):
+    """
+    Mean fraction of the exact top k (brute-force cosine) found by the approximate query
+
+    Args:
+        index (IVFIndex): fitted index
+        queries (sparse matrix): l2 normalised query rows
+        k (int): number of results
+        candidates (list(np.array)): allowed row positions per query, all rows if None
+    """
+    recalls = []
+    for i in range(queries.shape[0]):
+        allowed = None if candidates is None else candidates[i]
+        exact, _ = index.query(queries[i], k, allowed, exact=True)
+        if len(exact) == 0:
+            continue
+        approx, _ = index.query(queries[i], k, allowed)
+        recalls.append(len(np.intersect1d(exact, approx)) / len(exact))
+    return float(np.mean(recalls)) if recalls else float("nan")
+
+
+class ListingRanker:
+    """
+    Ranks candidate listings (e.g. the unseen listings of the user's cluster) by cosine similarity
+    of the user's TF-IDF review profile with the listing profiles, with an IVFIndex
+
+    Example:
+        clusterer = ReviewClusterer().fit(df_reviews["comments"])
+        ranker = ListingRanker.from_reviews(df_reviews, clusterer)
+        profile = ranker.profile(df_reviews.loc[df_reviews["reviewer_id"] == 1621287, "comments"])
+        ranker.suggest(index, 1621287, profile)
+    """
+
+    def __init__(self, vectorizer, listing_ids, index):
+        """
+        Args:
+            vectorizer: object with transform(texts) -> TF-IDF rows (e.g. a ReviewClusterer)
+            listing_ids (np.array): sorted listing ids, the rows of the index
+            index (IVFIndex): index of the listing profiles
+        """
+        self.vectorizer = vectorizer
+        self.listing_ids = listing_ids
+        self.index = index
+
+    @classmethod
+    def from_reviews(cls, df, vectorizer, text_col="comments", listing_col="listing_id", **index_kwargs):
+        """
+        Ranker of the listings of df with profiles from their review texts
+        """
+        listing_ids, vectors = profiles(vectorizer.transform(df[text_col]), df[listing_col].to_numpy())
+        return cls(vectorizer, listing_ids, IVFIndex(**index_kwargs).fit(vectors))
+
+    def profile(self, texts):
+        """
+        TF-IDF profile (one l2 normalised row) of the review texts of a user
+        """
+        return normalize(sp.csr_matrix(self.vectorizer.transform(texts).sum(axis=0)))
+
+    def positions(self, listing_ids):
+        """
+        Sorted index rows of listing_ids, unknown listings (without reviews) are dropped
+        """
+        listing_ids = np.unique(listing_ids)
+        positions = np.searchsorted(self.listing_ids, listing_ids)
+        known = positions < len(self.listing_ids)
+        known[known] = self.listing_ids[positions[known]] == listing_ids[known]
+        return positions[known]
+
+    def rank(self, profile, candidates=None, k=3, exact=False):
+        """
+        Top k of the candidate listing ids (all listings if None) for profile
+
+        Returns:
+            listing ids and cosine similarities, best first
+        """
+        positions = None if candidates is None else self.positions(candidates)
+        rows, scores = self.index.query(profile, k, positions, exact)
+        return self.listing_ids[rows], scores
+
+    def suggest(self, recommendation_index, reviewer_id, profile, k=3):
+        """
+        Best k unseen listings of the cluster of the reviewer (see RecommendationIndex.suggest)
+        """
+        clusters = recommendation_index.clusters(reviewer_id)
+        if len(clusters) == 0:
+            return []
+        candidates = np.setdiff1d(recommendation_index.listings(clusters[0]), recommendation_index.seen(reviewer_id))
+        listing_ids, _ = self.rank(profile, candidates, k)
+        return listing_ids.tolist()
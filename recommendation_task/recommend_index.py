@@ -0,0 +1,306 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# arrays of a RecommendationIndex, stored as <name>.npy
+INDEX_ARRAYS = [
+    "reviewer_ids",
+    "seen_offsets",
+    "seen_listings",
+    "cluster_offsets",
+    "reviewer_clusters",
+    "listing_offsets",
+    "cluster_listings",
+]
+
+
+def _offsets(codes, n):
+    """
+    CSR offsets of rows sorted by codes in [0, n)
+    """
+    return np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=n))]).astype(np.int64)
+
+
+def _rows(offsets):
+    """
+    Row of every value of CSR offsets, the inverse of _offsets
+    """
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+
+
+def _with_rows(ids, offsets_list, new_ids):
+    """
+    Sorted ids with the unknown new_ids inserted and every CSR offsets of offsets_list with empty rows for them
+    """
+    new_ids = np.unique(new_ids)
+    pos = np.searchsorted(ids, new_ids)
+    unknown = pos >= len(ids)
+    unknown[~unknown] = ids[pos[~unknown]] != new_ids[~unknown]
+    if not unknown.any():
+        return ids, offsets_list
+    # the old rows move down by the number of ids inserted before them
+    old_rows = np.arange(len(ids)) + np.searchsorted(new_ids[unknown], ids)
+    n_rows = len(ids) + int(unknown.sum())
+    expanded = []
+    for offsets in offsets_list:
+        counts = np.zeros(n_rows, dtype=np.int64)
+        counts[old_rows] = np.diff(offsets)
+        expanded.append(np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+    return np.insert(ids, pos[unknown], new_ids[unknown]), expanded
+
+
+def _merge_rows(offsets, values, rows, new_values, keep_order=False):
+    """
+    CSR offsets and values with new_values added to rows, without duplicates
+
+    Rows are sorted sets unless keep_order, then the new values are appended in their order
+    (after the ones of the row). Only the values of the touched rows are sorted, the others are
+    moved as they are, so the cost is a copy of values plus the size of the touched rows.
+    """
+    touched = np.zeros(len(offsets) - 1, dtype=bool)
+    touched[rows] = True
+    old_rows = _rows(offsets)
+    in_touched = touched[old_rows]
+    # values of the touched rows (old ones first) with their row and position
+    pair_rows = np.concatenate([old_rows[in_touched], rows])
+    pair_values = np.concatenate([values[in_touched], new_values.astype(values.dtype)])
+    order = np.lexsort((np.arange(len(pair_values)), pair_values, pair_rows))
+    first = np.ones(len(order), dtype=bool)
+    sorted_rows, sorted_values = pair_rows[order], pair_values[order]
+    first[1:] = (sorted_rows[1:] != sorted_rows[:-1]) | (sorted_values[1:] != sorted_values[:-1])
+    order = order[first]
+    if keep_order:
+        order = order[np.lexsort((order, pair_rows[order]))]
+    counts = np.diff(offsets)
+    counts[touched] = 0
+    counts += np.bincount(pair_rows[order], minlength=len(counts))
+    new_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    merged = np.empty(new_offsets[-1], dtype=values.dtype)
+    kept = np.flatnonzero(~in_touched)
+    merged[new_offsets[old_rows[kept]] + kept - offsets[old_rows[kept]]] = values[kept]
+    # merged_rows is sorted, searchsorted gives the first position of each row
+    merged_rows = pair_rows[order]
+    rank = np.arange(len(order)) - np.searchsorted(merged_rows, merged_rows)
+    merged[new_offsets[merged_rows] + rank] = pair_values[order]
+    return new_offsets, merged
+
+
+class RecommendationIndex:
+    """
+    Precomputed lookups of suggest_listings of 2_Modeling.ipynb in compact arrays
+
+    Per reviewer (position in the sorted reviewer_ids) the seen listings and the clusters of
+    the reviews, per cluster its listings, each as one flat value array with CSR-like offsets:
+    the values of row i are values[offsets[i]:offsets[i + 1]]. A suggestion is a binary search
+    of the reviewer id and a few slices, the arrays can be memory-mapped from disk (load).
+
+    Example:
+        index = RecommendationIndex.from_reviews(df_reviews)
+        index.suggest(1621287)
+    """
+
+    def __init__(
+        self,
+        reviewer_ids,
+        seen_offsets,
+        seen_listings,
+        cluster_offsets,
+        reviewer_clusters,
+        listing_offsets,
+        cluster_listings,
+        seed=None,
+    ):
+        """
+        Args:
+            reviewer_ids (np.array): sorted reviewer ids
+            seen_offsets, seen_listings (np.array): sorted listings reviewed by each reviewer
+            cluster_offsets, reviewer_clusters (np.array): clusters of the reviews of each reviewer,
+                ordered by first review (the first one is the cluster used by the notebook)
+            listing_offsets, cluster_listings (np.array): sorted listings of each cluster
+            seed (int): seed of the sampling
+        """
+        self.reviewer_ids = reviewer_ids
+        self.seen_offsets = seen_offsets
+        self.seen_listings = seen_listings
+        self.cluster_offsets = cluster_offsets
+        self.reviewer_clusters = reviewer_clusters
+        self.listing_offsets = listing_offsets
+        self.cluster_listings = cluster_listings
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_reviews(cls, df, reviewer_col="reviewer_id", listing_col="listing_id", cluster_col="Cluster", seed=None):
+        """
+        Build the index from reviews with their cluster (df_reviews of 2_Modeling.ipynb)
+        """
+        reviewers = df[reviewer_col].to_numpy(dtype=np.int64)
+        listings = df[listing_col].to_numpy(dtype=np.int64)
+        clusters = df[cluster_col].to_numpy(dtype=np.int64)
+        return cls._from_pairs(reviewers, listings, reviewers, clusters, clusters, listings, seed=seed)
+
+    @classmethod
+    def _from_pairs(
+        cls, seen_reviewers, seen_listings, cluster_reviewers, clusters, listing_clusters, listings, seed=None
+    ):
+        """
+        Build the index from (reviewer, listing), (reviewer, cluster) and (cluster, listing) pairs,
+        the (reviewer, cluster) pairs in the order of the reviews
+        """
+        reviewer_ids = np.unique(seen_reviewers)
+        n_reviewers = len(reviewer_ids)
+        n_clusters = int(max(clusters.max(initial=-1), listing_clusters.max(initial=-1))) + 1
+
+        seen = pd.DataFrame({"code": np.searchsorted(reviewer_ids, seen_reviewers), "listing": seen_listings})
+        seen = seen.drop_duplicates().sort_values(by=["code", "listing"])
+        reviewer_clusters = pd.DataFrame(
+            {"code": np.searchsorted(reviewer_ids, cluster_reviewers), "cluster": clusters}
+        )
+        # stable sort keeps the order of the first review per reviewer
+        reviewer_clusters = reviewer_clusters.drop_duplicates().sort_values(by="code", kind="stable")
+        cluster_listings = pd.DataFrame({"cluster": listing_clusters, "listing": listings}).drop_duplicates()
+        cluster_listings = cluster_listings.sort_values(by=["cluster", "listing"])
+        return cls(
+            reviewer_ids,
+            _offsets(seen["code"].to_numpy(), n_reviewers),
+            seen["listing"].to_numpy(),
+            _offsets(reviewer_clusters["code"].to_numpy(), n_reviewers),
+            reviewer_clusters["cluster"].to_numpy(dtype=np.int32),
+            _offsets(cluster_listings["cluster"].to_numpy(), n_clusters),
+            cluster_listings["listing"].to_numpy(),
+            seed=seed,
+        )
+
+    def add_reviews(self, df, reviewer_col="reviewer_id", listing_col="listing_id", cluster_col="Cluster"):
+        """
+        New index with the reviews of df (with their cluster) added, the clusters of known
+        reviewers keep their order (the cluster of the first review stays the first one)
+
+        The new pairs are merged into the rows they touch and the other rows are copied, so it
+        costs a copy of the arrays plus O(new reviews), not a sort or a refit. Returns a new index,
+        so an index memory-mapped by load stays valid until it is replaced.
+        """
+        reviewers = df[reviewer_col].to_numpy(dtype=np.int64)
+        listings = df[listing_col].to_numpy(dtype=np.int64)
+        clusters = df[cluster_col].to_numpy(dtype=np.int64)
+        reviewer_ids, (seen_offsets, cluster_offsets) = _with_rows(
+            self.reviewer_ids, [self.seen_offsets, self.cluster_offsets], reviewers
+        )
+        codes = np.searchsorted(reviewer_ids, reviewers)
+        seen_offsets, seen_listings = _merge_rows(seen_offsets, self.seen_listings, codes, listings)
+        cluster_offsets, reviewer_clusters = _merge_rows(
+            cluster_offsets, self.reviewer_clusters, codes, clusters, keep_order=True
+        )
+        index = self.add_listings(listings, clusters)
+        index.reviewer_ids = reviewer_ids
+        index.seen_offsets, index.seen_listings = seen_offsets, seen_listings
+        index.cluster_offsets, index.reviewer_clusters = cluster_offsets, reviewer_clusters
+        return index
+
+    def add_listings(self, listing_ids, clusters):
+        """
+        New index with listings (e.g. without reviews) added to clusters, so suggest can return them
+        """
+        clusters = np.asarray(clusters, dtype=np.int64)
+        listing_offsets = self.listing_offsets
+        n_clusters = int(clusters.max(initial=-1)) + 1
+        if n_clusters > self.n_clusters:
+            listing_offsets = np.concatenate(
+                [listing_offsets, np.full(n_clusters - self.n_clusters, listing_offsets[-1], dtype=np.int64)]
+            )
+        listing_offsets, cluster_listings = _merge_rows(
+            listing_offsets, self.cluster_listings, clusters, np.asarray(listing_ids, dtype=np.int64)
+        )
+        index = RecommendationIndex(
+            self.reviewer_ids,
+            self.seen_offsets,
+            self.seen_listings,
+            self.cluster_offsets,
+            self.reviewer_clusters,
+            listing_offsets,
+            cluster_listings,
+        )
+        index.rng = self.rng
+        return index
+
+    @property
+    def n_clusters(self):
+        return len(self.listing_offsets) - 1
+
+    def position(self, reviewer_id):
+        """
+        Row of reviewer_id in the per-reviewer arrays, -1 for unknown reviewers
+        """
+        pos = int(np.searchsorted(self.reviewer_ids, reviewer_id))
+        if pos < len(self.reviewer_ids) and self.reviewer_ids[pos] == reviewer_id:
+            return pos
+        return -1
+
+    def seen(self, reviewer_id):
+        """
+        Listings reviewed by reviewer_id
+        """
+        pos = self.position(reviewer_id)
+        if pos < 0:
+            return self.seen_listings[:0]
+        return self.seen_listings[self.seen_offsets[pos] : self.seen_offsets[pos + 1]]
+
+    def clusters(self, reviewer_id):
+        """
+        Clusters of the reviews of reviewer_id, in the order of the first review per cluster
+        """
+        pos = self.position(reviewer_id)
+        if pos < 0:
+            return self.reviewer_clusters[:0]
+        return self.reviewer_clusters[self.cluster_offsets[pos] : self.cluster_offsets[pos + 1]]
+
+    def listings(self, cluster):
+        """
+        Listings of cluster
+        """
+        return self.cluster_listings[self.listing_offsets[cluster] : self.listing_offsets[cluster + 1]]
+
+    def suggest(self, reviewer_id, k=3, rng=None):
+        """
+        k random listings of the cluster of the reviewer's first review that the reviewer has not seen
+
+        As suggest_listings of 2_Modeling.ipynb, but fewer than k listings if the cluster has fewer
+        unseen listings and an empty list for unknown reviewers.
+        """
+        clusters = self.clusters(reviewer_id)
+        if len(clusters) == 0:
+            return []
+        return sample_unseen(self.listings(clusters[0]), self.seen(reviewer_id), k, rng or self.rng)
+
+    def save(self, path):
+        """
+        Store the index in directory path, one .npy file per array
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap=True, seed=None):
+        """
+        Load an index stored with save, memory-mapped (read-only) if mmap
+        """
+        mmap_mode = "r" if mmap else None
+        # plain ndarrays on the mapped buffers, slices of np.memmap are slower
+        arrays = [np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)) for name in INDEX_ARRAYS]
+        return cls(*arrays, seed=seed)
+
+
+def sample_unseen(candidates, seen, k, rng):
+    """
+    Uniform sample of k candidates not in the sorted array seen (all unseen ones in random order if there are fewer)
+
+    Draws k + len(seen) distinct candidates and drops the seen ones, so the cost does not depend
+    on the number of candidates.
+    """
+    n_draws = min(len(candidates), k + len(seen))
+    draws = candidates[rng.choice(len(candidates), n_draws, replace=False)]
+    if len(seen) > 0:
+        pos = np.minimum(np.searchsorted(seen, draws), len(seen) - 1)
+        draws = draws[seen[pos] != draws]
+    return draws[:k].tolist()